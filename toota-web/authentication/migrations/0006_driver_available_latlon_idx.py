@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("authentication", "0005_driver_physical_address_user_physical_address"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="driver",
+            index=models.Index(
+                fields=["is_available", "latitude", "longitude"],
+                name="driver_available_latlon_idx",
+            ),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -148,7 +149,7 @@ class Driver(AbstractCustomUser):
         if result['total_count'] > 0:
             self.average_rating = result['total_value'] / result['total_count']
             self.rating_count = result['total_count']
-        self.save()
+        self.save_fields("average_rating", "rating_count")
         
     groups = models.ManyToManyField(
         'auth.Group',
@@ -166,6 +167,12 @@ class Driver(AbstractCustomUser):
     )
     
     objects = BaseCustomUserManager()
+
+    class Meta:
+        indexes = [
+            # Bounding-box prefilter for nearest driver search
+            models.Index(fields=['is_available', 'latitude', 'longitude'], name='driver_available_latlon_idx'),
+        ]
     
     def __str__(self):
         return f"{self.email} - {self.vehicle_type}" if self.vehicle_type else self.email
@@ -177,15 +184,24 @@ class Driver(AbstractCustomUser):
             if Driver.objects.exclude(id=self.id).filter(vehicle_registration=self.vehicle_registration).exists():
                 raise ValidationError({'vehicle_registration': _("This vehicle registration number is already in use.")})
                 
-    def save(self, *args, **kwargs):
-        self.full_clean()  # Ensure clean() is called before saving
+    def save(self, *args, validate=True, **kwargs):
+        if validate:
+            self.full_clean()  # Ensure clean() is called before saving
         super().save(*args, **kwargs)
+
+    def save_fields(self, *fields):
+        """
+        Write only `fields` (plus updated_at), without full_clean(). For
+        internal state changes (availability, location, counters); profile
+        and KYC edits go through save() and stay validated.
+        """
+        self.save(update_fields={*fields, "updated_at"}, validate=False)
         
     def update_location(self, latitude, longitude):
         self.latitude = latitude
         self.longitude = longitude
         self.current_location = f"Latitude: {latitude}, Longitude: {longitude}"
-        self.save()
+        self.save_fields("latitude", "longitude", "current_location")
 
 
    
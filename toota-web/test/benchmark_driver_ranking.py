@@ -0,0 +1,58 @@
+"""
+Benchmark: ranking candidate drivers by distance.
+
+Compares the original per-driver geodesic loop in find_nearest_drivers with
+the vectorized haversine + argpartition ranking in trips.ranking.
+
+Run from the toota-web directory:
+    python -m test.benchmark_driver_ranking
+"""
+import time
+import numpy as np
+from geopy.distance import geodesic
+from trips.ranking import rank_nearest
+
+PICKUP = (-26.2041, 28.0473)  # Johannesburg
+LIMIT = 20
+
+
+def geodesic_loop(lats, lons):
+    drivers_with_distance = []
+    for i in range(len(lats)):
+        distance = geodesic(PICKUP, (lats[i], lons[i])).km
+        drivers_with_distance.append((i, distance))
+    return sorted(drivers_with_distance, key=lambda x: x[1])[:LIMIT]
+
+
+def timed(fn, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    rng = np.random.default_rng(42)
+    print(f"{'drivers':>8} {'geodesic loop':>15} {'numpy':>10} {'numpy+refine':>14} {'speedup':>9}")
+    for n in (1_000, 10_000, 100_000):
+        lats = PICKUP[0] + rng.uniform(-0.5, 0.5, n)
+        lons = PICKUP[1] + rng.uniform(-0.5, 0.5, n)
+        lats_list, lons_list = lats.tolist(), lons.tolist()
+
+        loop_s = timed(geodesic_loop, lats_list, lons_list, repeat=1 if n >= 100_000 else 3)
+        numpy_s = timed(lambda: rank_nearest(*PICKUP, lats_list, lons_list, LIMIT))
+        refine_s = timed(lambda: rank_nearest(*PICKUP, lats_list, lons_list, LIMIT, refine=True))
+
+        expected = [i for i, _ in geodesic_loop(lats_list, lons_list)] if n <= 10_000 else None
+        if expected is not None:
+            positions, _ = rank_nearest(*PICKUP, lats_list, lons_list, LIMIT, refine=True)
+            assert list(positions) == expected, "rankings differ"
+
+        print(f"{n:>8} {loop_s * 1000:>12.1f} ms {numpy_s * 1000:>7.2f} ms {refine_s * 1000:>11.2f} ms "
+              f"{loop_s / refine_s:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
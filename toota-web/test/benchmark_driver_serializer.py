@@ -0,0 +1,63 @@
+"""
+Benchmark: serializing a page of 20 driver search results.
+
+Compares FindDriversSerializer on model instances (the old path) with
+serialize_driver_rows on `.values()` rows (the find_nearest_drivers fast path).
+No database access is timed, only serialization.
+
+Run from the toota-web directory with the usual .env in place:
+    python -m test.benchmark_driver_serializer
+"""
+import os
+import time
+import uuid
+from decimal import Decimal
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "toota.settings")
+django.setup()
+
+from authentication.models import Driver  # noqa: E402
+from trips.serializers import (FindDriversSerializer, find_drivers_projection,  # noqa: E402
+                               serialize_driver_rows)
+
+PAGE = 20
+ROUNDS = 2000
+
+
+def make_drivers():
+    return [
+        Driver(
+            id=uuid.uuid4(), email=f"driver{i}@example.com", full_name=f"Driver {i}",
+            phone_number="+27821234567", average_rating=Decimal("4.50"), rating_count=12,
+            vehicle_type="bakkie", car_image="image/upload/v1/car.jpg",
+            current_location="Johannesburg", latitude=-26.2 + i / 1000, longitude=28.0,
+            rating=Decimal("4.50"), is_available=True, is_online=True, total_trips_completed=40,
+        )
+        for i in range(PAGE)
+    ]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn()
+    return (time.perf_counter() - start) / ROUNDS
+
+
+def main():
+    drivers = make_drivers()
+    fields, _ = find_drivers_projection()
+    rows = [{name: getattr(driver, name) for name in fields} for driver in drivers]
+
+    before = timed(lambda: [FindDriversSerializer(driver).data for driver in drivers])
+    after = timed(lambda: serialize_driver_rows(rows))
+
+    print(f"FindDriversSerializer:  {before * 1e3:8.2f} ms per {PAGE} drivers")
+    print(f"serialize_driver_rows:  {after * 1e3:8.2f} ms per {PAGE} drivers")
+    print(f"speedup:                {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,13 +5,19 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "toota.settings")
 django.setup()
 
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 from toota.middleware import JWTMiddleware  # Import custom JWT middleware
-from trips.routing import websocket_urlpatterns
+from trips.routing import channel_name_patterns, websocket_urlpatterns
+from trips.maps_client import close_maps_session_on_reactor_shutdown, maps_lifespan
+
+# Daphne has no ASGI lifespan support; close the Maps session from its reactor instead.
+close_maps_session_on_reactor_shutdown()
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),  # Handles HTTP requests
     "websocket": JWTMiddleware(
         URLRouter(websocket_urlpatterns)  # Handles WebSocket requests with JWT
     ),
+    "lifespan": maps_lifespan,  # Closes the shared Google Maps session on shutdown (uvicorn only)
+    "channel": ChannelNameRouter(channel_name_patterns),  # runworker trip-dispatch
 })
@@ -0,0 +1,46 @@
+"""
+Channel layer configuration.
+
+Two layers are used so each kind of traffic can be tuned separately:
+
+- "default" carries dispatch traffic: trip requests, acceptances and status
+  updates on the driver_{id}, user_{id} and trip_{id} groups. These must not
+  be lost, so they get a larger capacity and a longer expiry.
+- "locations" carries live driver positions on driver_{id} and user_{id}
+  (consumers opt in with channel_layer_alias = "locations"). A position is
+  stale within seconds, so that layer keeps little and expires it quickly.
+
+With Redis hosts configured both layers use channels_redis, which shards
+channels and groups across all hosts by consistent hashing. Without hosts
+they fall back to InMemoryChannelLayer, which only works within one process.
+"""
+
+DISPATCH = "default"
+LOCATIONS = "locations"
+
+
+def build_channel_layers(hosts, prefix="toota", dispatch_capacity=1000, dispatch_expiry=60,
+                         locations_capacity=100, locations_expiry=5, group_expiry=86400):
+    """Return a CHANNEL_LAYERS dict for the given Redis host URLs (possibly empty)."""
+    if not hosts:
+        return {
+            DISPATCH: {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+            LOCATIONS: {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+        }
+
+    def redis_layer(name, capacity, expiry):
+        return {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": list(hosts),
+                "prefix": f"{prefix}:{name}",
+                "capacity": capacity,
+                "expiry": expiry,
+                "group_expiry": group_expiry,
+            },
+        }
+
+    return {
+        DISPATCH: redis_layer("dispatch", dispatch_capacity, dispatch_expiry),
+        LOCATIONS: redis_layer("locations", locations_capacity, locations_expiry),
+    }
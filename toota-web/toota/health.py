@@ -0,0 +1,67 @@
+import asyncio
+import time
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.http import JsonResponse
+
+
+async def check_channel_layer(alias, timeout=2.0):
+    """
+    Round-trip a message through one channel layer. For channels_redis every
+    shard is pinged as well, since a single round trip only reaches one host.
+    """
+    started = time.monotonic()
+    layer = get_channel_layer(alias)
+    result = {"backend": type(layer).__name__}
+    try:
+        if hasattr(layer, "ring_size"):
+            await asyncio.wait_for(
+                asyncio.gather(*(layer.connection(index).ping() for index in range(layer.ring_size))),
+                timeout,
+            )
+            result["shards"] = layer.ring_size
+        channel = await layer.new_channel()
+        await layer.send(channel, {"type": "health.check"})
+        await asyncio.wait_for(layer.receive(channel), timeout)
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e) or type(e).__name__
+    result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+async def channel_layer_health(request):
+    """Health of every configured channel layer: 200 if all are reachable, else 503."""
+    aliases = list(settings.CHANNEL_LAYERS)
+    results = await asyncio.gather(*(check_channel_layer(alias) for alias in aliases))
+    layers = dict(zip(aliases, results))
+    healthy = all(layer["status"] == "ok" for layer in layers.values())
+    return JsonResponse({"healthy": healthy, "layers": layers}, status=200 if healthy else 503)
+
+
+def runtime_stats(request):
+    """
+    The in-process counters of this worker (location filtering, broadcast
+    suppression, Maps caching, dispatch), for scraping by monitoring. Each
+    server process reports only its own counters.
+    """
+    from trips.dead_reckoning import dead_reckoning
+    from trips.dispatch import dispatch_strategy
+    from trips.location_buffer import location_buffer
+    from trips.location_history import location_history
+    from trips.location_policy import location_policy
+    from trips.maps_cache import geocode_cache, reverse_geocode_cache, route_cache
+    from trips.maps_client import maps_breaker
+    from trips.utils import maps_single_flight
+
+    return JsonResponse({
+        "location_policy": location_policy.stats(),
+        "dead_reckoning": dead_reckoning.stats(),
+        "location_buffer": location_buffer.stats(),
+        "location_history": location_history.stats(),
+        "maps_caches": {cache.name: cache.stats() for cache in (route_cache, geocode_cache, reverse_geocode_cache)},
+        "maps_breaker": maps_breaker.stats(),
+        "maps_single_flight": maps_single_flight.stats(),
+        "dispatch": dispatch_strategy.stats(),
+    })
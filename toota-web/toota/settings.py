@@ -1,9 +1,10 @@
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import config, Csv
 import dj_database_url
 import cloudinary
 import os
+from .channel_layers import build_channel_layers
 
 # from rest_framework_simplejwt.settings import api_settings
 
@@ -164,12 +165,143 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator'},
 ]
 
-# Channels settings (single definition)
-CHANNEL_LAYERS = {
+# Channels settings (single definition, see toota/channel_layers.py).
+# Set CHANNEL_REDIS_HOSTS (comma-separated redis:// URLs, sharded) to run more than one worker.
+CHANNEL_LAYERS = build_channel_layers(
+    config('CHANNEL_REDIS_HOSTS', default='', cast=Csv()),
+    prefix=config('CHANNEL_LAYER_PREFIX', default='toota'),
+    dispatch_capacity=config('CHANNEL_DISPATCH_CAPACITY', default=1000, cast=int),
+    dispatch_expiry=config('CHANNEL_DISPATCH_EXPIRY_SECONDS', default=60, cast=int),
+    locations_capacity=config('CHANNEL_LOCATIONS_CAPACITY', default=100, cast=int),
+    locations_expiry=config('CHANNEL_LOCATIONS_EXPIRY_SECONDS', default=5, cast=int),
+)
+
+# Shared Django cache (driver profiles, "django" maps caches). Set CACHE_REDIS_URL whenever more than one
+# process serves traffic: the default LocMemCache is per process, so invalidations would not reach the others.
+CACHE_REDIS_URL = config('CACHE_REDIS_URL', default='')
+CACHES = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+        'KEY_PREFIX': config('CACHE_KEY_PREFIX', default='toota'),
+    } if CACHE_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Driver search: in-memory grid index of available drivers (see trips/driver_index.py)
+DRIVER_INDEX_CELL_DEGREES = config('DRIVER_INDEX_CELL_DEGREES', default=0.05, cast=float)  # ~5.5 km cells
+DRIVER_INDEX_RESYNC_SECONDS = config('DRIVER_INDEX_RESYNC_SECONDS', default=60, cast=int)
+# Re-measure the final top drivers with geodesic after the vectorized haversine ranking
+DRIVER_SEARCH_GEODESIC_REFINE = config('DRIVER_SEARCH_GEODESIC_REFINE', default=True, cast=bool)
+
+# Driver search mode: "index" (in-memory grid) or "database" (bounding box + haversine in SQL)
+DRIVER_SEARCH_MODE = config('DRIVER_SEARCH_MODE', default='index')
+# Initial search radius per Driver.vehicle_type, widened until enough drivers are found
+DRIVER_SEARCH_RADIUS_KM = {
+    'default': 10.0,
+    'motorBike': 5.0,
+    'scooter': 5.0,
+    'car': 8.0,
+    '4 ton truck': 20.0,
+    '8 ton truck': 30.0,
+}
+DRIVER_SEARCH_RADIUS_GROWTH = config('DRIVER_SEARCH_RADIUS_GROWTH', default=2.0, cast=float)
+DRIVER_SEARCH_MAX_RADIUS_KM = config('DRIVER_SEARCH_MAX_RADIUS_KM', default=50.0, cast=float)
+
+# Driver GPS pings are buffered in memory and written with one bulk_update per interval
+DRIVER_LOCATION_FLUSH_SECONDS = config('DRIVER_LOCATION_FLUSH_SECONDS', default=2.0, cast=float)
+DRIVER_LOCATION_FLUSH_BATCH_SIZE = config('DRIVER_LOCATION_FLUSH_BATCH_SIZE', default=500, cast=int)
+# Driver GPS pings closer together, shorter or faster than this are acknowledged but dropped
+DRIVER_LOCATION_MIN_INTERVAL_SECONDS = config('DRIVER_LOCATION_MIN_INTERVAL_SECONDS', default=2.0, cast=float)
+DRIVER_LOCATION_MIN_DISTANCE_METERS = config('DRIVER_LOCATION_MIN_DISTANCE_METERS', default=10.0, cast=float)
+DRIVER_LOCATION_MAX_SPEED_KMH = config('DRIVER_LOCATION_MAX_SPEED_KMH', default=200.0, cast=float)
+# Accept a "jump" once this many consecutive fixes agree on the new position (the old fix was the bad one)
+DRIVER_LOCATION_REANCHOR_FIXES = config('DRIVER_LOCATION_REANCHOR_FIXES', default=3, cast=int)
+# Passenger map updates: clients extrapolate along speed/heading; the server only broadcasts when
+# that prediction is off by more than the tolerance, or after the maximum silence
+DEAD_RECKONING_WINDOW = config('DEAD_RECKONING_WINDOW', default=4, cast=int)
+DEAD_RECKONING_TOLERANCE_METERS = config('DEAD_RECKONING_TOLERANCE_METERS', default=25.0, cast=float)
+DEAD_RECKONING_MAX_SILENCE_SECONDS = config('DEAD_RECKONING_MAX_SILENCE_SECONDS', default=10.0, cast=float)
+# Driver current_location (a paid reverse geocode) is refreshed at most this often, and only after this much movement
+DRIVER_ADDRESS_REFRESH_SECONDS = config('DRIVER_ADDRESS_REFRESH_SECONDS', default=300, cast=int)
+DRIVER_ADDRESS_REFRESH_METERS = config('DRIVER_ADDRESS_REFRESH_METERS', default=500, cast=int)
+# Append-only driver location history (trips.DriverLocationPoint), written on each location flush
+LOCATION_HISTORY_ENABLED = config('LOCATION_HISTORY_ENABLED', default=True, cast=bool)
+LOCATION_HISTORY_BATCH_SIZE = config('LOCATION_HISTORY_BATCH_SIZE', default=1000, cast=int)
+LOCATION_HISTORY_MAX_PENDING = config('LOCATION_HISTORY_MAX_PENDING', default=100000, cast=int)
+LOCATION_HISTORY_RETENTION_DAYS = config('LOCATION_HISTORY_RETENTION_DAYS', default=90, cast=int)
+
+# Static driver profile sent alongside location updates; invalidated when the driver's profile changes
+DRIVER_PROFILE_CACHE_ALIAS = config('DRIVER_PROFILE_CACHE_ALIAS', default='default')
+DRIVER_PROFILE_CACHE_TTL_SECONDS = config('DRIVER_PROFILE_CACHE_TTL_SECONDS', default=300, cast=int)
+
+# Trip dispatch (see trips/dispatch.py): offer to the nearest WAVE_SIZE drivers at once, each later wave
+# GROWTH times larger up to MAX_WAVE_SIZE; earlier offers stay open, first accept wins
+DISPATCH_WAVE_SIZE = config('DISPATCH_WAVE_SIZE', default=3, cast=int)
+DISPATCH_WAVE_GROWTH = config('DISPATCH_WAVE_GROWTH', default=2.0, cast=float)
+DISPATCH_MAX_WAVE_SIZE = config('DISPATCH_MAX_WAVE_SIZE', default=12, cast=int)
+DISPATCH_OFFER_TIMEOUT_SECONDS = config('DISPATCH_OFFER_TIMEOUT_SECONDS', default=15.0, cast=float)
+# Run dispatch in separate `python manage.py runworker trip-dispatch` processes (needs CHANNEL_REDIS_HOSTS);
+# otherwise the passenger's socket dispatches its own trips
+DISPATCH_WORKER = config('DISPATCH_WORKER', default=False, cast=bool)
+# A searching trip whose dispatcher has not checked in for this long may be taken over (see requeue_dispatches)
+DISPATCH_STALE_SECONDS = config('DISPATCH_STALE_SECONDS', default=60, cast=int)
+
+# Shared, pooled HTTP client for Google Maps calls (see trips/maps_client.py)
+# Point at a local trips.maps_stub server for offline tests and load tests
+MAPS_BASE_URL = config('MAPS_BASE_URL', default='https://maps.googleapis.com')
+MAPS_HTTP_MAX_CONNECTIONS = config('MAPS_HTTP_MAX_CONNECTIONS', default=100, cast=int)
+MAPS_HTTP_MAX_CONNECTIONS_PER_HOST = config('MAPS_HTTP_MAX_CONNECTIONS_PER_HOST', default=32, cast=int)
+MAPS_HTTP_DNS_CACHE_SECONDS = config('MAPS_HTTP_DNS_CACHE_SECONDS', default=300, cast=int)
+MAPS_HTTP_KEEPALIVE_SECONDS = config('MAPS_HTTP_KEEPALIVE_SECONDS', default=60, cast=int)
+MAPS_HTTP_TIMEOUT_SECONDS = config('MAPS_HTTP_TIMEOUT_SECONDS', default=10, cast=int)
+# Circuit breaker around Google Maps calls: open after N consecutive failures, retry after M seconds
+MAPS_BREAKER_FAILURE_THRESHOLD = config('MAPS_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+MAPS_BREAKER_RESET_SECONDS = config('MAPS_BREAKER_RESET_SECONDS', default=30, cast=int)
+# Local route estimate used while Maps is unavailable: haversine * road factor at an average speed
+ROUTE_ESTIMATE_ROAD_FACTOR = config('ROUTE_ESTIMATE_ROAD_FACTOR', default=1.3, cast=float)
+ROUTE_ESTIMATE_SPEED_KMH = {  # keyed by lowercased vehicle type
+    'default': 40.0,
+    'motorbike': 45.0,
+    'scooter': 40.0,
+    'car': 45.0,
+    'bakkie': 45.0,
+    '1 ton truck': 40.0,
+    '1.5 ton truck': 40.0,
+    '2 ton truck': 38.0,
+    '4 ton truck': 35.0,
+    '8 ton truck': 30.0,
+}
+# Per-driver route lookups for nearby driver lists: max in flight and overall budget
+ROUTE_LOOKUP_CONCURRENCY = config('ROUTE_LOOKUP_CONCURRENCY', default=5, cast=int)
+ROUTE_LOOKUP_DEADLINE_SECONDS = config('ROUTE_LOOKUP_DEADLINE_SECONDS', default=8, cast=float)
+
+# Google Maps result caches (see trips/maps_cache.py). BACKEND is "memory"
+# (per-process LRU) or "django" (the Django cache named by CACHE_ALIAS, e.g. Redis).
+MAPS_CACHES = {
+    'routes': {
+        'BACKEND': config('ROUTE_CACHE_BACKEND', default='memory'),
+        'CACHE_ALIAS': 'default',
+        'TTL_SECONDS': config('ROUTE_CACHE_TTL_SECONDS', default=120, cast=int),
+        'MAX_ENTRIES': 10000,
+        'GRID_METERS': config('ROUTE_CACHE_GRID_METERS', default=50, cast=int),
+    },
+    'geocodes': {
+        'BACKEND': 'memory',
+        'TTL_SECONDS': 24 * 3600,
+        'MAX_ENTRIES': 5000,
+    },
+    'reverse_geocodes': {
+        'BACKEND': 'memory',
+        'TTL_SECONDS': 7 * 24 * 3600,
+        'MAX_ENTRIES': 20000,
+        'GRID_METERS': 25,
     },
 }
+# Geocodes are also persisted in trips.GeocodeResult
+GEOCODE_DB_TTL_SECONDS = config('GEOCODE_DB_TTL_SECONDS', default=90 * 24 * 3600, cast=int)
+GEOCODE_NEGATIVE_TTL_SECONDS = config('GEOCODE_NEGATIVE_TTL_SECONDS', default=3600, cast=int)
 
 
 LANGUAGE_CODE = 'en-us'
@@ -3,6 +3,7 @@ from django.urls import path, include, re_path
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from .health import channel_layer_health, runtime_stats
 
 # Use the production URL as the default for Swagger
 swagger_url = "https://toota-web.onrender.com/swagger/"
@@ -27,6 +28,8 @@ schema_view = get_schema_view(
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("health/channels/", channel_layer_health, name="channel-layer-health"),
+    path("health/stats/", runtime_stats, name="runtime-stats"),
     path("swagger/", schema_view.with_ui("swagger", cache_timeout=0), name="swagger-ui"),
     path("redoc/", schema_view.with_ui("redoc", cache_timeout=0), name="schema-redoc"),
     re_path(r"^swagger(?P<format>\.json|\.yaml)$", schema_view.without_ui(cache_timeout=0), name="schema-json"),
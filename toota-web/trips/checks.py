@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Warning, register
+
+
+@register()
+def check_shared_caches(app_configs, **kwargs):
+    """
+    Driver profiles are invalidated through the Django cache, so once the
+    channel layer spans processes the cache has to be shared as well.
+    """
+    layer = getattr(settings, 'CHANNEL_LAYERS', {}).get('default', {})
+    if "redis" not in layer.get("BACKEND", "").lower():
+        return []
+    alias = getattr(settings, 'DRIVER_PROFILE_CACHE_ALIAS', 'default')
+    if not isinstance(caches[alias], LocMemCache):
+        return []
+    return [Warning(
+        f"The driver profile cache '{alias}' is a per-process LocMemCache but the channel layer is on Redis.",
+        hint="Set CACHE_REDIS_URL so profile invalidations reach every process.",
+        id="trips.W001",
+    )]
@@ -0,0 +1,39 @@
+import pytest
+from authentication.models import Driver, User
+from payments.models import Payment
+from trips.maps_client import maps_breaker
+from trips.maps_cache import geocode_cache, reverse_geocode_cache, route_cache
+from trips.models import Trip
+
+
+@pytest.fixture
+def trip_setup(db):
+    user = User.objects.create_user(email="rider@example.com", password="testpass123")
+    driver = Driver.objects.create_user(
+        email="driver@example.com", password="testpass123", latitude=-26.2, longitude=28.0,
+        vehicle_type="bakkie", is_available=True, is_online=True
+    )
+    trip = Trip.objects.create(user=user, pickup="Sandton City", destination="Rosebank Mall",
+                               vehicle_type="Bakkie", accepted_fare=150)
+    Payment.objects.create(user=user, trip_id=trip.id, amount=150, currency="ZAR",
+                           payment_method="cash", status="pending")
+    return user, driver, trip
+
+
+@pytest.fixture
+def maps_caches():
+    """Empty Maps caches (and hit/miss counters), emptied again after the test."""
+    caches = (route_cache, geocode_cache, reverse_geocode_cache)
+    for cache in caches:
+        cache.clear()
+    yield caches
+    for cache in caches:
+        cache.clear()
+
+
+@pytest.fixture
+def breaker():
+    """The shared maps_breaker, restored to its previous state after the test."""
+    saved = dict(vars(maps_breaker))
+    yield maps_breaker
+    vars(maps_breaker).update(saved)
@@ -3,18 +3,29 @@ import logging
 from datetime import datetime
 from asgiref.sync import sync_to_async
 from channels.layers import get_channel_layer
-import re
 from asyncio import sleep, create_task
 import asyncio
+import time
+from channels.consumer import AsyncConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from authentication.models import User, Driver
 from .models import Trip
+from .driver_index import driver_index
 from channels.exceptions import StopConsumer
 from payments.models import Payment
 from django.db.models import Q
-from .utils import (get_google_route_data, find_nearest_drivers,
-                    is_peak_hour_or_festive, get_coordinates, reverse_geocode)
+from django.conf import settings
+from toota.channel_layers import LOCATIONS
+from .utils import (get_google_route_data, get_batch_route_data, gather_with_deadline, find_nearest_drivers,
+                    is_peak_hour_or_festive, get_coordinates, areverse_geocode,
+                    format_duration, route_summary)
+from .ranking import point_distance_km
+from .location_buffer import location_buffer
+from .location_policy import location_policy
+from .dead_reckoning import dead_reckoning
+from .driver_profile import aget_driver_profile, build_location_delta
+from .dispatch import DISPATCH_CHANNEL, TripDispatcher, dispatch_group, open_dispatch
 
 
 logger = logging.getLogger(__name__)
@@ -22,6 +33,8 @@ logger = logging.getLogger(__name__)
 
 class DriverLocationConsumer(AsyncWebsocketConsumer):
     """Updates the location of the driver in real-time."""
+    channel_layer_alias = LOCATIONS
+
     async def connect(self):
 
         if self.scope["user"].is_authenticated and await self.is_driver(self.scope["user"]):
@@ -53,10 +66,14 @@ class DriverLocationConsumer(AsyncWebsocketConsumer):
         # Cancel ping task if it exists and is still running
         if hasattr(self, 'ping_task') and not self.ping_task.done():
             self.ping_task.cancel()
+        if hasattr(self, 'location_task') and not self.location_task.done():
+            self.location_task.cancel()
+        if location_buffer.position(getattr(self, 'driver_id', None)) is not None:
+            await location_buffer.aflush()
         
         # Remove from channel group
-        if hasattr(self, 'user_group_name'):
-            await self.channel_layer.group_discard(self.driver_group_name, self.channel_name)
+        if hasattr(self, 'room_group_name'):
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
         
         logger.info(f"User disconnected with code: {close_code}")
 
@@ -68,10 +85,48 @@ class DriverLocationConsumer(AsyncWebsocketConsumer):
             latitude = data.get("latitude")
             longitude = data.get("longitude")
 
+            now = time.monotonic()
+            if not hasattr(self, 'location_jumps'):
+                self.location_jumps = []
+            reason = location_policy.check(getattr(self, 'last_fix', None), latitude, longitude, now,
+                                           jumps=self.location_jumps)
+            if reason is not None:
+                if reason == "too_close":
+                    await self.broadcast_stop(now)
+                # Acknowledge, but do not persist or broadcast.
+                await self.send(text_data=json.dumps({
+                    "type": "driver_location_update",
+                    "message": "location received",
+                    "ignored": reason,
+                }))
+                return
+            latitude, longitude = float(latitude), float(longitude)
+            self.last_fix = (latitude, longitude, now)
+            if not hasattr(self, 'motion_track'):
+                self.motion_track = dead_reckoning.new_track()
+            speed, heading = self.motion_track.add(latitude, longitude, now)
+
             self.driver.latitude = latitude
             self.driver.longitude = longitude
-            await self.save_driver(self.driver)
-            driver_info = await self.get_driver_details(self.driver)  # Returns payload of driver details
+            location_buffer.record(self.driver_id, latitude, longitude, speed=speed, heading=heading)
+            driver_index.sync_driver(self.driver)
+            self.schedule_current_location_update(latitude, longitude)
+            # Only the position changes per ping; listeners fetch the cached
+            # profile when profile_version changes.
+            profile_entry = await aget_driver_profile(self.driver_id)
+
+            # Passengers extrapolate from speed and heading, so only broadcast
+            # when that prediction drifts or the profile changed.
+            if (profile_entry["version"] == getattr(self, 'sent_profile_version', None)
+                    and not dead_reckoning.should_broadcast(self.motion_track, latitude, longitude, now)):
+                await self.send(text_data=json.dumps({
+                    "type": "driver_location_update",
+                    "message": "location updated successfully"
+                }))
+                return
+            dead_reckoning.mark_sent(self.motion_track, latitude, longitude, speed, heading, now)
+            self.sent_profile_version = profile_entry["version"]
+            driver_info = build_location_delta(self.driver, profile_entry, speed_kmh=speed, heading=heading)
 
             # Ensure message is serializable
             message = {
@@ -95,31 +150,62 @@ class DriverLocationConsumer(AsyncWebsocketConsumer):
             })
         )
 
+    async def broadcast_stop(self, now):
+        """
+        The driver is inside the dead band, so the ping was dropped. If the
+        last broadcast still had them moving, send one zero-speed update at
+        the last accepted fix so passengers stop extrapolating.
+        """
+        track = getattr(self, 'motion_track', None)
+        if track is None or not dead_reckoning.needs_stop_correction(track):
+            return
+        latitude, longitude, _ = self.last_fix
+        dead_reckoning.mark_sent(track, latitude, longitude, 0.0, None, now)
+        profile_entry = await aget_driver_profile(self.driver_id)
+        self.sent_profile_version = profile_entry["version"]
+        await self.channel_layer.group_send(self.room_group_name, {
+            "type": "driver_location_update",
+            "driver_details": build_location_delta(self.driver, profile_entry, speed_kmh=0.0, heading=None),
+        })
 
-    @database_sync_to_async
-    def is_driver(self, driver):
-        return Driver.objects.filter(id=driver.id).exists()
+
+    def schedule_current_location_update(self, latitude, longitude):
+        """
+        Refresh the driver's human-readable current_location in the
+        background. Reverse geocoding is a paid Maps call, so it runs at most
+        once at a time, and again only after DRIVER_ADDRESS_REFRESH_SECONDS
+        and DRIVER_ADDRESS_REFRESH_METERS of movement since the last one.
+        """
+        if latitude is None or longitude is None:
+            return
+        now = time.monotonic()
+        last = getattr(self, 'last_address_lookup', None)
+        if last is not None:
+            last_lat, last_lon, last_at = last
+            if now - last_at < getattr(settings, 'DRIVER_ADDRESS_REFRESH_SECONDS', 300):
+                return
+            moved_m = point_distance_km(last_lat, last_lon, latitude, longitude) * 1000
+            if moved_m < getattr(settings, 'DRIVER_ADDRESS_REFRESH_METERS', 500):
+                return
+        if hasattr(self, 'location_task') and not self.location_task.done():
+            return
+        self.last_address_lookup = (latitude, longitude, now)
+        self.location_task = asyncio.create_task(self.update_current_location(latitude, longitude))
+        self.location_task.add_done_callback(self._handle_task_result)
+
+    async def update_current_location(self, latitude, longitude):
+        address = await areverse_geocode(latitude, longitude)
+        if address:
+            self.driver.current_location = address
+            await self.save_current_location(self.driver.id, address)
 
     @database_sync_to_async
-    def save_driver(self, driver):
-        driver.save()
+    def save_current_location(self, driver_id, address):
+        Driver.objects.filter(id=driver_id).update(current_location=address)
 
     @database_sync_to_async
-    def get_driver_details(self, driver):
-        return {
-            "id": str(driver.id),
-            "name": f"{driver.first_name} {driver.last_name}",
-            "email": driver.email,
-            "phone": str(driver.phone_number),
-            "vehicle_type": driver.vehicle_type,
-            "rating": float(driver.average_rating),
-            "latitude": driver.latitude,
-            "longitude": driver.longitude,
-            "is_available": driver.is_available,
-            "profile_pic": driver.profile_pic.url if driver.profile_pic else None,
-            "car_images": [img.image.url for img in driver.car_images.all()],
-            "number_plate": driver.number_plate
-        }
+    def is_driver(self, driver):
+        return Driver.objects.filter(id=driver.id).exists()
 
     async def send_ping(self):
         try:
@@ -133,6 +219,8 @@ class DriverLocationConsumer(AsyncWebsocketConsumer):
 
 class UserGetLocationConsumer(AsyncWebsocketConsumer):
     """Gets the location of the driver and sends it to the user in real-time."""
+    channel_layer_alias = LOCATIONS
+
     async def connect(self):
         self.driver_id = self.scope["url_route"]["kwargs"]["driver_id"]
         self.driver_group_name = f"driver_{self.driver_id}"
@@ -164,7 +252,7 @@ class UserGetLocationConsumer(AsyncWebsocketConsumer):
             self.ping_task.cancel()
         
         # Remove from channel group
-        if hasattr(self, 'user_group_name'):
+        if hasattr(self, 'driver_group_name'):
             await self.channel_layer.group_discard(self.driver_group_name, self.channel_name)
         
         logger.info(f"User disconnected with code: {close_code}")
@@ -184,19 +272,26 @@ class UserGetLocationConsumer(AsyncWebsocketConsumer):
 
     async def driver_location_update(self, event):
         driver_details = event["driver_details"]
+        profile = None
+        if driver_details.get("profile_version") != getattr(self, 'profile_version', None):
+            profile_entry = await aget_driver_profile(driver_details["id"])
+            self.profile_version = profile_entry["version"]
+            profile = profile_entry["profile"]
         route_data = await asyncio.wait_for(
-                    get_google_route_data(self.user_latitude, self.user_longitude, driver_details['latitude'], driver_details['longitude']),
+                    get_google_route_data(self.user_latitude, self.user_longitude, driver_details['latitude'], driver_details['longitude'],
+                                          vehicle_type=driver_details['vehicle_type']),
                     timeout=20
                 )
-        driver_details["duration"] = route_data['duration']
-        driver_details["distance"] = route_data['distance']
-        
-        await self.send(
-            text_data=json.dumps({
-                "type": "driver_location_update",
-                "driver_details": event["driver_details"]
-            })
-        )
+        driver_details.update(route_summary(route_data))
+
+        message = {
+            "type": "driver_location_update",
+            "driver_details": driver_details
+        }
+        if profile is not None:
+            # Sent on the first update and whenever the profile changes.
+            message["driver_profile"] = profile
+        await self.send(text_data=json.dumps(message))
 
         await self.channel_layer.group_send(
             "user_{}".format(self.scope["user"].id),
@@ -224,6 +319,11 @@ class UserGetLocationConsumer(AsyncWebsocketConsumer):
 class TripRequestConsumer(AsyncWebsocketConsumer):
     """Handles trip requests from users in real-time."""
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Dispatches this socket's trips itself unless a dispatch worker does
+        self.dispatcher = TripDispatcher(self)
+
     async def connect(self):
         try:
             if self.scope["user"].is_authenticated and await self.is_user(self.scope['user']):
@@ -258,6 +358,9 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
         # Cancel ping task if it exists and is still running
         if hasattr(self, 'ping_task') and not self.ping_task.done():
             self.ping_task.cancel()
+
+        # An abandoned dispatch keeps its state and can be resumed by requeue_dispatches
+        self.dispatcher.cancel_all()
         
         # Remove from channel group
         if hasattr(self, 'user_group_name'):
@@ -288,51 +391,34 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
                     await self.send(text_data=json.dumps({
                         'error': 'Destination address is required'
                     }))
-                pickup_latitude, pickup_longitude = await asyncio.wait_for(
-                    get_coordinates(pickup), timeout=60
+                    return
+                # Geocode both ends concurrently
+                (pickup_latitude, pickup_longitude), (dest_latitude, dest_longitude) = await asyncio.gather(
+                    asyncio.wait_for(get_coordinates(pickup), timeout=60),
+                    asyncio.wait_for(get_coordinates(destination), timeout=15),
                 )
                 if not pickup_latitude or not pickup_longitude:
                     await self.send(text_data=json.dumps({"type": "error", "message": "Invalid pickup location"}))
                     return
 
-                dest_latitude, dest_longitude = await asyncio.wait_for(
-                    get_coordinates(destination), timeout=15
-                )
                 if not dest_latitude or not dest_longitude:
                     await self.send(text_data=json.dumps({"type": "error", "message": "Invalid destination location"}))
                     return
                 load_description = data.get("load_description", "")
 
                 route_data = await asyncio.wait_for(
-                    get_google_route_data(pickup_latitude, pickup_longitude, dest_latitude, dest_longitude),
+                    get_google_route_data(pickup_latitude, pickup_longitude, dest_latitude, dest_longitude,
+                                          vehicle_type=vehicle_type),
                     timeout=15
                 )
                 logger.info(route_data)
                 if not route_data:
                     await self.send(text_data=json.dumps({"type": "error", "message": "Failed to get route data"}))
-                distance = route_data['distance']
-                duration = route_data['duration']
-
-                def parse_duration_to_minutes(duration_str):
-                    try:
-                        hours = re.search(r"(\d+)\s*hour", duration_str)
-                        minutes = re.search(r"(\d+)\s*min", duration_str)
-                        seconds = re.search(r"(\d+)\s*sec", duration_str)
-                        total_minutes = 0.0
-                        if hours:
-                            total_minutes += float(hours.group(1)) * 60
-                        if minutes:
-                            total_minutes += float(minutes.group(1))
-                        if seconds:
-                            total_minutes += float(seconds.group(1)) / 60
-                        return total_minutes
-                    except Exception as e:
-                        logger.error(f"Failed to parse duration '{duration}': {e}")
-                        return 0.0
-
-                estimated_time_minutes = parse_duration_to_minutes(duration)
-
-                trip = await database_sync_to_async(Trip.objects.create)(
+                    return
+                distance = round(route_data['distance_meters'] / 1000, 2)
+                estimated_time_minutes = route_data['duration_seconds'] / 60
+
+                trip = Trip(
                     user=self.user,
                     vehicle_type=vehicle_type,
                     pickup=pickup,
@@ -344,6 +430,7 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
                     load_description=load_description
                 )
 
+                # Price the trip before inserting it, so creation is a single INSERT.
                 fare = trip.calculate_fare(distance, estimated_time_minutes, surge)
                 trip.accepted_fare = fare
                 await database_sync_to_async(trip.save)()
@@ -354,7 +441,10 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
                     "vehicle_type": vehicle_type,
                     "estimated_fare": fare,
                     "distance": distance,
-                    "estimated_time": duration,
+                    "estimated_time": format_duration(route_data['duration_seconds']),
+                    "estimated_time_seconds": route_data['duration_seconds'],
+                    # True when Maps was unavailable and distance/time (and so the fare) are a local estimate
+                    "estimated": bool(route_data.get("estimated")),
                     "status": "pending"
                 }
                 await self.send(text_data=json.dumps(response_data))
@@ -390,13 +480,10 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
                         }))
                         return
 
-                    # Get all available drivers for this trip
-                    available_drivers = await self.get_available_drivers(trip)
-                    
-                    if not available_drivers:
+                    if not await open_dispatch(trip.id):
                         await self.send(text_data=json.dumps({
                             "type": "error",
-                            "message": "No drivers available at the moment. Please try again later."
+                            "message": "Already searching for a driver for this trip"
                         }))
                         return
 
@@ -414,8 +501,15 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
                         }
                     }))
 
-                    # Start the automatic driver selection process
-                    await self.auto_select_driver(trip, available_drivers, payment)
+                    # Matching runs in the dispatch worker (or beside this consumer's
+                    # message loop) and reports back through dispatch_update.
+                    if getattr(settings, 'DISPATCH_WORKER', False):
+                        await self.channel_layer.send(DISPATCH_CHANNEL, {
+                            "type": "trip.confirmed",
+                            "trip_id": str(trip.id),
+                        })
+                    else:
+                        self.dispatcher.start(trip.id)
 
                 else:
                     await self.send(text_data=json.dumps({
@@ -436,150 +530,17 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
                     "message": "Failed to confirm trip"
                 }))
 
-    async def auto_select_driver(self, trip, available_drivers, payment):
-        """
-        Automatically prompt drivers one by one until one accepts the trip
-        """
-        trip_user = await sync_to_async(lambda: trip.user)()
-        user_details = await self.get_user_details(trip_user)
-        
-        for driver in available_drivers:
-            try:
-                # Check if driver is still available and online before sending request
-                current_driver = await self.get_driver(driver['id'])
-                if not current_driver or not current_driver.is_available or not current_driver.is_online:
-                    continue
-                
-                # Send trip request to driver
-                await self.channel_layer.group_send(
-                    f"driver_{driver['id']}",
-                    {
-                        "type": "trip_request_notification",
-                        "data": {
-                            "trip_id": str(trip.id),
-                            "pickup": trip.pickup,
-                            "destination": trip.destination,
-                            "vehicle_type": trip.vehicle_type,
-                            "load_description": trip.load_description,
-                            "user_info": user_details,
-                            "payment_info": {
-                                "payment_method": payment.payment_method,
-                                "payment_status": payment.status,
-                                "amount": float(payment.amount),
-                                "currency": payment.currency,
-                            }
-                        }
-                    }
-                )
-
-                # Wait for driver response with timeout
-                driver_accepted = await self.await_driver_response(
-                    trip_id=str(trip.id), 
-                    selected_driver_id=driver['id'],
-                    wait_time=30  # 30 seconds timeout per driver
-                )
-
-                if driver_accepted:
-                    # Driver accepted the trip
-                    driver_details = await self.get_driver_details(current_driver)
-                    
-                    await self.send(text_data=json.dumps({
-                        "type": "driver_assigned",
-                        "trip_id": str(trip.id),
-                        "status": "driver_assigned",
-                        "message": "Driver found and assigned to your trip!",
-                        "driver_info": driver_details,
-                        "payment_info": {
-                            "payment_method": payment.payment_method,
-                            "payment_status": payment.status,
-                            "amount": float(payment.amount),
-                            "currency": payment.currency,
-                        }
-                    }))
-                    return  # Exit the loop as we found a driver
-
-                # Driver declined or didn't respond, continue to next driver
-                
-            except Exception as e:
-                logger.error(f"Error requesting driver {driver['id']}: {e}")
-                continue
-
-        # If we reach here, no driver accepted the trip
-        await self.send(text_data=json.dumps({
-            "type": "no_driver_found",
-            "trip_id": str(trip.id),
-            "status": "no_driver_available",
-            "message": "No drivers are available to accept your trip at the moment. Please try again later."
-        }))
-
-    async def await_driver_response(self, trip_id: str, selected_driver_id: str, wait_time: int = 30):
-        """
-        Waits for a driver response for the given trip within wait_time seconds.
-        Returns True if driver accepted, False if declined/no response.
-        """
-        try:
-            # Wait asynchronously for the driver's response
-            await asyncio.sleep(wait_time)
-
-            # Re-fetch the trip to get the updated status
-            trip = await self.get_trip(trip_id)
-
-            # Check if trip status changed (driver responded)
-            if trip.status == "accepted":
-                logger.info(f"Driver {selected_driver_id} accepted trip {trip_id}")
-                return True
-            elif trip.status == "declined":
-                logger.info(f"Driver {selected_driver_id} declined trip {trip_id}")
-                # Reset trip status to pending for next driver attempt
-                trip.status = "pending"
-                trip.driver = None
-                await self.save_trip(trip)
-                return False
-            else:
-                # Still pending - driver didn't respond
-                logger.info(f"Driver {selected_driver_id} did not respond for trip {trip_id}")
-                # Reset the assigned driver for next attempt
-                trip.driver = None
-                await self.save_trip(trip)
-                return False
-
-        except asyncio.CancelledError:
-            logger.warning(f"Await driver response task cancelled for trip {trip_id}")
-            return False
-        except Exception as e:
-            logger.error(f"Error in await_driver_response for trip {trip_id}: {e}", exc_info=True)
-            return False
-
     async def trip_request_notification(self, event):
         await self.send(text_data=json.dumps({
             "type": "new_trip_request",
             "trip_details": event["data"]
         }))
 
-    async def trip_rejected(self, event):
-        trip_id = event.get("trip_id")
-        selected_driver_id = event.get("driver_id")
-        trip = await self.get_trip(trip_id)
-
-        if trip.status == "pending":
-            # Reset the assigned driver
-            trip.driver = None
-            await self.save_trip(trip)
-
-            # Get a fresh list of available drivers
-            available_drivers = await self.get_available_drivers(trip)
-
-            # Notify the rider to select another driver
-            await self.send(text_data=json.dumps({
-                "type": "select_new_driver",
-                "message": "Driver is not available. Please select another driver.",
-                "available_drivers": available_drivers
-            }))
-
-            logger.info(f"Driver {selected_driver_id} did not respond for trip {trip_id}. Trip reset.")
-        else:
-            logger.info(f"Driver {selected_driver_id} responded for trip {trip_id} with status '{trip.status}'.")
+    async def dispatch_update(self, event):
+        await self.send(text_data=json.dumps(event["data"]))
 
+    async def dispatch_answer(self, event):
+        self.dispatcher.answer(event["trip_id"], event["driver_id"], event["response"])
 
     async def trip_status_update(self, event):
         await self.send(text_data=json.dumps({
@@ -588,14 +549,6 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
             "status": event.get("status"),
         }))
 
-    @database_sync_to_async
-    def get_user_details(self, user):
-        return {
-            "id": str(user.id),
-            "name": f"{user.full_name}",
-            "phone": str(user.phone_number) if user.phone_number else None,
-        }
-
     @database_sync_to_async
     def is_user(self, user):
         return User.objects.filter(id=user.id).exists()
@@ -607,17 +560,6 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
         except Trip.DoesNotExist:
             return None
 
-    @database_sync_to_async
-    def get_driver(self, driver_id):
-        try:
-            return Driver.objects.get(id=driver_id)
-        except Driver.DoesNotExist:
-            return None
-
-    @database_sync_to_async
-    def save_trip(self, trip):
-        trip.save()
-
     @database_sync_to_async
     def get_trip_details(self, trip):
         return {
@@ -635,21 +577,6 @@ class TripRequestConsumer(AsyncWebsocketConsumer):
             "created_at": trip.created_at.isoformat() if hasattr(trip, 'created_at') else None
         }
 
-    @database_sync_to_async
-    def get_driver_details(self, driver):
-        return {
-            "id": str(driver.id),
-            "name": f"{driver.first_name} {driver.last_name}".strip() or driver.email,
-            "phone": str(driver.phone_number) if driver.phone_number else None,
-            "vehicle_type": driver.vehicle_type,
-            "rating": float(driver.rating) if driver.rating else None,
-        }
-
-    @database_sync_to_async
-    def get_available_drivers(self, trip):
-        drivers = find_nearest_drivers(trip.pickup_latitude, trip.pickup_longitude, [trip.vehicle_type])
-        return drivers
-
     @database_sync_to_async
     def get_payment_for_trip(self, trip_id):
         return (
@@ -738,15 +665,12 @@ class DriverTripConsumer(AsyncWebsocketConsumer):
             return
 
         if driver_response == "reject":
-            user_id = (await sync_to_async(lambda: trip.user.id)())
-            await self.channel_layer.group_send(
-                f"user_{user_id}",
-                {
-                    "type": "trip_rejected",
-                    "trip_id": str(trip.id),
-                    "driver_id": str(self.driver.id)
-                }
-            )
+            await self.channel_layer.group_send(dispatch_group(trip.id), {
+                "type": "dispatch.answer",
+                "trip_id": str(trip.id),
+                "driver_id": str(self.driver.id),
+                "response": "reject",
+            })
 
             await self.send(text_data=json.dumps({
                 "type": "trip_rejected",
@@ -754,7 +678,7 @@ class DriverTripConsumer(AsyncWebsocketConsumer):
             }))
 
         elif driver_response == "accept":
-            user_id = (await sync_to_async(lambda: trip.user.id)())
+            user_id = trip.user_id
 
             payment = await self.get_payment_for_trip(trip_id)
 
@@ -764,12 +688,14 @@ class DriverTripConsumer(AsyncWebsocketConsumer):
                 }))
                 return
 
-            trip.driver = self.driver
-            trip.status = "accepted"
-            self.driver.is_available = False
-
-            await self.save_driver(self.driver)
-            await self.save_trip(trip)
+            # Only one of the drivers offered this trip can win it
+            if trip.status != "pending" or trip.driver_id is not None or not await self.accept_trip(trip.id):
+                await self.send(text_data=json.dumps({
+                    "type": "trip_offer_cancelled",
+                    "trip_id": str(trip.id),
+                    "reason": "taken",
+                }))
+                return
 
             await self.channel_layer.group_send(
                 f"user_{user_id}",
@@ -779,6 +705,12 @@ class DriverTripConsumer(AsyncWebsocketConsumer):
                     "status": "accepted",
                 }
             )
+            await self.channel_layer.group_send(dispatch_group(trip.id), {
+                "type": "dispatch.answer",
+                "trip_id": str(trip.id),
+                "driver_id": str(self.driver.id),
+                "response": "accept",
+            })
             await self.send(text_data=json.dumps({"type": "trip_status_update", "message": f"Trip {trip.id} accepted"}))
 
         else:
@@ -796,6 +728,13 @@ class DriverTripConsumer(AsyncWebsocketConsumer):
             "trip_details": event["data"]
         }))
 
+    async def trip_offer_cancelled(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "trip_offer_cancelled",
+            "trip_id": event["trip_id"],
+            "reason": event["reason"],
+        }))
+
     @database_sync_to_async
     def get_trip(self, trip_id):
         try:
@@ -804,12 +743,8 @@ class DriverTripConsumer(AsyncWebsocketConsumer):
             return None
 
     @database_sync_to_async
-    def save_trip(self, trip):
-        trip.save()
-    
-    @database_sync_to_async
-    def save_driver(self, driver):
-        driver.save()
+    def accept_trip(self, trip_id):
+        return Trip.accept(trip_id, self.driver)
 
     @database_sync_to_async
     def get_available_drivers(self, trip):
@@ -910,8 +845,6 @@ class UpdateTripStatusConsumer(AsyncWebsocketConsumer):
         trip_status = data.get('status')
 
         if self.user_role == "driver":
-            await self.update_trip_status(trip_status)
-
             if trip_status == "arrived at pickup" and payment.payment_method == "cash" and payment.status == "pending":
                 await self.update_trip_status(trip_status)
                 await self.channel_layer.group_send(
@@ -946,7 +879,7 @@ class UpdateTripStatusConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def update_trip_status(self, status):
         self.trip.status = status
-        self.trip.save()
+        self.trip.save_fields("status")
 
     @database_sync_to_async
     def get_trip(self, trip_id):
@@ -987,6 +920,8 @@ class UpdateTripStatusConsumer(AsyncWebsocketConsumer):
 
 class UserGetAvailableDrivers(AsyncWebsocketConsumer):
     """Handles requests for available drivers in real-time."""
+    channel_layer_alias = LOCATIONS
+
 
     async def connect(self):
         try:
@@ -1059,25 +994,8 @@ class UserGetAvailableDrivers(AsyncWebsocketConsumer):
             }))
             return
 
-        # Process driver data with proper error handling
-        nearest_drivers = []
-        for driver in drivers:
-            print(driver)
-            try:
-                # Now we can call the async function directly
-                route_data = await asyncio.wait_for(
-                    get_google_route_data(user_latitude, user_longitude, driver['latitude'], driver['longitude']),
-                    timeout=20  # 5-second timeout per request
-                )
-                nearest_drivers.append({
-                    "driver": driver,
-                    "route_data": route_data
-                })
-            except asyncio.TimeoutError:
-                logger.warning(f"Timeout getting route data for driver ")
-            except Exception as e:
-                logger.error(f"Error processing driver: {e}", exc_info=True)
-        
+        nearest_drivers = await self.get_drivers_with_route_data(user_latitude, user_longitude, drivers)
+
         # Send results
         await self.send(text_data=json.dumps({
             "type": "nearest_drivers",
@@ -1093,24 +1011,8 @@ class UserGetAvailableDrivers(AsyncWebsocketConsumer):
 
         try:
             drivers = await sync_to_async(find_nearest_drivers)(user_lat, user_lon, vehicle_type)
-            
-            nearest_drivers = []
-            for driver in drivers:
-                try:
-                    # Now we can call the async function directly
-                    route_data = await asyncio.wait_for(
-                        get_google_route_data(user_latitude, user_longitude, driver['latitude'], driver['longitude']),
-                        timeout=20 
-                    )
-                    nearest_drivers.append({
-                        "driver": driver,
-                        "route_data": route_data
-                    })
-                except asyncio.TimeoutError:
-                    logger.warning(f"Timeout getting route data for driver {driver.id}")
-                except Exception as e:
-                    logger.error(f"Error processing driver {driver.id}: {e}", exc_info=True)
-            
+            nearest_drivers = await self.get_drivers_with_route_data(user_lat, user_lon, drivers)
+
             await self.send(text_data=json.dumps({
                 "type": "nearest_drivers",
                 "nearest_drivers": nearest_drivers
@@ -1118,6 +1020,57 @@ class UserGetAvailableDrivers(AsyncWebsocketConsumer):
         except Exception as e:
             logger.error(f"Error in send_driver_location: {e}", exc_info=True)
 
+    async def get_drivers_with_route_data(self, user_lat, user_lon, drivers):
+        """
+        Attach each driver's route to the user, fetched with one batched
+        Distance Matrix lookup instead of a Directions call per driver.
+
+        Drivers the batch could not answer fall back to concurrent
+        Directions lookups (bounded by ROUTE_LOOKUP_CONCURRENCY). Everything
+        shares one ROUTE_LOOKUP_DEADLINE_SECONDS budget; drivers whose
+        lookup misses it are dropped rather than holding up the list.
+        """
+        if not drivers:
+            return []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + getattr(settings, 'ROUTE_LOOKUP_DEADLINE_SECONDS', 8)
+
+        try:
+            routes = await asyncio.wait_for(
+                get_batch_route_data(
+                    [(driver['latitude'], driver['longitude']) for driver in drivers],
+                    user_lat, user_lon
+                ),
+                timeout=deadline - loop.time()
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Timeout getting batched route data for nearest drivers")
+            routes = [None] * len(drivers)
+
+        missing = [i for i, route_data in enumerate(routes) if route_data is None]
+        dropped = set()
+        if missing:
+            fetched = await gather_with_deadline(
+                (
+                    get_google_route_data(drivers[i]['latitude'], drivers[i]['longitude'], user_lat, user_lon,
+                                          vehicle_type=drivers[i]['vehicle_type'])
+                    for i in missing
+                ),
+                limit=getattr(settings, 'ROUTE_LOOKUP_CONCURRENCY', 5),
+                deadline=max(deadline - loop.time(), 0),
+            )
+            for position, i in enumerate(missing):
+                if position in fetched:
+                    routes[i] = fetched[position]
+                else:
+                    dropped.add(i)
+
+        return [
+            {"driver": driver, "route_data": route_summary(route_data)}
+            for i, (driver, route_data) in enumerate(zip(drivers, routes))
+            if i not in dropped
+        ]
+
     @database_sync_to_async
     def is_user(self, user):
         return User.objects.filter(id=user.id).exists()
@@ -1130,4 +1083,27 @@ class UserGetAvailableDrivers(AsyncWebsocketConsumer):
         except asyncio.CancelledError:
             pass
         except Exception as e:
-            logger.error(f"Ping loop stopped with error: {e}", exc_info=True)
\ No newline at end of file
+            logger.error(f"Ping loop stopped with error: {e}", exc_info=True)
+
+
+class DispatchWorkerConsumer(AsyncConsumer):
+    """
+    Runs trip dispatch outside the passengers' sockets when DISPATCH_WORKER
+    is on. Start any number of workers with
+
+        python manage.py runworker trip-dispatch
+
+    Each "trip.confirmed" message on that channel is handled by one worker,
+    which claims the trip's TripDispatch row and then receives the drivers'
+    answers on its own channel through the dispatch_{trip_id} group.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatcher = TripDispatcher(self)
+
+    async def trip_confirmed(self, event):
+        self.dispatcher.start(event["trip_id"])
+
+    async def dispatch_answer(self, event):
+        self.dispatcher.answer(event["trip_id"], event["driver_id"], event["response"])
@@ -0,0 +1,122 @@
+import math
+import threading
+from collections import deque
+from django.conf import settings
+from .ranking import EARTH_RADIUS_KM, initial_bearing, point_distance_km
+
+# Below this speed a driver is treated as stationary and has no heading.
+STATIONARY_KMH = 1.0
+
+
+def predict_position(latitude, longitude, speed_kmh, heading, elapsed_seconds):
+    """
+    Project a fix forward along `heading` at `speed_kmh` for
+    `elapsed_seconds` (great-circle destination point). Without motion the
+    position is returned unchanged.
+    """
+    if not speed_kmh or heading is None or elapsed_seconds <= 0:
+        return latitude, longitude
+    angular = speed_kmh * elapsed_seconds / 3600 / EARTH_RADIUS_KM
+    lat1, lon1, bearing = map(math.radians, (latitude, longitude, heading))
+    lat2 = math.asin(math.sin(lat1) * math.cos(angular) + math.cos(lat1) * math.sin(angular) * math.cos(bearing))
+    lon2 = lon1 + math.atan2(
+        math.sin(bearing) * math.sin(angular) * math.cos(lat1),
+        math.cos(angular) - math.sin(lat1) * math.sin(lat2),
+    )
+    return math.degrees(lat2), (math.degrees(lon2) + 540) % 360 - 180
+
+
+class MotionTrack:
+    """The last few accepted fixes of one driver connection."""
+
+    def __init__(self, window=4):
+        self.fixes = deque(maxlen=window)
+        self.last_sent = None  # (lat, lon, speed_kmh, heading, t) of the last broadcast
+
+    def add(self, latitude, longitude, now):
+        """
+        Record a fix and return (speed_kmh, heading) smoothed over the
+        window: total path length over elapsed time, and the bearing from
+        the oldest fix to this one.
+        """
+        self.fixes.append((latitude, longitude, now))
+        if len(self.fixes) < 2:
+            return None, None
+        first, last = self.fixes[0], self.fixes[-1]
+        elapsed = last[2] - first[2]
+        if elapsed <= 0:
+            return None, None
+        path_km = sum(
+            point_distance_km(a[0], a[1], b[0], b[1])
+            for a, b in zip(self.fixes, list(self.fixes)[1:])
+        )
+        speed_kmh = path_km / (elapsed / 3600)
+        if speed_kmh < STATIONARY_KMH:
+            return 0.0, None
+        return speed_kmh, initial_bearing(first[0], first[1], latitude, longitude)
+
+
+class DeadReckoningPolicy:
+    """
+    Decides which accepted fixes are broadcast to passengers.
+
+    Clients extrapolate the last broadcast position along its speed and
+    heading. A new fix is only broadcast when that prediction is off by more
+    than `tolerance_m` metres, or after `max_silence` seconds without one.
+    """
+
+    def __init__(self, window=4, tolerance_m=25.0, max_silence=10.0):
+        self.window = window
+        self.tolerance_m = tolerance_m
+        self.max_silence = max_silence
+        self._lock = threading.Lock()
+        self.broadcast = 0
+        self.suppressed = 0
+
+    def new_track(self):
+        return MotionTrack(self.window)
+
+    def should_broadcast(self, track, latitude, longitude, now):
+        send = self._should_broadcast(track, latitude, longitude, now)
+        with self._lock:
+            if send:
+                self.broadcast += 1
+            else:
+                self.suppressed += 1
+        return send
+
+    def _should_broadcast(self, track, latitude, longitude, now):
+        if track.last_sent is None:
+            return True
+        sent_lat, sent_lon, speed_kmh, heading, sent_at = track.last_sent
+        if now - sent_at >= self.max_silence:
+            return True
+        predicted = predict_position(sent_lat, sent_lon, speed_kmh, heading, now - sent_at)
+        return point_distance_km(*predicted, latitude, longitude) * 1000 > self.tolerance_m
+
+    def needs_stop_correction(self, track):
+        """
+        Whether a stationary (dead-banded) fix must be broadcast as a stop.
+        Those fixes never reach should_broadcast, so if the last broadcast
+        still had the driver moving, clients would extrapolate it forever.
+        """
+        moving = track.last_sent is not None and bool(track.last_sent[2])
+        if moving:
+            with self._lock:
+                self.broadcast += 1
+        return moving
+
+    @staticmethod
+    def mark_sent(track, latitude, longitude, speed_kmh, heading, now):
+        track.last_sent = (latitude, longitude, speed_kmh, heading, now)
+
+    def stats(self):
+        with self._lock:
+            return {"broadcast": self.broadcast, "suppressed": self.suppressed}
+
+
+dead_reckoning = DeadReckoningPolicy(
+    window=getattr(settings, 'DEAD_RECKONING_WINDOW', 4),
+    tolerance_m=getattr(settings, 'DEAD_RECKONING_TOLERANCE_METERS', 25.0),
+    max_silence=getattr(settings, 'DEAD_RECKONING_MAX_SILENCE_SECONDS', 10.0),
+)
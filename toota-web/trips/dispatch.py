@@ -0,0 +1,475 @@
+import asyncio
+import datetime
+import logging
+import threading
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from authentication.models import Driver
+from payments.models import Payment
+from .models import Trip, TripDispatch
+from .utils import find_nearest_drivers
+
+logger = logging.getLogger(__name__)
+
+# Channel consumed by `python manage.py runworker trip-dispatch` (see DispatchWorkerConsumer)
+DISPATCH_CHANNEL = "trip-dispatch"
+
+
+def dispatch_group(trip_id):
+    """Group the dispatcher of a trip listens on for drivers' answers."""
+    return f"dispatch_{trip_id}"
+
+
+class OpenOffers:
+    """The drivers holding an open offer for one trip, and their answers as they arrive."""
+
+    def __init__(self):
+        self.drivers = set()
+        self.answers = asyncio.Queue()
+
+    def add(self, driver_ids):
+        self.drivers.update(str(driver_id) for driver_id in driver_ids)
+
+    def answer(self, driver_id, response):
+        """Queue "accept"/"reject" from a driver. Returns False if they hold no open offer."""
+        driver_id = str(driver_id)
+        if driver_id not in self.drivers:
+            return False
+        self.answers.put_nowait((driver_id, response))
+        return True
+
+    async def first_accept(self, timeout):
+        """
+        The id of the first driver to accept within `timeout` seconds. None
+        once every open offer has been rejected, or when time runs out.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.drivers:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                driver_id, response = await asyncio.wait_for(self.answers.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+            if response == "accept":
+                return driver_id
+            self.drivers.discard(driver_id)
+        return None
+
+
+class DispatchStrategy:
+    """
+    How a confirmed trip is offered to the nearest drivers.
+
+    Offers go out in waves: the first reaches the `wave_size` nearest
+    drivers, each later wave `growth` times as many (at most
+    `max_wave_size`). Earlier offers stay open while later waves go out, and
+    the first driver to accept wins. A wave waits `offer_timeout` seconds, or
+    less once every open offer has been rejected. wave_size=1, growth=1 is
+    one driver at a time.
+    """
+
+    def __init__(self, wave_size=3, growth=2.0, max_wave_size=12, offer_timeout=15.0):
+        self.wave_size = max(1, wave_size)
+        self.growth = max(1.0, growth)
+        self.max_wave_size = max(self.wave_size, max_wave_size)
+        self.offer_timeout = offer_timeout
+        self._lock = threading.Lock()
+        self._waves = {}  # wave number -> {"offers", "matched", "match_seconds"}
+        self.trips = 0
+        self.matched = 0
+        self.unmatched = 0
+
+    def waves(self, drivers):
+        """Split the ranked driver list into successive waves."""
+        size, start = self.wave_size, 0
+        while start < len(drivers):
+            yield drivers[start:start + size]
+            start += size
+            size = min(self.max_wave_size, max(size, int(size * self.growth)))
+
+    def _wave(self, number):
+        return self._waves.setdefault(number, {"offers": 0, "matched": 0, "match_seconds": 0.0})
+
+    def record_offers(self, wave, count):
+        with self._lock:
+            self._wave(wave)["offers"] += count
+
+    def record_match(self, wave, seconds):
+        """A driver accepted during `wave`, `seconds` after dispatch started."""
+        with self._lock:
+            self.trips += 1
+            self.matched += 1
+            stats = self._wave(wave)
+            stats["matched"] += 1
+            stats["match_seconds"] += seconds
+
+    def record_no_match(self):
+        with self._lock:
+            self.trips += 1
+            self.unmatched += 1
+
+    def stats(self):
+        with self._lock:
+            waves = [
+                {
+                    "wave": number,
+                    "offers": wave["offers"],
+                    "matched": wave["matched"],
+                    "avg_time_to_match_seconds": (
+                        round(wave["match_seconds"] / wave["matched"], 3) if wave["matched"] else None
+                    ),
+                }
+                for number, wave in sorted(self._waves.items())
+            ]
+            match_seconds = sum(wave["match_seconds"] for wave in self._waves.values())
+            return {
+                "trips": self.trips,
+                "matched": self.matched,
+                "unmatched": self.unmatched,
+                "avg_time_to_match_seconds": round(match_seconds / self.matched, 3) if self.matched else None,
+                "waves": waves,
+            }
+
+
+dispatch_strategy = DispatchStrategy(
+    wave_size=getattr(settings, 'DISPATCH_WAVE_SIZE', 3),
+    growth=getattr(settings, 'DISPATCH_WAVE_GROWTH', 2.0),
+    max_wave_size=getattr(settings, 'DISPATCH_MAX_WAVE_SIZE', 12),
+    offer_timeout=getattr(settings, 'DISPATCH_OFFER_TIMEOUT_SECONDS', 15.0),
+)
+
+
+def stale_cutoff(now=None):
+    """Dispatches whose heartbeat is older than this are no longer being run."""
+    return (now or timezone.now()) - datetime.timedelta(seconds=getattr(settings, 'DISPATCH_STALE_SECONDS', 60))
+
+
+@database_sync_to_async
+def open_dispatch(trip_id):
+    """
+    Create (or restart a finished or abandoned) dispatch for a confirmed
+    trip. Returns False if a dispatcher is already working on it.
+    """
+    dispatch, created = TripDispatch.objects.get_or_create(trip_id=trip_id)
+    if created:
+        return True
+    if dispatch.status == TripDispatch.StatusChoices.SEARCHING:
+        # Unclaimed (new, or released when its dispatcher stopped) rows can be
+        # claimed as they are; a fresh heartbeat means someone is running it.
+        return dispatch.heartbeat_at is None or dispatch.heartbeat_at < stale_cutoff()
+    dispatch.status = TripDispatch.StatusChoices.SEARCHING
+    dispatch.wave = 0
+    dispatch.offered = []
+    dispatch.heartbeat_at = None
+    dispatch.save()
+    return True
+
+
+@database_sync_to_async
+def claim_dispatch(trip_id):
+    """
+    Take over a searching dispatch nobody is running (new, or with a stale
+    heartbeat) with one conditional UPDATE. Returns the TripDispatch with its
+    trip and passenger loaded, or None if it is finished or already claimed.
+    """
+    now = timezone.now()
+    claimed = TripDispatch.objects.filter(
+        Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=stale_cutoff(now)),
+        trip_id=trip_id, status=TripDispatch.StatusChoices.SEARCHING,
+    ).update(heartbeat_at=now)
+    if not claimed:
+        return None
+    return TripDispatch.objects.select_related("trip__user").get(trip_id=trip_id)
+
+
+@database_sync_to_async
+def save_progress(trip_id, wave, offered):
+    TripDispatch.objects.filter(trip_id=trip_id).update(wave=wave, offered=offered, heartbeat_at=timezone.now())
+
+
+@database_sync_to_async
+def touch_dispatch(trip_id):
+    TripDispatch.objects.filter(trip_id=trip_id).update(heartbeat_at=timezone.now())
+
+
+@database_sync_to_async
+def finish_dispatch(trip_id, status):
+    TripDispatch.objects.filter(trip_id=trip_id).update(status=status, heartbeat_at=timezone.now())
+
+
+@database_sync_to_async
+def release_dispatch(trip_id):
+    """
+    Hand a dispatch whose dispatcher stopped back for an immediate claim
+    (its open offers have been withdrawn, so it starts over).
+    """
+    TripDispatch.objects.filter(trip_id=trip_id, status=TripDispatch.StatusChoices.SEARCHING).update(
+        heartbeat_at=None, wave=0, offered=[]
+    )
+
+
+@database_sync_to_async
+def get_trip(trip_id):
+    return Trip.objects.filter(id=trip_id).first()
+
+
+@database_sync_to_async
+def get_payment_for_trip(trip_id):
+    return Payment.objects.filter(trip_id=trip_id).filter(Q(status="success") | Q(payment_method="cash")).first()
+
+
+@database_sync_to_async
+def available_drivers(trip):
+    return find_nearest_drivers(trip.pickup_latitude, trip.pickup_longitude, [trip.vehicle_type])
+
+
+@database_sync_to_async
+def get_driver(driver_id):
+    return Driver.objects.get(id=driver_id)
+
+
+@database_sync_to_async
+def offerable_drivers(driver_ids):
+    """The given drivers that are still available and online, in the given order."""
+    drivers = {
+        str(driver.id): driver
+        for driver in Driver.objects.filter(id__in=driver_ids, is_available=True, is_online=True)
+    }
+    return [drivers[str(driver_id)] for driver_id in driver_ids if str(driver_id) in drivers]
+
+
+def driver_details(driver):
+    return {
+        "id": str(driver.id),
+        "name": driver.full_name or driver.email,
+        "phone": str(driver.phone_number) if driver.phone_number else None,
+        "vehicle_type": driver.vehicle_type,
+        "rating": float(driver.rating) if driver.rating else None,
+    }
+
+
+class TripDispatcher:
+    """
+    Runs wave dispatch for trips on behalf of one consumer: the dispatch
+    worker, or a passenger's socket when DISPATCH_WORKER is off. The
+    consumer joins dispatch_{trip_id} while a trip is dispatched, and passes
+    the "dispatch.answer" events it receives there to `answer()`. Progress
+    goes to the passenger's user_{id} group as "dispatch.update" events.
+    """
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.offers = {}  # trip_id -> OpenOffers
+        self.tasks = {}   # trip_id -> running dispatch task
+
+    def start(self, trip_id):
+        """Dispatch `trip_id` in the background unless it already is."""
+        trip_id = str(trip_id)
+        task = self.tasks.get(trip_id)
+        if task and not task.done():
+            return False
+        task = self.tasks[trip_id] = asyncio.create_task(self.run(trip_id))
+        task.add_done_callback(lambda task: self._task_done(trip_id, task))
+        return True
+
+    def _task_done(self, trip_id, task):
+        if self.tasks.get(trip_id) is task:
+            del self.tasks[trip_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Dispatch of trip {trip_id} failed", exc_info=task.exception())
+
+    def answer(self, trip_id, driver_id, response):
+        """
+        Pass a driver's "accept"/"reject" to the dispatch running for
+        `trip_id`. Returns False if no open offer of that driver is held here.
+        """
+        offers = self.offers.get(str(trip_id))
+        return offers is not None and offers.answer(driver_id, response)
+
+    def cancel_all(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+    async def notify_user(self, user_id, data):
+        await self.consumer.channel_layer.group_send(f"user_{user_id}", {"type": "dispatch.update", "data": data})
+
+    async def keep_alive(self, trip_id):
+        """Refresh the heartbeat often enough that no other worker takes the trip over."""
+        interval = getattr(settings, 'DISPATCH_STALE_SECONDS', 60) / 3
+        while True:
+            await asyncio.sleep(interval)
+            await touch_dispatch(trip_id)
+
+    async def run(self, trip_id):
+        """
+        Offer the trip to the nearest drivers in waves until one accepts,
+        then withdraw every other open offer. Picks up where an abandoned
+        dispatch left off: drivers already offered keep their open offers.
+        Stops as soon as the trip is no longer pending (e.g. cancelled).
+        """
+        dispatch = await claim_dispatch(trip_id)
+        if dispatch is None:
+            return
+        trip = dispatch.trip
+        layer, channel_name = self.consumer.channel_layer, self.consumer.channel_name
+        await layer.group_add(dispatch_group(trip_id), channel_name)
+        heartbeat = asyncio.create_task(self.keep_alive(trip_id))
+        offers = self.offers[trip_id] = OpenOffers()
+        offers.add(dispatch.offered)
+        offered = list(dispatch.offered)
+        winner = None
+        trip_gone = False
+        started = time.monotonic()
+        try:
+            payment = await get_payment_for_trip(trip_id)
+            notification = {
+                "type": "trip_request_notification",
+                "data": {
+                    "trip_id": trip_id,
+                    "pickup": trip.pickup,
+                    "destination": trip.destination,
+                    "vehicle_type": trip.vehicle_type,
+                    "load_description": trip.load_description,
+                    "user_info": {
+                        "id": str(trip.user.id),
+                        "name": f"{trip.user.full_name}",
+                        "phone": str(trip.user.phone_number) if trip.user.phone_number else None,
+                    },
+                    "payment_info": payment and {
+                        "payment_method": payment.payment_method,
+                        "payment_status": payment.status,
+                        "amount": float(payment.amount),
+                        "currency": payment.currency,
+                    },
+                }
+            }
+
+            if offered:
+                # Resuming: one of the earlier offers may have been accepted meanwhile
+                winner = await self.await_driver_response(trip_id, offers, wait_time=0)
+            trip_gone = not winner and trip.status != Trip.StatusChoices.PENDING
+
+            ranked = [] if winner or trip_gone else [
+                driver for driver in await available_drivers(trip) if str(driver['id']) not in offered
+            ]
+            for wave_number, wave in enumerate(dispatch_strategy.waves(ranked), start=dispatch.wave + 1):
+                if wave_number > dispatch.wave + 1:
+                    current = await get_trip(trip_id)
+                    if current is None or current.status != Trip.StatusChoices.PENDING:
+                        trip_gone = True
+                        break
+                # Drivers may have gone offline or taken another trip since the search
+                drivers = await offerable_drivers([driver['id'] for driver in wave])
+                if not drivers:
+                    continue
+                driver_ids = [str(driver.id) for driver in drivers]
+                offered.extend(driver_ids)
+
+                # Open the offers before the drivers can possibly answer them
+                offers.add(driver_ids)
+                await asyncio.gather(*(
+                    layer.group_send(f"driver_{driver_id}", notification) for driver_id in driver_ids
+                ))
+                dispatch_strategy.record_offers(wave_number, len(driver_ids))
+                await save_progress(trip_id, wave_number, offered)
+                await self.notify_user(trip.user_id, {
+                    "type": "dispatch_progress",
+                    "trip_id": trip_id,
+                    "wave": wave_number,
+                    "drivers_offered": len(offered),
+                })
+
+                winner = await self.await_driver_response(trip_id, offers, wait_time=dispatch_strategy.offer_timeout)
+                if winner:
+                    dispatch_strategy.record_match(wave_number, time.monotonic() - started)
+                    break
+        except asyncio.CancelledError:
+            # The consumer running this dispatch went away: take the offers back
+            # and release the trip so the next confirm (or a worker) can claim it.
+            await self.withdraw_offers(trip_id, offered, reason="cancelled")
+            await release_dispatch(trip_id)
+            raise
+        finally:
+            heartbeat.cancel()
+            self.offers.pop(trip_id, None)
+            await layer.group_discard(dispatch_group(trip_id), channel_name)
+
+        if trip_gone:
+            logger.info(f"Trip {trip_id} is no longer pending, stopping dispatch")
+            await self.withdraw_offers(trip_id, offered, reason="cancelled")
+            await finish_dispatch(trip_id, TripDispatch.StatusChoices.CANCELLED)
+            return
+
+        await self.withdraw_offers(trip_id, [driver_id for driver_id in offered if driver_id != winner],
+                                   reason="taken" if winner else "expired")
+        if winner:
+            await finish_dispatch(trip_id, TripDispatch.StatusChoices.MATCHED)
+            await self.notify_user(trip.user_id, {
+                "type": "driver_assigned",
+                "trip_id": trip_id,
+                "status": "driver_assigned",
+                "message": "Driver found and assigned to your trip!",
+                "driver_info": driver_details(await get_driver(winner)),
+                "payment_info": notification["data"]["payment_info"],
+            })
+            return
+
+        dispatch_strategy.record_no_match()
+        await finish_dispatch(trip_id, TripDispatch.StatusChoices.NO_DRIVER)
+        await self.notify_user(trip.user_id, {
+            "type": "no_driver_found",
+            "trip_id": trip_id,
+            "status": "no_driver_available",
+            "message": "No drivers are available to accept your trip at the moment. Please try again later."
+        })
+
+    async def await_driver_response(self, trip_id, offers, wait_time=30):
+        """
+        Waits up to wait_time seconds for one of the drivers holding an open
+        offer for the trip to accept. Returns the winning driver's id, or
+        None if they all declined or did not respond.
+
+        Answers arrive as "dispatch.answer" events, so this returns as soon
+        as a driver accepts. The trip row is only re-read if nobody accepted
+        by the deadline.
+        """
+        try:
+            winner = await offers.first_accept(wait_time)
+            if winner:
+                logger.info(f"Driver {winner} accepted trip {trip_id}")
+                return winner
+            if not offers.drivers:
+                logger.info(f"Every driver offered trip {trip_id} declined")
+                return None
+
+            # No acceptance by the deadline (an event may have been dropped): fall back to the row.
+            trip = await get_trip(trip_id)
+            if trip and trip.status == "accepted" and str(trip.driver_id) in offers.drivers:
+                logger.info(f"Driver {trip.driver_id} accepted trip {trip_id}")
+                return str(trip.driver_id)
+            logger.info(f"No driver accepted trip {trip_id} within {wait_time} seconds")
+            return None
+
+        except asyncio.CancelledError:
+            logger.warning(f"Await driver response task cancelled for trip {trip_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Error in await_driver_response for trip {trip_id}: {e}", exc_info=True)
+            return None
+
+    async def withdraw_offers(self, trip_id, driver_ids, reason):
+        """Tell drivers whose offer is no longer open that it was taken or expired."""
+        await asyncio.gather(*(
+            self.consumer.channel_layer.group_send(f"driver_{driver_id}", {
+                "type": "trip_offer_cancelled",
+                "trip_id": trip_id,
+                "reason": reason,
+            })
+            for driver_id in driver_ids
+        ))
@@ -0,0 +1,157 @@
+import math
+import threading
+import time
+import logging
+from django.conf import settings
+from .ranking import rank_nearest
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEGREE = 111.32
+
+
+class DriverGridIndex:
+    """
+    In-memory fixed-cell grid of available drivers.
+
+    Drivers are bucketed by (floor(lat / cell), floor(lon / cell)). A nearest
+    driver query starts at the pickup cell and widens ring by ring, so only
+    the cells around the pickup are scanned instead of every online driver.
+
+    The index is per process. It is loaded from the database on first use and
+    resynced every `resync_seconds` so that updates made by other workers are
+    eventually picked up.
+    """
+
+    def __init__(self, cell_degrees=0.05, resync_seconds=60):
+        self.cell_degrees = cell_degrees
+        self.resync_seconds = resync_seconds
+        self._lock = threading.RLock()
+        self._cells = {}     # (row, col) -> set of driver ids
+        self._drivers = {}   # driver id -> (lat, lon, vehicle_type, (row, col))
+        self._loaded_at = None
+
+    def _cell_for(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees))
+
+    def __len__(self):
+        return len(self._drivers)
+
+    def __contains__(self, driver_id):
+        return str(driver_id) in self._drivers
+
+    def update(self, driver_id, lat, lon, vehicle_type=None):
+        """Insert or move a driver. Drivers without coordinates are removed."""
+        driver_id = str(driver_id)
+        if lat is None or lon is None:
+            self.remove(driver_id)
+            return
+        lat, lon = float(lat), float(lon)
+        cell = self._cell_for(lat, lon)
+        with self._lock:
+            previous = self._drivers.get(driver_id)
+            if previous and previous[3] != cell:
+                self._discard_from_cell(driver_id, previous[3])
+            self._drivers[driver_id] = (lat, lon, vehicle_type, cell)
+            self._cells.setdefault(cell, set()).add(driver_id)
+
+    def remove(self, driver_id):
+        driver_id = str(driver_id)
+        with self._lock:
+            previous = self._drivers.pop(driver_id, None)
+            if previous:
+                self._discard_from_cell(driver_id, previous[3])
+
+    def sync_driver(self, driver):
+        """Reflect a Driver instance's availability and position in the index."""
+        if driver.is_available:
+            self.update(driver.id, driver.latitude, driver.longitude, driver.vehicle_type)
+        else:
+            self.remove(driver.id)
+
+    def _discard_from_cell(self, driver_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                del self._cells[cell]
+
+    def rebuild(self, rows):
+        """Replace the whole index with (id, lat, lon, vehicle_type) rows."""
+        with self._lock:
+            self._cells = {}
+            self._drivers = {}
+            for driver_id, lat, lon, vehicle_type in rows:
+                self.update(driver_id, lat, lon, vehicle_type)
+            self._loaded_at = time.monotonic()
+        logger.info(f"Driver index rebuilt with {len(self._drivers)} drivers")
+
+    def needs_rebuild(self):
+        if self._loaded_at is None:
+            return True
+        return time.monotonic() - self._loaded_at > self.resync_seconds
+
+    def _ring(self, center, radius):
+        """Yield the cells on the square ring `radius` cells away from `center`."""
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield (row - radius, c)
+            yield (row + radius, c)
+        for r in range(row - radius + 1, row + radius):
+            yield (r, col - radius)
+            yield (r, col + radius)
+
+    def _max_radius(self, center):
+        """Chebyshev distance from `center` to the farthest occupied cell."""
+        row, col = center
+        return max(
+            (max(abs(r - row), abs(c - col)) for r, c in self._cells),
+            default=-1,
+        )
+
+    def nearest(self, lat, lon, limit=20, vehicle_types=None, refine=False):
+        """
+        Return up to `limit` (driver_id, distance_km) pairs ordered by distance.
+
+        Rings are widened until `limit` matching drivers are found and the
+        next ring cannot contain anything closer than the furthest of them.
+        Candidates are ranked in one vectorized haversine pass; `refine`
+        re-measures the final `limit` with geodesic (see trips.ranking).
+        """
+        lat, lon = float(lat), float(lon)
+        center = self._cell_for(lat, lon)
+        vehicle_types = set(vehicle_types) if vehicle_types else None
+        # Smallest width of a cell in km around the pickup (longitude shrinks with latitude).
+        cell_km = self.cell_degrees * KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+
+        ids, lats, lons = [], [], []
+        with self._lock:
+            max_radius = self._max_radius(center)
+            radius = 0
+            while radius <= max_radius:
+                if len(ids) >= limit:
+                    _, distances = rank_nearest(lat, lon, lats, lons, limit)
+                    # Anything in this ring is at least (radius - 1) cells away.
+                    if (radius - 1) * cell_km > distances[-1]:
+                        break
+                for cell in self._ring(center, radius):
+                    for driver_id in self._cells.get(cell, ()):
+                        d_lat, d_lon, d_vehicle_type, _ = self._drivers[driver_id]
+                        if vehicle_types and d_vehicle_type not in vehicle_types:
+                            continue
+                        ids.append(driver_id)
+                        lats.append(d_lat)
+                        lons.append(d_lon)
+                radius += 1
+
+        positions, distances = rank_nearest(lat, lon, lats, lons, limit, refine=refine)
+        return [(ids[i], float(d)) for i, d in zip(positions, distances)]
+
+
+driver_index = DriverGridIndex(
+    cell_degrees=getattr(settings, 'DRIVER_INDEX_CELL_DEGREES', 0.05),
+    resync_seconds=getattr(settings, 'DRIVER_INDEX_RESYNC_SECONDS', 60),
+)
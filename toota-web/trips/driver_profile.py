@@ -0,0 +1,78 @@
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from authentication.models import Driver
+
+# Driver fields the profile is built from; saving any of them invalidates it.
+PROFILE_SOURCE_FIELDS = frozenset({
+    "full_name", "email", "phone_number", "vehicle_type", "vehicle_load_capacity",
+    "average_rating", "rating_count", "car_image", "vehicle_registration",
+})
+
+
+def build_driver_profile(driver):
+    """The static part of a driver's broadcast details (everything but position)."""
+    return {
+        "id": str(driver.id),
+        "name": driver.full_name or driver.email,
+        "email": driver.email,
+        "phone": str(driver.phone_number) if driver.phone_number else None,
+        "vehicle_type": driver.vehicle_type,
+        "vehicle_load_capacity": driver.vehicle_load_capacity,
+        "rating": float(driver.average_rating),
+        "rating_count": driver.rating_count,
+        "car_image": driver.car_image.url if driver.car_image else None,
+        "number_plate": driver.vehicle_registration,
+    }
+
+
+def build_location_delta(driver, profile_entry, speed_kmh=None, heading=None):
+    """
+    What a location broadcast carries: position, motion for client-side
+    extrapolation (see trips.dead_reckoning) and the profile version.
+    """
+    return {
+        "id": str(driver.id),
+        "latitude": driver.latitude,
+        "longitude": driver.longitude,
+        "speed_kmh": None if speed_kmh is None else round(speed_kmh, 1),
+        "heading": None if heading is None else round(heading),
+        "timestamp": int(time.time() * 1000),
+        "is_available": driver.is_available,
+        "vehicle_type": profile_entry["profile"]["vehicle_type"],
+        "profile_version": profile_entry["version"],
+    }
+
+
+def _cache():
+    return caches[getattr(settings, 'DRIVER_PROFILE_CACHE_ALIAS', 'default')]
+
+
+def _key(driver_id):
+    return f"driver_profile:{driver_id}"
+
+
+def get_driver_profile(driver_id):
+    """
+    Return {"version": int, "profile": dict} for a driver, from the cache or
+    freshly built. The version changes whenever the profile is rebuilt, so
+    listeners only need to refetch the profile when it differs.
+    """
+    entry = _cache().get(_key(driver_id))
+    if entry is None:
+        driver = Driver.objects.get(id=driver_id)
+        entry = {"version": time.time_ns() // 1000, "profile": build_driver_profile(driver)}
+        _cache().set(_key(driver_id), entry, getattr(settings, 'DRIVER_PROFILE_CACHE_TTL_SECONDS', 300))
+    return entry
+
+
+async def aget_driver_profile(driver_id):
+    entry = await _cache().aget(_key(driver_id))
+    if entry is None:
+        entry = await database_sync_to_async(get_driver_profile)(driver_id)
+    return entry
+
+
+def invalidate_driver_profile(driver_id):
+    _cache().delete(_key(driver_id))
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import threading
+from channels.db import database_sync_to_async
+from django.conf import settings
+from authentication.models import Driver
+from .location_history import location_history
+
+logger = logging.getLogger(__name__)
+
+
+class LocationBuffer:
+    """
+    Write-behind buffer for driver GPS positions.
+
+    Pings only record the latest position per driver in memory; a background
+    task writes all pending positions every `flush_interval` seconds with a
+    single bulk_update of latitude/longitude (no save(), no full_clean()).
+    Readers in this process should consult `position()`/`overlay()` first,
+    since the database can lag by up to one flush interval. Every recorded
+    position is also queued in `history` and written on the same flush.
+    """
+
+    def __init__(self, flush_interval=2.0, batch_size=500, history=None):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.history = history
+        self._pending = {}   # driver_id -> (lat, lon), waiting for the next flush
+        self._flushing = {}  # positions being written right now
+        self._lock = threading.Lock()
+        self._flusher = None
+        self.recorded = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.flushes = 0
+
+    def record(self, driver_id, latitude, longitude, speed=None, heading=None):
+        """Remember a driver's latest position and make sure a flusher is running."""
+        driver_id = str(driver_id)
+        with self._lock:
+            if driver_id in self._pending:
+                self.coalesced += 1
+            self._pending[driver_id] = (latitude, longitude)
+            self.recorded += 1
+        if self.history is not None:
+            self.history.append(driver_id, latitude, longitude, speed=speed, heading=heading)
+        self._ensure_flusher()
+
+    def position(self, driver_id):
+        """The buffered (lat, lon) for a driver, or None if the DB is current."""
+        driver_id = str(driver_id)
+        with self._lock:
+            return self._pending.get(driver_id) or self._flushing.get(driver_id)
+
+    def overlay(self, rows):
+        """Replace latitude/longitude in `.values()` rows with buffered positions."""
+        for row in rows:
+            position = self.position(row["id"])
+            if position is not None:
+                row["latitude"], row["longitude"] = position
+        return rows
+
+    def flush(self):
+        """
+        Write every pending position to the database, then the queued
+        history. Returns the number of driver positions written.
+        """
+        written = self._flush_positions()
+        if self.history is not None:
+            self.history.flush()
+        return written
+
+    def _flush_positions(self):
+        with self._lock:
+            if not self._pending:
+                return 0
+            self._flushing, self._pending = self._pending, {}
+            batch = dict(self._flushing)
+        try:
+            Driver.objects.bulk_update(
+                [Driver(id=driver_id, latitude=lat, longitude=lon) for driver_id, (lat, lon) in batch.items()],
+                fields=["latitude", "longitude"],
+                batch_size=self.batch_size,
+            )
+        except Exception:
+            # Put the positions back unless a newer ping already replaced them.
+            with self._lock:
+                for driver_id, position in batch.items():
+                    self._pending.setdefault(driver_id, position)
+            raise
+        finally:
+            with self._lock:
+                self._flushing = {}
+        self.flushed += len(batch)
+        self.flushes += 1
+        return len(batch)
+
+    async def aflush(self):
+        return await database_sync_to_async(self.flush)()
+
+    def _ensure_flusher(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # sync callers flush explicitly
+        if self._flusher is None or self._flusher.done() or self._flusher.get_loop() is not loop:
+            self._flusher = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.aflush()
+            except Exception as e:
+                logger.error(f"Failed to flush driver locations: {e}", exc_info=True)
+            with self._lock:
+                if not self._pending:
+                    self._flusher = None
+                    return
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "recorded": self.recorded,
+            "coalesced": self.coalesced,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "pending": pending,
+        }
+
+
+location_buffer = LocationBuffer(
+    flush_interval=getattr(settings, 'DRIVER_LOCATION_FLUSH_SECONDS', 2.0),
+    batch_size=getattr(settings, 'DRIVER_LOCATION_FLUSH_BATCH_SIZE', 500),
+    history=location_history,
+)
@@ -0,0 +1,204 @@
+"""
+Append-only driver location history.
+
+DriverLocationConsumer hands accepted pings to the location buffer, which
+queues them here; each buffer flush writes the queue with one bulk_create,
+so the live ingestion path never waits on these inserts.
+
+On PostgreSQL trips_driverlocationpoint is partitioned by month on
+recorded_at. Partitions are created on demand before each insert and whole
+months are dropped by `manage.py prune_location_history`. Other databases use
+a plain table and row deletes.
+"""
+import datetime
+import logging
+import threading
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import DriverLocationPoint
+
+logger = logging.getLogger(__name__)
+
+COORDINATE_SCALE = 1_000_000
+TABLE = DriverLocationPoint._meta.db_table
+
+
+def encode_coordinate(value):
+    """Degrees to int32 fixed point (1e-6 degree, about 11 cm)."""
+    return int(round(float(value) * COORDINATE_SCALE))
+
+
+def decode_coordinate(value):
+    return value / COORDINATE_SCALE
+
+
+def encode_polyline(points):
+    """Encode (lat, lon) pairs with Google's encoded polyline algorithm (1e-5 precision)."""
+    result = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        lat, lon = int(round(lat * 1e5)), int(round(lon * 1e5))
+        for delta in (lat - prev_lat, lon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        prev_lat, prev_lon = lat, lon
+    return "".join(result)
+
+
+def _month_start(moment):
+    return moment.astimezone(datetime.timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month_start):
+    return (month_start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month_start):
+    return f"{TABLE}_y{month_start.year}m{month_start.month:02d}"
+
+
+_known_partitions = set()
+
+
+def ensure_partitions(moments):
+    """Create the monthly partitions covering `moments` (PostgreSQL only)."""
+    if connection.vendor != "postgresql":
+        return
+    for month_start in {_month_start(moment) for moment in moments}:
+        name = partition_name(month_start)
+        if name in _known_partitions:
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{TABLE}" '
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [month_start, _next_month(month_start)],
+            )
+        _known_partitions.add(name)
+
+
+class LocationHistory:
+    """
+    Queue of location points waiting to be written. `flush()` is called by
+    the location buffer's background flusher. If the database is down the
+    queue keeps at most `max_pending` points, dropping the oldest.
+    """
+
+    def __init__(self, enabled=True, batch_size=1000, max_pending=100_000):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def append(self, driver_id, latitude, longitude, speed=None, heading=None, recorded_at=None):
+        if not self.enabled:
+            return
+        point = DriverLocationPoint(
+            driver_id=driver_id,
+            recorded_at=recorded_at or timezone.now(),
+            lat_e6=encode_coordinate(latitude),
+            lon_e6=encode_coordinate(longitude),
+            speed=None if speed is None else int(round(speed)),
+            heading=None if heading is None else int(round(heading)) % 360,
+        )
+        with self._lock:
+            self._pending.append(point)
+            self._trim()
+
+    def _trim(self):
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped += overflow
+
+    def flush(self):
+        """Write every queued point. Returns the count written."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        try:
+            ensure_partitions(point.recorded_at for point in batch)
+            DriverLocationPoint.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            with self._lock:
+                self._pending[:0] = batch
+                self._trim()
+            raise
+        self.written += len(batch)
+        return len(batch)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {"written": self.written, "pending": pending, "dropped": self.dropped}
+
+
+location_history = LocationHistory(
+    enabled=getattr(settings, 'LOCATION_HISTORY_ENABLED', True),
+    batch_size=getattr(settings, 'LOCATION_HISTORY_BATCH_SIZE', 1000),
+    max_pending=getattr(settings, 'LOCATION_HISTORY_MAX_PENDING', 100_000),
+)
+
+
+def trip_breadcrumbs(trip, max_points=None):
+    """
+    The driver's recorded path for a trip, as an encoded polyline.
+
+    A trip has no explicit start/end timestamps, so the window runs from its
+    creation until its last update once it is completed or cancelled, or
+    until now while it is still active.
+    """
+    if trip.driver_id is None:
+        return {"trip_id": str(trip.id), "points": 0, "polyline": ""}
+    finished = trip.status in (trip.StatusChoices.COMPLETED, trip.StatusChoices.CANCELLED)
+    ended_at = trip.updated_at if finished else timezone.now()
+    rows = (
+        DriverLocationPoint.objects
+        .filter(driver_id=trip.driver_id, recorded_at__range=(trip.created_at, ended_at))
+        .order_by("recorded_at")
+        .values_list("lat_e6", "lon_e6")
+    )
+    points = [(decode_coordinate(lat), decode_coordinate(lon)) for lat, lon in rows]
+    if max_points and len(points) > max_points:
+        # Thin evenly but always keep the last point.
+        step = len(points) / max_points
+        points = [points[int(i * step)] for i in range(max_points - 1)] + [points[-1]]
+    return {"trip_id": str(trip.id), "points": len(points), "polyline": encode_polyline(points)}
+
+
+def prune_location_history(older_than):
+    """
+    Delete history recorded before `older_than`. On PostgreSQL whole monthly
+    partitions that end before it are dropped; the rest is deleted by row.
+    Returns the names of dropped partitions.
+    """
+    dropped = []
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                "WHERE parent.relname = %s",
+                [TABLE],
+            )
+            for (name,) in cursor.fetchall():
+                try:
+                    year, month = int(name[-7:-3]), int(name[-2:])
+                except ValueError:
+                    continue
+                month_start = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+                if _next_month(month_start) <= older_than:
+                    cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+                    _known_partitions.discard(name)
+                    dropped.append(name)
+    DriverLocationPoint.objects.filter(recorded_at__lt=older_than).delete()
+    return dropped
@@ -0,0 +1,109 @@
+import threading
+import time
+from django.conf import settings
+from .ranking import point_distance_km
+
+
+class LocationPolicy:
+    """
+    Decides which driver GPS pings are worth ingesting.
+
+    A ping is dropped when it arrives less than `min_interval` seconds after
+    the last accepted one, moved less than `min_distance_m` metres from it
+    (dead band), or implies a speed above `max_speed_kmh` (a GPS jump).
+    A jump is not rejected forever: once `reanchor_after` consecutive jumps
+    agree with each other, the last accepted fix is taken to be the bad one
+    and the new position is accepted. Callers keep the last accepted fix and
+    the pending jumps per connection; the policy only keeps counters.
+    """
+
+    REASONS = ("invalid", "too_soon", "too_close", "too_fast")
+
+    def __init__(self, min_interval=2.0, min_distance_m=10.0, max_speed_kmh=200.0, reanchor_after=3):
+        self.min_interval = min_interval
+        self.min_distance_m = min_distance_m
+        self.max_speed_kmh = max_speed_kmh
+        self.reanchor_after = reanchor_after
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.reanchored = 0
+        self.dropped = dict.fromkeys(self.REASONS, 0)
+
+    def check(self, last_fix, latitude, longitude, now=None, jumps=None):
+        """
+        Return None if the ping should be ingested, otherwise the reason it
+        was dropped. `last_fix` is the (lat, lon, timestamp) of the last
+        accepted ping, or None. `jumps` is a list the caller keeps per
+        connection for the consecutive "too_fast" fixes; without it a jump
+        is always dropped.
+        """
+        now = time.monotonic() if now is None else now
+        reason = self._reason(last_fix, latitude, longitude, now)
+        reanchored = False
+        if jumps is not None:
+            if reason == "too_fast":
+                fix = (float(latitude), float(longitude), now)
+                if jumps and not self._agrees(jumps[-1], fix):
+                    jumps.clear()
+                jumps.append(fix)
+                if len(jumps) >= self.reanchor_after:
+                    reason, reanchored = None, True
+            if reason is None:
+                jumps.clear()
+        with self._lock:
+            if reason is None:
+                self.accepted += 1
+                self.reanchored += reanchored
+            else:
+                self.dropped[reason] += 1
+        return reason
+
+    def _agrees(self, previous, fix):
+        """Whether two fixes are consistent with each other (no jump between them)."""
+        distance_km = point_distance_km(previous[0], previous[1], fix[0], fix[1])
+        elapsed = fix[2] - previous[2]
+        if elapsed <= 0:
+            return distance_km * 1000 < self.min_distance_m
+        return distance_km / (elapsed / 3600) <= self.max_speed_kmh
+
+    def _reason(self, last_fix, latitude, longitude, now):
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            return "invalid"
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return "invalid"
+        if last_fix is None:
+            return None
+
+        last_lat, last_lon, last_time = last_fix
+        elapsed = now - last_time
+        if elapsed < self.min_interval:
+            return "too_soon"
+        distance_km = point_distance_km(last_lat, last_lon, latitude, longitude)
+        if distance_km * 1000 < self.min_distance_m:
+            return "too_close"
+        if elapsed > 0 and distance_km / (elapsed / 3600) > self.max_speed_kmh:
+            return "too_fast"
+        return None
+
+    def stats(self):
+        with self._lock:
+            dropped = dict(self.dropped)
+            accepted = self.accepted
+            reanchored = self.reanchored
+        total = accepted + sum(dropped.values())
+        return {
+            "accepted": accepted,
+            "reanchored": reanchored,
+            "dropped": dropped,
+            "drop_rate": round(sum(dropped.values()) / total, 3) if total else 0.0,
+        }
+
+
+location_policy = LocationPolicy(
+    min_interval=getattr(settings, 'DRIVER_LOCATION_MIN_INTERVAL_SECONDS', 2.0),
+    min_distance_m=getattr(settings, 'DRIVER_LOCATION_MIN_DISTANCE_METERS', 10.0),
+    max_speed_kmh=getattr(settings, 'DRIVER_LOCATION_MAX_SPEED_KMH', 200.0),
+    reanchor_after=getattr(settings, 'DRIVER_LOCATION_REANCHOR_FIXES', 3),
+)
@@ -0,0 +1,22 @@
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from trips.location_history import prune_location_history
+
+
+class Command(BaseCommand):
+    help = "Delete driver location history older than the retention period."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=getattr(settings, 'LOCATION_HISTORY_RETENTION_DAYS', 90),
+            help="Keep this many days of history (default: LOCATION_HISTORY_RETENTION_DAYS).",
+        )
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - datetime.timedelta(days=options["days"])
+        dropped = prune_location_history(older_than)
+        for name in dropped:
+            self.stdout.write(f"Dropped partition {name}")
+        self.stdout.write(self.style.SUCCESS(f"Pruned location history before {older_than:%Y-%m-%d}"))
@@ -0,0 +1,26 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from trips.dispatch import DISPATCH_CHANNEL, stale_cutoff
+from trips.models import TripDispatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Hand searching trips whose dispatcher stopped checking in (a dead worker, "
+        "a dropped socket or a lost message) back to the dispatch workers."
+    )
+
+    def handle(self, *args, **options):
+        stale_before = stale_cutoff()
+        trip_ids = list(
+            TripDispatch.objects
+            .filter(status=TripDispatch.StatusChoices.SEARCHING)
+            .filter(Q(heartbeat_at__lt=stale_before) | Q(heartbeat_at__isnull=True, created_at__lt=stale_before))
+            .values_list("trip_id", flat=True)
+        )
+        channel_layer = get_channel_layer()
+        for trip_id in trip_ids:
+            async_to_sync(channel_layer.send)(DISPATCH_CHANNEL, {"type": "trip.confirmed", "trip_id": str(trip_id)})
+        self.stdout.write(self.style.SUCCESS(f"Requeued {len(trip_ids)} dispatch(es)"))
@@ -0,0 +1,161 @@
+import math
+import threading
+import time
+import logging
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEGREE = 111320.0
+
+
+def snap_to_grid(lat, lon, grid_meters):
+    """
+    Snap a coordinate to a grid of roughly `grid_meters` squares and return
+    the integer cell, so nearby points share a cache key.
+    """
+    lat_step = grid_meters / METERS_PER_DEGREE
+    lat_cell = math.floor(float(lat) / lat_step)
+    snapped_lat = (lat_cell + 0.5) * lat_step
+    lon_step = grid_meters / (METERS_PER_DEGREE * max(math.cos(math.radians(snapped_lat)), 0.01))
+    return lat_cell, math.floor(float(lon) / lon_step)
+
+
+class MemoryBackend:
+    """In-process TTL + LRU store."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    async def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    async def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    """
+    Store entries in a Django cache (e.g. Redis) shared by all workers.
+
+    The cache is shared with the rest of the site, so `clear` never flushes
+    it: entries are stored with a generation number and clearing bumps the
+    namespace's generation, which makes every older entry a miss.
+    """
+
+    def __init__(self, alias="default", namespace="maps"):
+        self.alias = alias
+        self.generation_key = "{}:generation".format(namespace)
+
+    async def get(self, key):
+        found = await caches[self.alias].aget_many([self.generation_key, key])
+        entry = found.get(key)
+        if entry is None or entry[0] != found.get(self.generation_key, 0):
+            return None
+        return entry[1]
+
+    async def set(self, key, value, ttl):
+        cache = caches[self.alias]
+        generation = await cache.aget(self.generation_key, 0)
+        await cache.aset(key, (generation, value), timeout=ttl)
+
+    def clear(self):
+        cache = caches[self.alias]
+        cache.add(self.generation_key, 0, timeout=None)
+        try:
+            cache.incr(self.generation_key)
+        except ValueError:
+            # Evicted between add and incr.
+            cache.set(self.generation_key, 1, timeout=None)
+
+
+class MapsCache:
+    """
+    TTL cache for Google Maps results with hit/miss counters.
+
+    Keys are built by the caller (see `key`) and namespaced by `name`.
+    `None` results are never cached.
+    """
+
+    def __init__(self, name, backend, ttl, grid_meters=50):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.grid_meters = grid_meters
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, *parts):
+        return "maps:{}:{}".format(self.name, ":".join(str(part) for part in parts))
+
+    def point_key(self, *points):
+        """Key for one or more (lat, lon) points snapped to the cache grid."""
+        cells = []
+        for lat, lon in points:
+            cells.extend(snap_to_grid(lat, lon, self.grid_meters))
+        return self.key(*cells)
+
+    async def get(self, key):
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value, ttl=None):
+        if value is not None:
+            await self.backend.set(key, value, self.ttl if ttl is None else ttl)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = self.misses = 0
+
+
+def build_maps_cache(name):
+    """Build a MapsCache from settings.MAPS_CACHES[name]."""
+    options = getattr(settings, 'MAPS_CACHES', {}).get(name, {})
+    if options.get("BACKEND", "memory") == "django":
+        backend = DjangoCacheBackend(options.get("CACHE_ALIAS", "default"), namespace="maps:{}".format(name))
+    else:
+        backend = MemoryBackend(options.get("MAX_ENTRIES", 10000))
+    return MapsCache(
+        name,
+        backend,
+        ttl=options.get("TTL_SECONDS", 120),
+        grid_meters=options.get("GRID_METERS", 50),
+    )
+
+
+route_cache = build_maps_cache("routes")
+geocode_cache = build_maps_cache("geocodes")
+reverse_geocode_cache = build_maps_cache("reverse_geocodes")
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import sys
+import time
+import aiohttp
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_loop = None
+
+
+def get_maps_session():
+    """
+    Return the process-wide aiohttp session used for all Google Maps calls.
+
+    The session is created lazily on the running event loop and reused, so
+    requests share pooled keep-alive connections and cached DNS lookups
+    instead of paying a TCP+TLS handshake per call. If the loop changes
+    (e.g. in tests) a new session is created for the new loop.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=getattr(settings, 'MAPS_HTTP_MAX_CONNECTIONS', 100),
+            limit_per_host=getattr(settings, 'MAPS_HTTP_MAX_CONNECTIONS_PER_HOST', 32),
+            ttl_dns_cache=getattr(settings, 'MAPS_HTTP_DNS_CACHE_SECONDS', 300),
+            keepalive_timeout=getattr(settings, 'MAPS_HTTP_KEEPALIVE_SECONDS', 60),
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=getattr(settings, 'MAPS_HTTP_TIMEOUT_SECONDS', 10)),
+        )
+        _session_loop = loop
+        logger.info("Created shared Google Maps HTTP session")
+    return _session
+
+
+async def close_maps_session():
+    """Close the shared session, if any. Safe to call more than once."""
+    global _session, _session_loop
+    session, _session, _session_loop = _session, None, None
+    if session is not None and not session.closed:
+        await session.close()
+        logger.info("Closed shared Google Maps HTTP session")
+
+
+async def maps_lifespan(scope, receive, send):
+    """
+    ASGI lifespan handler that closes the shared Maps session on shutdown.
+    Uvicorn calls it; Daphne does not implement lifespan at all, which is
+    what close_maps_session_on_reactor_shutdown covers.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_maps_session()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def close_maps_session_on_reactor_shutdown():
+    """
+    Close the shared session from a Twisted "before shutdown" trigger, for
+    Daphne (runserver and production), which never sends lifespan events.
+    Returns False without doing anything when no Twisted reactor is
+    installed, so importing this under other servers does not install one.
+    """
+    reactor = sys.modules.get("twisted.internet.reactor")
+    if reactor is None:
+        return False
+    from twisted.internet.defer import Deferred
+
+    def close():
+        return Deferred.fromFuture(asyncio.ensure_future(close_maps_session()))
+
+    reactor.addSystemEventTrigger("before", "shutdown", close)
+    return True
+
+
+class CircuitBreaker:
+    """
+    Stops calling Google Maps after repeated failures.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    requests are refused for `reset_timeout` seconds. Then one trial request
+    is let through (half-open): success closes the breaker, failure opens it
+    again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self.rejected = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow_request(self):
+        state = self.state
+        if state == "closed":
+            return True
+        now = time.monotonic()
+        # A trial that never reported back (e.g. cancelled) does not block the next one forever.
+        if state == "half_open" and (
+            self.trial_started_at is None or now - self.trial_started_at >= self.reset_timeout
+        ):
+            self.trial_started_at = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_started_at = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Google Maps circuit breaker opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+maps_breaker = CircuitBreaker(
+    failure_threshold=getattr(settings, 'MAPS_BREAKER_FAILURE_THRESHOLD', 5),
+    reset_timeout=getattr(settings, 'MAPS_BREAKER_RESET_SECONDS', 30),
+)
+
+# API statuses that mean Google Maps is unavailable rather than "no answer".
+MAPS_FAILURE_STATUSES = {"OVER_QUERY_LIMIT", "REQUEST_DENIED", "UNKNOWN_ERROR"}
+
+
+def maps_url(api):
+    """
+    URL of a Maps web service, e.g. maps_url("geocode"). The host comes from
+    MAPS_BASE_URL so tests and load tests can point at trips.maps_stub.
+    """
+    base_url = getattr(settings, 'MAPS_BASE_URL', 'https://maps.googleapis.com').rstrip("/")
+    return f"{base_url}/maps/api/{api}/json"
+
+
+async def maps_get_json(url, params=None, timeout=5, session=None):
+    """
+    GET a Google Maps endpoint through the circuit breaker. Returns the
+    decoded JSON, or None if the breaker is open or the call failed.
+    Parameters set to None (e.g. a missing API key) are left out.
+    """
+    if not maps_breaker.allow_request():
+        return None
+    if params is not None:
+        params = {name: value for name, value in params.items() if value is not None}
+    try:
+        async with (session or get_maps_session()).get(
+            url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            if response.status >= 500:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status
+                )
+            data = await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        logger.error(f"Google Maps request to {url} failed: {e}")
+        maps_breaker.record_failure()
+        return None
+
+    if data.get("status") in MAPS_FAILURE_STATUSES:
+        logger.error(f"Google Maps request to {url} returned {data.get('status')}")
+        maps_breaker.record_failure()
+    else:
+        maps_breaker.record_success()
+    return data
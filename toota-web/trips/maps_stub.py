@@ -0,0 +1,182 @@
+"""
+Local stand-in for the Google Maps Directions, Distance Matrix and Geocoding
+APIs, for offline tests and load tests.
+
+Answers are deterministic and synthetic: routes are the straight-line
+distance times a road factor at a fixed speed, addresses geocode to a stable
+point derived from their text, and coordinates reverse-geocode to a made-up
+street address. Latency and errors can be injected.
+
+Point the app at it with MAPS_BASE_URL, e.g.:
+    python -m trips.maps_stub --port 8089 --latency 0.05 --error-rate 0.01
+    MAPS_BASE_URL=http://127.0.0.1:8089 daphne toota.asgi:application
+
+Tests can start one in-process with `maps_stub_server()`.
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import math
+import random
+from aiohttp import web
+from .ranking import EARTH_RADIUS_KM
+
+# Where synthetic geocodes land: a box around Johannesburg.
+GEOCODE_ORIGIN = (-26.2041, 28.0473)
+GEOCODE_SPAN_DEGREES = 0.5
+
+
+class MapsStub:
+    """
+    aiohttp application serving fake Maps responses.
+
+    `latency` seconds are added to every response, plus up to `jitter`
+    seconds of random delay. A fraction `error_rate` of requests fail, either
+    with an HTTP 500 (`error_mode="http"`) or with an OVER_QUERY_LIMIT status
+    (`error_mode="quota"`). `seed` makes jitter and errors reproducible.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_mode="http",
+                 road_factor=1.3, speed_kmh=40, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_mode = error_mode
+        self.road_factor = road_factor
+        self.speed_kmh = speed_kmh
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get("/maps/api/directions/json", self.directions)
+        app.router.add_get("/maps/api/distancematrix/json", self.distance_matrix)
+        app.router.add_get("/maps/api/geocode/json", self.geocode)
+        return app
+
+    async def _respond(self, build):
+        self.requests += 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            if self.error_mode == "quota":
+                return web.json_response({"status": "OVER_QUERY_LIMIT"})
+            return web.json_response({"status": "UNKNOWN_ERROR"}, status=500)
+        return web.json_response(build())
+
+    def route(self, origin, destination):
+        """Synthetic (distance_meters, duration_seconds) between two points."""
+        lat1, lon1, lat2, lon2 = map(math.radians, (*origin, *destination))
+        a = (math.sin((lat2 - lat1) / 2) ** 2
+             + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+        distance_km = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a)) * self.road_factor
+        return int(distance_km * 1000), int(distance_km / self.speed_kmh * 3600)
+
+    @staticmethod
+    def _point(value):
+        lat, lon = value.split(",")
+        return float(lat), float(lon)
+
+    @staticmethod
+    def _values(distance_meters, duration_seconds):
+        minutes = max(1, round(duration_seconds / 60))
+        return {
+            "distance": {"value": distance_meters, "text": f"{distance_meters / 1000:.1f} km"},
+            "duration": {"value": duration_seconds, "text": f"{minutes} min{'s' if minutes != 1 else ''}"},
+        }
+
+    async def directions(self, request):
+        def build():
+            try:
+                origin = self._point(request.query["origin"])
+                destination = self._point(request.query["destination"])
+            except (KeyError, ValueError):
+                return {"status": "INVALID_REQUEST", "routes": []}
+            leg = self._values(*self.route(origin, destination))
+            return {"status": "OK", "routes": [{"legs": [leg]}]}
+
+        return await self._respond(build)
+
+    async def distance_matrix(self, request):
+        def build():
+            try:
+                origins = [self._point(p) for p in request.query["origins"].split("|")]
+                destinations = [self._point(p) for p in request.query["destinations"].split("|")]
+            except (KeyError, ValueError):
+                return {"status": "INVALID_REQUEST", "rows": []}
+            rows = [
+                {"elements": [
+                    {"status": "OK", **self._values(*self.route(origin, destination))}
+                    for destination in destinations
+                ]}
+                for origin in origins
+            ]
+            return {"status": "OK", "rows": rows}
+
+        return await self._respond(build)
+
+    async def geocode(self, request):
+        def build():
+            if "latlng" in request.query:
+                try:
+                    lat, lon = self._point(request.query["latlng"])
+                except ValueError:
+                    return {"status": "INVALID_REQUEST", "results": []}
+                number = int(abs(lat * 1000 + lon * 1000)) % 200 + 1
+                address = f"{number} Stub Street, {lat:.3f}, {lon:.3f}"
+                return {"status": "OK", "results": [{"formatted_address": address}]}
+
+            address = request.query.get("address", "").strip()
+            if not address:
+                return {"status": "ZERO_RESULTS", "results": []}
+            digest = hashlib.sha1(address.lower().encode()).digest()
+            lat = GEOCODE_ORIGIN[0] + (digest[0] / 255 - 0.5) * GEOCODE_SPAN_DEGREES
+            lon = GEOCODE_ORIGIN[1] + (digest[1] / 255 - 0.5) * GEOCODE_SPAN_DEGREES
+            return {"status": "OK", "results": [{
+                "formatted_address": address,
+                "geometry": {"location": {"lat": round(lat, 6), "lng": round(lon, 6)}},
+            }]}
+
+        return await self._respond(build)
+
+
+@contextlib.asynccontextmanager
+async def maps_stub_server(host="127.0.0.1", port=0, **options):
+    """
+    Run a MapsStub on the current event loop and yield (base_url, stub).
+    Port 0 picks a free port.
+    """
+    stub = MapsStub(**options)
+    runner = web.AppRunner(stub.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = runner.addresses[0][1]
+    try:
+        yield f"http://{host}:{bound_port}", stub
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake Google Maps responses.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-mode", choices=["http", "quota"], default="http")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    stub = MapsStub(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                    error_mode=args.error_mode, seed=args.seed)
+    web.run_app(stub.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABLE = "trips_driverlocationpoint"
+
+
+def create_table(apps, schema_editor):
+    """
+    On PostgreSQL create the history table range-partitioned by month on
+    recorded_at (partitions are added on demand by trips.location_history).
+    Elsewhere create a plain table.
+    """
+    model = apps.get_model("trips", "DriverLocationPoint")
+    if schema_editor.connection.vendor != "postgresql":
+        schema_editor.create_model(model)
+        return
+    schema_editor.execute(
+        f"""
+        CREATE TABLE "{TABLE}" (
+            "id" bigint GENERATED BY DEFAULT AS IDENTITY,
+            "driver_id" uuid NOT NULL,
+            "recorded_at" timestamp with time zone NOT NULL,
+            "lat_e6" integer NOT NULL,
+            "lon_e6" integer NOT NULL,
+            "speed" smallint NULL,
+            "heading" smallint NULL,
+            PRIMARY KEY ("id", "recorded_at")
+        ) PARTITION BY RANGE ("recorded_at")
+        """
+    )
+    schema_editor.execute(
+        f'CREATE INDEX "driverloc_driver_time_idx" ON "{TABLE}" ("driver_id", "recorded_at")'
+    )
+
+
+def drop_table(apps, schema_editor):
+    schema_editor.execute(f'DROP TABLE IF EXISTS "{TABLE}" CASCADE')
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("authentication", "0006_driver_available_latlon_idx"),
+        ("trips", "0003_geocoderesult"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="DriverLocationPoint",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        ("recorded_at", models.DateTimeField()),
+                        ("lat_e6", models.IntegerField()),
+                        ("lon_e6", models.IntegerField()),
+                        ("speed", models.SmallIntegerField(blank=True, null=True)),
+                        ("heading", models.SmallIntegerField(blank=True, null=True)),
+                        (
+                            "driver",
+                            models.ForeignKey(
+                                db_constraint=False,
+                                db_index=False,
+                                on_delete=django.db.models.deletion.DO_NOTHING,
+                                related_name="location_history",
+                                to="authentication.driver",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "indexes": [
+                            models.Index(
+                                fields=["driver", "recorded_at"],
+                                name="driverloc_driver_time_idx",
+                            )
+                        ],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_table, drop_table),
+    ]
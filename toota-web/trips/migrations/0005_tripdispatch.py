@@ -0,0 +1,46 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0004_driverlocationpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TripDispatch",
+            fields=[
+                (
+                    "trip",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="dispatch",
+                        serialize=False,
+                        to="trips.trip",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("searching", "Searching"),
+                            ("matched", "Matched"),
+                            ("no driver", "No driver"),
+                        ],
+                        default="searching",
+                        max_length=20,
+                    ),
+                ),
+                ("wave", models.PositiveSmallIntegerField(default=0)),
+                ("offered", models.JSONField(blank=True, default=list)),
+                ("heartbeat_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0005_tripdispatch"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="tripdispatch",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("searching", "Searching"),
+                    ("matched", "Matched"),
+                    ("no driver", "No driver"),
+                    ("cancelled", "Cancelled"),
+                ],
+                default="searching",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -1,9 +1,13 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from django.core.validators import MinLengthValidator
 import uuid
 from django.contrib.auth import get_user_model
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from authentication.models import Driver
+from .driver_index import driver_index
+from .driver_profile import PROFILE_SOURCE_FIELDS, invalidate_driver_profile
 
 User = get_user_model()  # Get the user model dynamically
 class Trip(models.Model):
@@ -76,6 +80,32 @@ class Trip(models.Model):
     def __str__(self):
         return f"{self.pickup} to {self.destination} and status is {self.status}"
 
+    def save_fields(self, *fields):
+        """Write only `fields` (plus updated_at) in a single UPDATE."""
+        self.save(update_fields={*fields, "updated_at"})
+
+    @classmethod
+    def accept(cls, trip_id, driver):
+        """
+        Give a pending, unassigned trip to `driver` and mark the driver
+        unavailable, as two conditional UPDATEs in one transaction. Returns
+        True if this driver won the trip, False if it was already taken or
+        the driver is no longer available (nothing is changed then).
+        """
+        with transaction.atomic():
+            won = cls.objects.filter(
+                id=trip_id, status=cls.StatusChoices.PENDING, driver__isnull=True
+            ).update(driver=driver, status=cls.StatusChoices.ACCEPTED, updated_at=timezone.now())
+            if not won:
+                return False
+            if not Driver.objects.filter(id=driver.id, is_available=True).update(is_available=False):
+                transaction.set_rollback(True)
+                return False
+        # Queryset updates skip post_save, so keep the search index in step here.
+        driver.is_available = False
+        driver_index.remove(driver.id)
+        return True
+
     def calculate_fare(self, distance_km, estimated_time_minutes, surge=False):
         """
         Calculate the total fare based on:
@@ -94,6 +124,31 @@ class Trip(models.Model):
         
         return round(total_fare, 2)
 
+class TripDispatch(models.Model):
+    """
+    Durable dispatch state of a confirmed trip, so dispatch survives the
+    passenger's socket and the worker running it. `offered` lists the
+    drivers sent the trip so far; the dispatcher refreshes `heartbeat_at`
+    every wave, and a searching trip with a stale heartbeat may be taken
+    over by another worker.
+    """
+    class StatusChoices(models.TextChoices):
+        SEARCHING = "searching", "Searching"
+        MATCHED = "matched", "Matched"
+        NO_DRIVER = "no driver", "No driver"
+        CANCELLED = "cancelled", "Cancelled"
+
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, primary_key=True, related_name="dispatch")
+    status = models.CharField(choices=StatusChoices.choices, default=StatusChoices.SEARCHING, max_length=20)
+    wave = models.PositiveSmallIntegerField(default=0)
+    offered = models.JSONField(default=list, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Dispatch of {self.trip_id}: {self.status} (wave {self.wave})"
+
 class DriverRating(models.Model):
     driver = models.ForeignKey("authentication.Driver", related_name='ratings', on_delete=models.CASCADE)
     user = models.ForeignKey("authentication.User", related_name='reviews', null=True, blank=True, on_delete=models.SET_NULL)
@@ -106,10 +161,67 @@ class DriverRating(models.Model):
     def __str__(self):
         return f"Rating for {self.driver.email} by {self.user.email if self.user else 'Anonymous'}: {self.rating}"
 
+class GeocodeResult(models.Model):
+    """
+    Persistent cache of forward geocodes keyed by a normalized address.
+    A row with null coordinates is a cached "no results" answer.
+    """
+    address_key = models.CharField(max_length=512, unique=True)
+    address = models.TextField()
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.address_key} -> {self.latitude}, {self.longitude}"
+
+class DriverLocationPoint(models.Model):
+    """
+    One entry in a driver's append-only location history.
+
+    Coordinates are int32 fixed point (degrees * 1e6, ~11 cm), speed is whole
+    km/h and heading whole degrees, to keep rows small. On PostgreSQL the
+    table is range-partitioned by month on recorded_at (see
+    trips.location_history). There is no FK constraint, so history can
+    outlive the driver row until it is pruned.
+    """
+    driver = models.ForeignKey(
+        "authentication.Driver", on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+        related_name="location_history"
+    )
+    recorded_at = models.DateTimeField()
+    lat_e6 = models.IntegerField()
+    lon_e6 = models.IntegerField()
+    speed = models.SmallIntegerField(null=True, blank=True)
+    heading = models.SmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["driver", "recorded_at"], name="driverloc_driver_time_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.driver_id} at {self.recorded_at}: {self.lat_e6 / 1e6}, {self.lon_e6 / 1e6}"
+
 @receiver(post_save, sender=DriverRating)
 def update_driver_rating_on_save(sender, instance, **kwargs):
     instance.driver.update_rating()
 
 @receiver(post_delete, sender=DriverRating)
 def update_driver_rating_on_delete(sender, instance, **kwargs):
-    instance.driver.update_rating()
\ No newline at end of file
+    instance.driver.update_rating()
+
+@receiver(post_save, sender=Driver)
+def sync_driver_index_on_save(sender, instance, **kwargs):
+    driver_index.sync_driver(instance)
+
+@receiver(post_save, sender=Driver)
+def invalidate_driver_profile_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or PROFILE_SOURCE_FIELDS.intersection(update_fields):
+        invalidate_driver_profile(instance.id)
+
+@receiver(post_delete, sender=Driver)
+def remove_driver_from_index_on_delete(sender, instance, **kwargs):
+    driver_index.remove(instance.id)
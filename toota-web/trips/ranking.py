@@ -0,0 +1,62 @@
+import math
+import numpy as np
+from geopy.distance import geodesic
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat, lon, lats, lons):
+    """
+    Great-circle distances in km from (lat, lon) to every point in the
+    `lats`/`lons` arrays, computed in one vectorized pass.
+    """
+    lat_r = np.radians(lat)
+    lats_r = np.radians(np.asarray(lats, dtype=np.float64))
+    d_lat = lats_r - lat_r
+    d_lon = np.radians(np.asarray(lons, dtype=np.float64)) - np.radians(lon)
+    a = np.sin(d_lat / 2) ** 2 + np.cos(lat_r) * np.cos(lats_r) * np.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def point_distance_km(lat1, lon1, lat2, lon2):
+    """Haversine distance in km between two points, for single pairs."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def initial_bearing(lat1, lon1, lat2, lon2):
+    """Compass bearing in degrees (0-360) from the first point towards the second."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    d_lon = lon2 - lon1
+    x = math.sin(d_lon) * math.cos(lat2)
+    y = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(d_lon)
+    return math.degrees(math.atan2(x, y)) % 360
+
+
+def rank_nearest(lat, lon, lats, lons, k, refine=False):
+    """
+    Return (positions, distances_km) of the `k` points nearest to (lat, lon),
+    nearest first. `positions` index into `lats`/`lons`.
+
+    Candidates are ranked by haversine with `argpartition`, so only the top
+    `k` are sorted. With `refine=True` those `k` are re-measured with geopy's
+    ellipsoidal `geodesic` for display accuracy and re-sorted.
+    """
+    lat, lon = float(lat), float(lon)
+    distances = haversine_km(lat, lon, lats, lons)
+    n = distances.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+    k = min(k, n)
+    top = np.argpartition(distances, k - 1)[:k] if k < n else np.arange(n)
+    top_distances = distances[top]
+
+    if refine:
+        top_distances = np.array([
+            geodesic((lat, lon), (lats[i], lons[i])).km for i in top
+        ])
+
+    order = np.argsort(top_distances, kind="stable")
+    return top[order], top_distances[order]
@@ -1,7 +1,8 @@
 from django.urls import path
 from .consumers import (DriverLocationConsumer, UserGetLocationConsumer,
                         TripRequestConsumer, DriverTripConsumer, UpdateTripStatusConsumer,
-                        UserGetAvailableDrivers)
+                        UserGetAvailableDrivers, DispatchWorkerConsumer)
+from .dispatch import DISPATCH_CHANNEL
 
 websocket_urlpatterns = [
     path("ws/trips/driver/location/", DriverLocationConsumer.as_asgi()),
@@ -11,3 +12,8 @@ websocket_urlpatterns = [
     path("ws/trips/status/<str:trip_id>/", UpdateTripStatusConsumer.as_asgi()),
     path("ws/trips/drivers/all/", UserGetAvailableDrivers.as_asgi())
 ]
+
+# Background channels served by `python manage.py runworker <channel>`
+channel_name_patterns = {
+    DISPATCH_CHANNEL: DispatchWorkerConsumer.as_asgi(),
+}
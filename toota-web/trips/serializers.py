@@ -1,3 +1,6 @@
+from decimal import Decimal
+from functools import lru_cache
+from cloudinary.models import CloudinaryField
 from rest_framework import serializers
 from authentication.models import Driver
 from trips.models import DriverRating
@@ -6,7 +9,53 @@ class FindDriversSerializer(serializers.ModelSerializer):
     class Meta:
         model = Driver
         exclude = ['password', 'last_login', 'is_superuser', 'is_staff', 'is_active', 'groups', 'user_permissions', 'created_at', 'updated_at',
-                  'license_number', 'license_expiry', 'number_plate', 'physical_address', 'vehicle_registration', 'earnings']
+                  'physical_address', 'vehicle_registration', 'earnings']
+
+def _to_str(value):
+    return None if value is None else str(value)
+
+
+def _decimal_to_str(places):
+    quantum = Decimal(1).scaleb(-places)
+    def convert(value):
+        return None if value is None else "{:f}".format(value.quantize(quantum))
+    return convert
+
+
+@lru_cache(maxsize=None)
+def find_drivers_projection():
+    """
+    Columns and per-column converters that reproduce FindDriversSerializer's
+    output from a `.values()` row. The field list is read from the serializer
+    once, so the lean payload keeps the same schema.
+    """
+    converters = {}
+    for name, field in FindDriversSerializer().fields.items():
+        model_field = Driver._meta.get_field(name)
+        if isinstance(model_field, CloudinaryField):
+            converters[name] = model_field.get_prep_value
+        elif isinstance(field, serializers.DecimalField):
+            converters[name] = _decimal_to_str(field.decimal_places)
+        elif isinstance(field, (serializers.UUIDField, serializers.CharField)):
+            converters[name] = _to_str
+        else:
+            converters[name] = None
+    return tuple(converters), converters
+
+
+def serialize_driver_rows(rows):
+    """
+    Fast path for FindDriversSerializer: turns `.values(*fields)` rows into
+    plain dicts without instantiating a DRF serializer per driver.
+    """
+    fields, converters = find_drivers_projection()
+    return [
+        {
+            name: converters[name](row[name]) if converters[name] else row[name]
+            for name in fields
+        }
+        for row in rows
+    ]
 
 class CheckTripStatusSerializer(serializers.Serializer):
     trip_id = serializers.UUIDField(required=True)
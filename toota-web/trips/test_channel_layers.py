@@ -0,0 +1,140 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import uuid
+from types import SimpleNamespace
+from unittest.mock import patch
+import pytest
+from toota.channel_layers import DISPATCH, LOCATIONS, build_channel_layers
+
+# Cross-process delivery needs a real Redis, e.g.
+#   CHANNEL_TEST_REDIS_URLS=redis://localhost:6379/0,redis://localhost:6379/1 pytest trips/test_channel_layers.py
+REDIS_URLS = [url for url in os.environ.get("CHANNEL_TEST_REDIS_URLS", "").split(",") if url]
+
+
+def test_channel_layers_fall_back_to_memory_and_shard_across_redis_hosts():
+    layers = build_channel_layers([])
+    assert {alias: layer["BACKEND"] for alias, layer in layers.items()} == {
+        DISPATCH: "channels.layers.InMemoryChannelLayer",
+        LOCATIONS: "channels.layers.InMemoryChannelLayer",
+    }
+
+    hosts = ["redis://a:6379/0", "redis://b:6379/0"]
+    layers = build_channel_layers(hosts, dispatch_capacity=500, locations_expiry=3)
+    assert layers[DISPATCH]["CONFIG"]["hosts"] == hosts
+    assert layers[LOCATIONS]["CONFIG"]["hosts"] == hosts
+    assert layers[DISPATCH]["CONFIG"]["capacity"] == 500
+    assert layers[LOCATIONS]["CONFIG"]["expiry"] == 3
+    assert layers[DISPATCH]["CONFIG"]["prefix"] != layers[LOCATIONS]["CONFIG"]["prefix"]
+
+
+@pytest.mark.django_db
+def test_runtime_stats_reports_in_process_counters(client):
+    body = client.get("/health/stats/").json()
+    assert set(body["location_policy"]["dropped"]) == {"invalid", "too_soon", "too_close", "too_fast"}
+    assert set(body["maps_caches"]) == {"routes", "geocodes", "reverse_geocodes"}
+    assert "hit_rate" in body["maps_caches"]["routes"]
+
+
+def test_redis_channel_layer_without_shared_cache_is_flagged(settings):
+    from trips.checks import check_shared_caches
+
+    assert check_shared_caches(None) == []
+    settings.CHANNEL_LAYERS = build_channel_layers(["redis://redis-1:6379/0"])
+    assert [error.id for error in check_shared_caches(None)] == ["trips.W001"]
+
+
+def test_channel_layer_health_check(client):
+    response = client.get("/health/channels/")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["healthy"] is True
+    assert set(body["layers"]) == {DISPATCH, LOCATIONS}
+
+
+def run_driver_node(driver_id, ready, received):
+    """
+    A second "node": a fresh process whose consumers talk to Redis only. It
+    connects a driver's trip socket and location socket, then reports every
+    frame they receive.
+    """
+    import django
+    django.setup()
+    from asgiref.sync import async_to_sync
+    from channels.testing import WebsocketCommunicator
+    from trips.consumers import DriverLocationConsumer, DriverTripConsumer
+
+    driver = SimpleNamespace(id=driver_id, is_authenticated=True, is_available=True, is_online=True)
+
+    async def is_driver(self, user):
+        return True
+
+    async def run():
+        sockets = []
+        for consumer in (DriverTripConsumer, DriverLocationConsumer):
+            communicator = WebsocketCommunicator(consumer.as_asgi(), "/")
+            communicator.scope["user"] = driver
+            connected, _ = await communicator.connect()
+            assert connected
+            sockets.append(communicator)
+        ready.set()
+        pending = 2
+        while pending:
+            for communicator in sockets:
+                try:
+                    frame = json.loads(await communicator.receive_from(timeout=0.2))
+                except asyncio.TimeoutError:
+                    continue
+                if frame["type"] != "ping":
+                    received.put(frame)
+                    pending -= 1
+        for communicator in sockets:
+            await communicator.disconnect()
+
+    with patch.object(DriverTripConsumer, "is_driver", is_driver), \
+            patch.object(DriverLocationConsumer, "is_driver", is_driver):
+        async_to_sync(run)()
+
+
+@pytest.mark.skipif(not REDIS_URLS, reason="set CHANNEL_TEST_REDIS_URLS to run against Redis")
+def test_trip_requests_and_location_updates_cross_processes(monkeypatch):
+    from channels_redis.core import RedisChannelLayer
+
+    # The child builds its CHANNEL_LAYERS from the environment at startup.
+    monkeypatch.setenv("CHANNEL_REDIS_HOSTS", ",".join(REDIS_URLS))
+    monkeypatch.setenv("CHANNEL_LAYER_PREFIX", f"test-{uuid.uuid4().hex[:8]}")
+    layers = build_channel_layers(REDIS_URLS, prefix=os.environ["CHANNEL_LAYER_PREFIX"])
+
+    context = multiprocessing.get_context("spawn")
+    ready, received = context.Event(), context.Queue()
+    driver_id = uuid.uuid4()
+    node = context.Process(target=run_driver_node, args=(driver_id, ready, received))
+    node.start()
+    try:
+        assert ready.wait(timeout=30), "driver node did not connect"
+
+        async def send_from_this_node():
+            dispatch = RedisChannelLayer(**layers[DISPATCH]["CONFIG"])
+            locations = RedisChannelLayer(**layers[LOCATIONS]["CONFIG"])
+            await dispatch.group_send(f"driver_{driver_id}", {
+                "type": "trip_request_notification",
+                "data": {"trip_id": "t-1", "pickup": "Sandton City"},
+            })
+            await locations.group_send(f"driver_{driver_id}", {
+                "type": "driver_location_update",
+                "driver_details": {"id": str(driver_id), "latitude": -26.2, "longitude": 28.0},
+            })
+            await dispatch.close_pools()
+            await locations.close_pools()
+
+        asyncio.run(send_from_this_node())
+        frames = [received.get(timeout=10) for _ in range(2)]
+    finally:
+        node.join(timeout=10)
+        if node.is_alive():
+            node.terminate()
+
+    assert {frame["type"] for frame in frames} == {"new_trip_request", "driver_location_update"}
+    trip_request = next(frame for frame in frames if frame["type"] == "new_trip_request")
+    assert trip_request["trip_details"]["trip_id"] == "t-1"
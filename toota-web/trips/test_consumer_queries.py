@@ -0,0 +1,107 @@
+import json
+from unittest.mock import patch
+import pytest
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from trips.consumers import DriverTripConsumer, TripRequestConsumer, UpdateTripStatusConsumer
+from trips.models import Trip
+
+# Consumers run under async_to_sync so their database_sync_to_async calls use
+# this thread's connection, which django_assert_num_queries watches. Counts
+# include the role check done on connect.
+
+
+def run_action(consumer, user, message, path="/", url_route=None):
+    async def run():
+        communicator = WebsocketCommunicator(consumer.as_asgi(), path)
+        communicator.scope["user"] = user
+        if url_route:
+            communicator.scope["url_route"] = {"kwargs": url_route}
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.send_to(text_data=json.dumps(message))
+        while True:
+            response = json.loads(await communicator.receive_from(timeout=5))
+            if response.get("type") != "ping":
+                break
+        await communicator.disconnect()
+        return response
+
+    return async_to_sync(run)()
+
+
+def test_create_trip_is_a_single_insert(trip_setup, django_assert_num_queries):
+    user, _, _ = trip_setup
+    route = {"distance_meters": 12000, "duration_seconds": 1200}
+
+    async def coordinates(address):
+        return (-26.1, 28.05)
+
+    async def route_data(*args, **kwargs):
+        return route
+
+    with patch("trips.consumers.get_coordinates", side_effect=coordinates), \
+            patch("trips.consumers.get_google_route_data", side_effect=route_data), \
+            django_assert_num_queries(2) as captured:
+        response = run_action(TripRequestConsumer, user, {
+            "action": "create_trip", "vehicle_type": "Bakkie",
+            "pickup": "Sandton City", "destination": "Rosebank Mall",
+        })
+
+    assert response["type"] == "trip_created"
+    assert response["estimated"] is False
+    writes = [q["sql"] for q in captured.captured_queries if not q["sql"].startswith("SELECT")]
+    assert len(writes) == 1 and writes[0].startswith("INSERT")
+    assert Trip.objects.get(id=response["trip_id"]).accepted_fare == pytest.approx(response["estimated_fare"])
+
+
+def test_create_trip_flags_a_locally_estimated_route(trip_setup):
+    user, _, _ = trip_setup
+
+    async def coordinates(address):
+        return (-26.1, 28.05)
+
+    async def route_data(*args, **kwargs):
+        return {"distance_meters": 9000, "duration_seconds": 900, "estimated": True}
+
+    with patch("trips.consumers.get_coordinates", side_effect=coordinates), \
+            patch("trips.consumers.get_google_route_data", side_effect=route_data):
+        response = run_action(TripRequestConsumer, user, {
+            "action": "create_trip", "vehicle_type": "Bakkie",
+            "pickup": "Sandton City", "destination": "Rosebank Mall",
+        })
+
+    assert response["type"] == "trip_created"
+    assert response["estimated"] is True
+
+
+def test_driver_accept_is_two_conditional_updates(trip_setup, django_assert_num_queries):
+    _, driver, trip = trip_setup
+
+    # connect check, trip, payment, then SAVEPOINT / 2 UPDATEs / RELEASE
+    with django_assert_num_queries(7) as captured:
+        response = run_action(DriverTripConsumer, driver, {"trip_id": str(trip.id), "driver_response": "accept"})
+
+    assert response["type"] == "trip_status_update"
+    writes = [q["sql"] for q in captured.captured_queries if q["sql"].startswith("UPDATE")]
+    assert len(writes) == 2
+    assert all("vehicle_registration" not in sql and "pickup" not in sql for sql in writes)
+    assert '"status" = \'pending\'' in writes[0] and '"driver_id" IS NULL' in writes[0]
+    assert '"is_available"' in writes[1].split("WHERE")[1]
+    trip.refresh_from_db()
+    driver.refresh_from_db()
+    assert (trip.status, trip.driver_id, driver.is_available) == ("accepted", driver.id, False)
+
+
+def test_status_update_writes_status_once(trip_setup, django_assert_num_queries):
+    _, driver, trip = trip_setup
+
+    with django_assert_num_queries(4) as captured:
+        response = run_action(UpdateTripStatusConsumer, driver, {"status": "picked up"},
+                              url_route={"trip_id": str(trip.id)})
+
+    assert response["type"] == "trip_status_update"
+    writes = [q["sql"] for q in captured.captured_queries if q["sql"].startswith("UPDATE")]
+    assert len(writes) == 1
+    trip.refresh_from_db()
+    assert trip.status == "picked up"
@@ -0,0 +1,86 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+import pytest
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from toota.channel_layers import LOCATIONS
+from trips.consumers import DriverLocationConsumer
+from trips.dead_reckoning import DeadReckoningPolicy, predict_position
+from trips.driver_index import DriverGridIndex
+from trips.location_buffer import LocationBuffer
+from trips.location_policy import LocationPolicy
+
+
+def test_dead_reckoning_suppresses_fixes_the_client_can_predict():
+    policy = DeadReckoningPolicy(window=3, tolerance_m=25.0, max_silence=10.0)
+    track = policy.new_track()
+    # Driving due east at ~36 km/h: one fix every 2 s, ~20 m apart.
+    east = [predict_position(-26.2, 28.0, 36.0, 90.0, t) for t in range(0, 20, 2)]
+
+    sent = []
+    for t, (lat, lon) in zip(range(0, 20, 2), east):
+        speed, heading = track.add(lat, lon, t)
+        if policy.should_broadcast(track, lat, lon, t):
+            policy.mark_sent(track, lat, lon, speed, heading, t)
+            sent.append(t)
+    assert speed == pytest.approx(36.0, rel=0.01)
+    assert heading == pytest.approx(90.0, abs=0.1)
+    # The first fix has no motion, so the next broadcast comes once the driver
+    # is 25 m off it; after that only the silence limit triggers one.
+    assert sent == [0, 4, 14]
+
+    # A sharp turn breaks the prediction straight away.
+    lat, lon = predict_position(*east[-1], 36.0, 0.0, 2)
+    track.add(lat, lon, 20)
+    assert policy.should_broadcast(track, lat, lon, 20)
+    assert policy.stats() == {"broadcast": 4, "suppressed": 7}
+
+
+def test_driver_who_stops_is_broadcast_once_at_zero_speed(trip_setup):
+    _, driver, _ = trip_setup
+    clock = [1000.0]
+    # Heading east at ~36 km/h, one fix every 3 s (~30 m), then parked.
+    moving = [predict_position(-26.2, 28.0, 36.0, 90.0, 3 * i) for i in range(5)]
+    parked = [moving[-1]] * 3
+
+    async def run():
+        layer = get_channel_layer(LOCATIONS)
+        passenger = await layer.new_channel()
+        await layer.group_add(f"driver_{driver.id}", passenger)
+        communicator = WebsocketCommunicator(DriverLocationConsumer.as_asgi(), "/")
+        communicator.scope["user"] = driver
+        assert (await communicator.connect())[0]
+
+        broadcasts = []
+        for lat, lon in moving + parked:
+            clock[0] += 3
+            await communicator.send_to(text_data=json.dumps({"latitude": lat, "longitude": lon}))
+            while True:
+                frame = json.loads(await communicator.receive_from(timeout=5))
+                if frame["type"] != "ping" and "driver_details" not in frame:
+                    break
+            try:
+                while True:
+                    message = await asyncio.wait_for(layer.receive(passenger), 0.05)
+                    broadcasts.append(message["driver_details"])
+            except asyncio.TimeoutError:
+                pass
+        await communicator.disconnect()
+        return broadcasts
+
+    # Only the consumer's clock is faked; the event loop keeps real time.
+    with patch("trips.consumers.time", SimpleNamespace(monotonic=lambda: clock[0])), \
+            patch("trips.consumers.location_policy", LocationPolicy()), \
+            patch("trips.consumers.dead_reckoning", DeadReckoningPolicy(max_silence=60.0)), \
+            patch("trips.consumers.driver_index", DriverGridIndex()), \
+            patch("trips.consumers.location_buffer", LocationBuffer()), \
+            patch.object(DriverLocationConsumer, "schedule_current_location_update"):
+        broadcasts = async_to_sync(run)()
+
+    assert broadcasts[-2]["speed_kmh"] == pytest.approx(36.0, rel=0.05)
+    stop = broadcasts[-1]
+    assert (stop["speed_kmh"], stop["heading"]) == (0.0, None)
+    assert (stop["latitude"], stop["longitude"]) == pytest.approx(moving[-1])
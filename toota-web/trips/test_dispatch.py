@@ -0,0 +1,366 @@
+import asyncio
+import datetime
+import io
+import json
+import time
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import ChannelNameRouter
+from channels.testing import WebsocketCommunicator
+from channels.worker import Worker
+from django.core.management import call_command
+from django.utils import timezone
+from authentication.models import Driver
+from trips.consumers import DriverTripConsumer, TripRequestConsumer
+from trips.dispatch import DISPATCH_CHANNEL, DispatchStrategy, OpenOffers, TripDispatcher
+from trips.routing import channel_name_patterns
+from trips.models import Trip, TripDispatch
+
+# Like test_consumer_queries, consumers run under async_to_sync so their
+# database calls share the test thread's connection.
+
+
+async def connect(consumer, user):
+    communicator = WebsocketCommunicator(consumer.as_asgi(), "/")
+    communicator.scope["user"] = user
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+async def receive(communicator, timeout=5):
+    """The next frame that is not a ping."""
+    while True:
+        frame = json.loads(await communicator.receive_from(timeout=timeout))
+        if frame.get("type") != "ping":
+            return frame
+
+
+def offer_to(*drivers):
+    async def available_drivers(trip):
+        return [{"id": str(driver.id)} for driver in drivers]
+    return patch("trips.dispatch.available_drivers", available_drivers)
+
+
+def dispatch_with(**options):
+    strategy = DispatchStrategy(**options)
+    return strategy, patch("trips.dispatch.dispatch_strategy", strategy)
+
+
+def more_drivers(*emails):
+    return [
+        Driver.objects.create_user(
+            email=email, password="testpass123", latitude=-26.21, longitude=28.01,
+            vehicle_type="bakkie", is_available=True, is_online=True
+        )
+        for email in emails
+    ]
+
+
+def test_driver_accept_assigns_without_waiting_out_the_timeout(trip_setup):
+    user, driver, trip = trip_setup
+
+    async def run():
+        rider = await connect(TripRequestConsumer, user)
+        driver_socket = await connect(DriverTripConsumer, driver)
+        await rider.send_to(text_data=json.dumps({"action": "confirm_trip", "trip_id": str(trip.id)}))
+        assert (await receive(rider))["type"] == "searching_driver"
+        assert (await receive(rider))["type"] == "dispatch_progress"
+        assert (await receive(driver_socket))["type"] == "new_trip_request"
+
+        started = time.monotonic()
+        await driver_socket.send_to(text_data=json.dumps({"trip_id": str(trip.id), "driver_response": "accept"}))
+        frames = [await receive(rider), await receive(rider)]
+        elapsed = time.monotonic() - started
+        await rider.disconnect()
+        await driver_socket.disconnect()
+        return frames, elapsed
+
+    with offer_to(driver):
+        frames, elapsed = async_to_sync(run)()
+
+    assert [frame["type"] for frame in frames] == ["trip_status_update", "driver_assigned"]
+    assert frames[1]["driver_info"]["id"] == str(driver.id)
+    assert elapsed < 2  # the per-driver deadline is 30 s
+    trip.refresh_from_db()
+    assert (trip.status, trip.driver_id) == ("accepted", driver.id)
+    assert TripDispatch.objects.get(trip=trip).status == "matched"
+
+
+def test_driver_reject_moves_on_to_the_next_wave_immediately(trip_setup):
+    user, first, trip = trip_setup
+    second, = more_drivers("second@example.com")
+    _, one_at_a_time = dispatch_with(wave_size=1, growth=1)
+
+    async def run():
+        rider = await connect(TripRequestConsumer, user)
+        first_socket = await connect(DriverTripConsumer, first)
+        second_socket = await connect(DriverTripConsumer, second)
+        await rider.send_to(text_data=json.dumps({"action": "confirm_trip", "trip_id": str(trip.id)}))
+        await receive(rider)
+        await receive(rider)
+        assert (await receive(first_socket))["type"] == "new_trip_request"
+
+        started = time.monotonic()
+        await first_socket.send_to(text_data=json.dumps({"trip_id": str(trip.id), "driver_response": "reject"}))
+        offer = await receive(second_socket)
+        elapsed = time.monotonic() - started
+        progress = await receive(rider)
+        assert (progress["type"], progress["wave"], progress["drivers_offered"]) == ("dispatch_progress", 2, 2)
+        for communicator in (rider, first_socket, second_socket):
+            await communicator.disconnect()
+        return offer, elapsed
+
+    with offer_to(first, second), one_at_a_time:
+        offer, elapsed = async_to_sync(run)()
+
+    assert offer["type"] == "new_trip_request"
+    assert offer["trip_details"]["trip_id"] == str(trip.id)
+    assert elapsed < 2
+
+
+def test_first_accept_in_a_wave_wins_and_the_others_are_told_it_was_taken(trip_setup):
+    user, first, trip = trip_setup
+    second, third = more_drivers("second@example.com", "third@example.com")
+    strategy, waves = dispatch_with(wave_size=3)
+
+    async def run():
+        rider = await connect(TripRequestConsumer, user)
+        sockets = [await connect(DriverTripConsumer, driver) for driver in (first, second, third)]
+        await rider.send_to(text_data=json.dumps({"action": "confirm_trip", "trip_id": str(trip.id)}))
+        await receive(rider)
+        await receive(rider)
+        # The whole wave is offered the trip at once
+        assert [(await receive(socket))["type"] for socket in sockets] == ["new_trip_request"] * 3
+
+        await sockets[1].send_to(text_data=json.dumps({"trip_id": str(trip.id), "driver_response": "accept"}))
+        await receive(sockets[1])
+        assigned = [await receive(rider), await receive(rider)][1]
+        cancelled = [await receive(sockets[0]), await receive(sockets[2])]
+        # A losing driver who answers late is told the same
+        await sockets[0].send_to(text_data=json.dumps({"trip_id": str(trip.id), "driver_response": "accept"}))
+        late = await receive(sockets[0])
+        for communicator in (rider, *sockets):
+            await communicator.disconnect()
+        return assigned, cancelled, late
+
+    with offer_to(first, second, third), waves:
+        assigned, cancelled, late = async_to_sync(run)()
+
+    assert assigned["driver_info"]["id"] == str(second.id)
+    assert all(frame == {"type": "trip_offer_cancelled", "trip_id": str(trip.id), "reason": "taken"}
+               for frame in cancelled + [late])
+    trip.refresh_from_db()
+    assert trip.driver_id == second.id
+    stats = strategy.stats()
+    assert (stats["matched"], stats["unmatched"]) == (1, 0)
+    assert [(wave["wave"], wave["offers"], wave["matched"]) for wave in stats["waves"]] == [(1, 3, 1)]
+
+
+def test_waves_grow_up_to_the_maximum():
+    strategy = DispatchStrategy(wave_size=2, growth=2, max_wave_size=5)
+    assert [len(wave) for wave in strategy.waves(list(range(12)))] == [2, 4, 5, 1]
+    assert [len(wave) for wave in DispatchStrategy(wave_size=1, growth=1).waves([1, 2, 3])] == [1, 1, 1]
+
+
+def test_open_offers_end_early_once_every_driver_rejected():
+    async def run():
+        offers = OpenOffers()
+        offers.add(["a", "b"])
+        assert offers.answer("a", "reject") and offers.answer("b", "reject")
+        assert not offers.answer("c", "accept")
+        started = time.monotonic()
+        assert await offers.first_accept(timeout=5) is None
+        return time.monotonic() - started
+
+    assert async_to_sync(run)() < 1
+
+
+def test_deadline_falls_back_to_the_trip_row(trip_setup):
+    _, driver, trip = trip_setup
+    Trip.objects.filter(id=trip.id).update(status="accepted", driver=driver)
+    dispatcher = TripDispatcher(consumer=None)
+
+    async def run():
+        offers = OpenOffers()
+        offers.add([driver.id])
+        return await dispatcher.await_driver_response(str(trip.id), offers, wait_time=0.05)
+
+    assert async_to_sync(run)() == str(driver.id)
+
+
+def test_only_one_driver_can_accept_a_trip(trip_setup):
+    _, first, trip = trip_setup
+    second, = more_drivers("second@example.com")
+
+    assert Trip.accept(trip.id, first) is True
+    assert Trip.accept(trip.id, second) is False
+    trip.refresh_from_db()
+    first.refresh_from_db()
+    second.refresh_from_db()
+    assert (trip.status, trip.driver_id) == ("accepted", first.id)
+    assert (first.is_available, second.is_available) == (False, True)
+
+
+def test_an_unavailable_driver_cannot_accept_and_leaves_the_trip_pending(trip_setup):
+    _, driver, trip = trip_setup
+    Driver.objects.filter(id=driver.id).update(is_available=False)
+
+    assert Trip.accept(trip.id, driver) is False
+    trip.refresh_from_db()
+    assert (trip.status, trip.driver_id) == ("pending", None)
+
+
+def test_dispatch_worker_keeps_matching_after_the_rider_disconnects(trip_setup, settings):
+    settings.DISPATCH_WORKER = True
+    user, driver, trip = trip_setup
+
+    async def run():
+        worker = Worker(ChannelNameRouter(channel_name_patterns), [DISPATCH_CHANNEL], get_channel_layer())
+        worker_task = asyncio.create_task(worker.handle())
+        driver_socket = await connect(DriverTripConsumer, driver)
+        rider = await connect(TripRequestConsumer, user)
+        await rider.send_to(text_data=json.dumps({"action": "confirm_trip", "trip_id": str(trip.id)}))
+        assert (await receive(rider))["type"] == "searching_driver"
+        await rider.disconnect()
+
+        offer = await receive(driver_socket)
+        await driver_socket.send_to(text_data=json.dumps({"trip_id": str(trip.id), "driver_response": "accept"}))
+        await receive(driver_socket)
+        dispatch_status = database_sync_to_async(lambda: TripDispatch.objects.get(trip=trip).status)
+        for _ in range(50):
+            if await dispatch_status() == "matched":
+                break
+            await asyncio.sleep(0.05)
+        await driver_socket.disconnect()
+        worker_task.cancel()
+        return offer
+
+    with offer_to(driver):
+        offer = async_to_sync(run)()
+
+    assert offer["trip_details"]["trip_id"] == str(trip.id)
+    dispatch = TripDispatch.objects.get(trip=trip)
+    assert (dispatch.status, dispatch.wave, dispatch.offered) == ("matched", 1, [str(driver.id)])
+    trip.refresh_from_db()
+    assert trip.driver_id == driver.id
+
+
+def test_a_stale_dispatch_is_resumed_and_a_fresh_one_is_not_taken_over(trip_setup):
+    _, driver, trip = trip_setup
+    # A worker offered the trip, the driver accepted, and the worker died before noticing
+    Trip.objects.filter(id=trip.id).update(status="accepted", driver=driver)
+    stale = timezone.now() - datetime.timedelta(minutes=5)
+    TripDispatch.objects.create(trip=trip, wave=1, offered=[str(driver.id)], heartbeat_at=stale)
+    layer = get_channel_layer()
+
+    async def requeued():
+        return await layer.receive(DISPATCH_CHANNEL)
+
+    call_command("requeue_dispatches", stdout=io.StringIO())
+    assert async_to_sync(requeued)() == {"type": "trip.confirmed", "trip_id": str(trip.id)}
+
+    class Consumer:
+        channel_layer = layer
+        channel_name = "test-dispatcher"
+
+    async def run():
+        await TripDispatcher(Consumer()).run(str(trip.id))
+
+    with offer_to():
+        async_to_sync(run)()
+    assert TripDispatch.objects.get(trip=trip).status == "matched"
+
+    # A dispatch that checked in recently belongs to its worker
+    TripDispatch.objects.filter(trip=trip).update(status="searching", heartbeat_at=timezone.now())
+    with patch("trips.dispatch.get_payment_for_trip") as payment:
+        async_to_sync(run)()
+    payment.assert_not_called()
+
+
+def test_a_dropped_rider_socket_withdraws_the_offers_and_the_trip_can_be_confirmed_again(trip_setup):
+    user, driver, trip = trip_setup
+    confirm = json.dumps({"action": "confirm_trip", "trip_id": str(trip.id)})
+
+    async def run():
+        driver_socket = await connect(DriverTripConsumer, driver)
+        rider = await connect(TripRequestConsumer, user)
+        await rider.send_to(text_data=confirm)
+        assert (await receive(driver_socket))["type"] == "new_trip_request"
+        await rider.disconnect()
+        withdrawn = await receive(driver_socket)
+        released = await database_sync_to_async(lambda: TripDispatch.objects.get(trip=trip).heartbeat_at)()
+
+        rider = await connect(TripRequestConsumer, user)
+        await rider.send_to(text_data=confirm)
+        reply = await receive(rider)
+        offer = await receive(driver_socket)
+        await rider.disconnect()
+        await receive(driver_socket)
+        await driver_socket.disconnect()
+        return withdrawn, released, reply, offer
+
+    with offer_to(driver):
+        withdrawn, released, reply, offer = async_to_sync(run)()
+
+    assert withdrawn == {"type": "trip_offer_cancelled", "trip_id": str(trip.id), "reason": "cancelled"}
+    assert released is None
+    assert reply["type"] == "searching_driver"
+    assert offer["type"] == "new_trip_request"
+
+
+def test_dispatch_stops_once_the_trip_is_no_longer_pending(trip_setup):
+    user, first, trip = trip_setup
+    second, = more_drivers("second@example.com")
+    _, one_at_a_time = dispatch_with(wave_size=1, growth=1)
+
+    async def run():
+        sockets = [await connect(DriverTripConsumer, driver) for driver in (first, second)]
+        rider = await connect(TripRequestConsumer, user)
+        await rider.send_to(text_data=json.dumps({"action": "confirm_trip", "trip_id": str(trip.id)}))
+        assert (await receive(sockets[0]))["type"] == "new_trip_request"
+        # The passenger cancels during the first wave, then the first driver declines
+        await database_sync_to_async(Trip.objects.filter(id=trip.id).update)(status="cancelled")
+        await sockets[0].send_to(text_data=json.dumps({"trip_id": str(trip.id), "driver_response": "reject"}))
+        await receive(sockets[0])
+        withdrawn = await receive(sockets[0])
+        assert json.loads(await sockets[1].receive_from())["type"] == "ping"
+        second_got_nothing = await sockets[1].receive_nothing(timeout=0.2)
+        for communicator in (rider, *sockets):
+            await communicator.disconnect()
+        return withdrawn, second_got_nothing
+
+    with offer_to(first, second), one_at_a_time:
+        withdrawn, second_got_nothing = async_to_sync(run)()
+
+    assert withdrawn["reason"] == "cancelled"
+    assert second_got_nothing
+    assert TripDispatch.objects.get(trip=trip).status == "cancelled"
+
+    # A requeued dispatch of a cancelled trip sends no offers at all
+    TripDispatch.objects.filter(trip=trip).update(status="searching", heartbeat_at=None)
+
+    class Consumer:
+        channel_layer = get_channel_layer()
+        channel_name = "test-dispatcher"
+
+    with offer_to(first, second), patch("trips.dispatch.offerable_drivers") as offerable:
+        async_to_sync(TripDispatcher(Consumer()).run)(str(trip.id))
+    offerable.assert_not_called()
+    assert TripDispatch.objects.get(trip=trip).status == "cancelled"
+
+
+def test_the_heartbeat_is_refreshed_while_a_wave_waits(trip_setup, settings):
+    settings.DISPATCH_STALE_SECONDS = 0.3
+    _, _, trip = trip_setup
+    TripDispatch.objects.create(trip=trip, heartbeat_at=timezone.now() - datetime.timedelta(minutes=5))
+
+    async def run():
+        keep_alive = asyncio.create_task(TripDispatcher(consumer=None).keep_alive(str(trip.id)))
+        await asyncio.sleep(0.25)
+        keep_alive.cancel()
+
+    async_to_sync(run)()
+    assert TripDispatch.objects.get(trip=trip).heartbeat_at > timezone.now() - datetime.timedelta(seconds=1)
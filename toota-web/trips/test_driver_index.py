@@ -0,0 +1,118 @@
+import random
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+from authentication.models import Driver
+from trips.driver_index import DriverGridIndex, driver_index
+from trips.ranking import haversine_km, rank_nearest
+from trips.serializers import FindDriversSerializer, find_drivers_projection, serialize_driver_rows
+from trips.utils import find_nearest_drivers
+
+
+def haversine_one(a, b):
+    return float(haversine_km(a[0], a[1], [b[0]], [b[1]])[0])
+
+
+def test_nearest_matches_full_scan():
+    rng = random.Random(7)
+    index = DriverGridIndex(cell_degrees=0.05)
+    points = {}
+    for i in range(500):
+        lat, lon = -26.2 + rng.uniform(-1, 1), 28.0 + rng.uniform(-1, 1)
+        points[str(i)] = (lat, lon)
+        index.update(i, lat, lon, "bakkie" if i % 2 else "car")
+
+    pickup = (-26.2, 28.05)
+    expected = sorted(points, key=lambda k: haversine_one(pickup, points[k]))[:20]
+    result = index.nearest(*pickup, limit=20)
+    assert [driver_id for driver_id, _ in result] == expected
+
+    bakkies = [k for k in sorted(points, key=lambda k: haversine_one(pickup, points[k])) if int(k) % 2][:5]
+    result = index.nearest(*pickup, limit=5, vehicle_types=["bakkie"])
+    assert [driver_id for driver_id, _ in result] == bakkies
+
+
+def test_update_moves_and_remove_drops_driver():
+    index = DriverGridIndex(cell_degrees=0.05)
+    index.update("a", -26.2, 28.0)
+    index.update("a", -25.0, 29.0)
+    index.update("b", -26.2, 28.0)
+    assert [d for d, _ in index.nearest(-25.0, 29.0, limit=1)] == ["a"]
+    index.remove("a")
+    assert "a" not in index
+    assert len(index) == 1
+
+
+def test_rank_nearest_top_k_and_geodesic_refine():
+    rng = np.random.default_rng(3)
+    lats = -26.2 + rng.uniform(-1, 1, 1000)
+    lons = 28.0 + rng.uniform(-1, 1, 1000)
+
+    positions, distances = rank_nearest(-26.2, 28.0, lats, lons, 10)
+    full = haversine_km(-26.2, 28.0, lats, lons)
+    assert list(positions) == list(np.argsort(full)[:10])
+    assert np.all(np.diff(distances) >= 0)
+
+    positions, distances = rank_nearest(-26.2, 28.0, lats, lons, 10, refine=True)
+    assert distances[0] == pytest.approx(geodesic((-26.2, 28.0), (lats[positions[0]], lons[positions[0]])).km)
+    assert len(rank_nearest(-26.2, 28.0, [], [], 10)[0]) == 0
+
+
+@pytest.mark.django_db
+def test_find_nearest_drivers_tracks_availability():
+    driver_index.rebuild([])
+    near = Driver.objects.create_user(
+        email="near@example.com", password="testpass123",
+        latitude=-26.2, longitude=28.0, vehicle_type="bakkie", is_available=True
+    )
+    Driver.objects.create_user(
+        email="far@example.com", password="testpass123",
+        latitude=-25.0, longitude=28.0, vehicle_type="bakkie", is_available=True
+    )
+
+    drivers = find_nearest_drivers(-26.2, 28.01, ["bakkie"])
+    assert [d["email"] for d in drivers] == ["near@example.com", "far@example.com"]
+    assert drivers[0]["distance_km"] == pytest.approx(geodesic((-26.2, 28.01), (-26.2, 28.0)).km, abs=1e-3)
+
+    near.is_available = False
+    near.save()
+    drivers = find_nearest_drivers(-26.2, 28.01, ["bakkie"])
+    assert [d["email"] for d in drivers] == ["far@example.com"]
+
+
+@pytest.mark.django_db
+def test_database_mode_orders_in_sql_and_widens_radius(settings):
+    settings.DRIVER_SEARCH_RADIUS_KM = {"default": 5.0}
+    settings.DRIVER_SEARCH_MAX_RADIUS_KM = 200.0
+    for i, lat in enumerate([-26.3, -26.21, -25.5]):
+        Driver.objects.create_user(
+            email=f"driver{i}@example.com", password="testpass123",
+            latitude=lat, longitude=28.0, vehicle_type="bakkie", is_available=True
+        )
+
+    drivers = find_nearest_drivers(-26.2, 28.0, ["bakkie"], limit=2, mode="database")
+    assert [d["email"] for d in drivers] == ["driver1@example.com", "driver0@example.com"]
+    assert 0 < drivers[0]["distance_km"] < drivers[1]["distance_km"]
+
+    # Only one driver within 5 km, so the radius widens to reach the far one.
+    drivers = find_nearest_drivers(-25.5, 28.0, ["bakkie"], limit=2, mode="database")
+    assert [d["email"] for d in drivers] == ["driver2@example.com", "driver1@example.com"]
+
+    # A growth that never widens the radius still ends at the maximum radius.
+    settings.DRIVER_SEARCH_RADIUS_GROWTH = 1.0
+    drivers = find_nearest_drivers(-25.5, 28.0, ["bakkie"], limit=3, mode="database")
+    assert len(drivers) == 3
+
+
+@pytest.mark.django_db
+def test_lean_driver_rows_match_find_drivers_serializer():
+    driver = Driver.objects.create_user(
+        email="lean@example.com", password="testpass123", phone_number="+27821234567",
+        car_image="image/upload/v1/car.jpg", latitude=-26.2, longitude=28.0,
+        vehicle_type="bakkie", average_rating="4.5", is_available=True
+    )
+    driver = Driver.objects.get(id=driver.id)
+    fields, _ = find_drivers_projection()
+    rows = Driver.objects.filter(id=driver.id).values(*fields)
+
+    assert serialize_driver_rows(rows) == [dict(FindDriversSerializer(driver).data)]
@@ -0,0 +1,34 @@
+import pytest
+from authentication.models import Driver
+from trips.driver_profile import build_location_delta, get_driver_profile
+
+
+@pytest.mark.django_db
+def test_driver_profile_is_cached_until_profile_fields_change(django_assert_num_queries):
+    driver = Driver.objects.create_user(
+        email="profile@example.com", password="testpass123", full_name="Thabo M",
+        latitude=-26.2, longitude=28.0, vehicle_type="bakkie", vehicle_registration="CA 123-456"
+    )
+    with django_assert_num_queries(1):
+        entry = get_driver_profile(driver.id)
+        assert get_driver_profile(driver.id) == entry
+    assert entry["profile"]["name"] == "Thabo M"
+    assert entry["profile"]["number_plate"] == "CA 123-456"
+
+    driver.latitude = -26.3
+    updated_at = Driver.objects.get(id=driver.id).updated_at
+    driver.save_fields("latitude")
+    assert get_driver_profile(driver.id) == entry
+    assert Driver.objects.get(id=driver.id).updated_at > updated_at
+
+    delta = build_location_delta(driver, entry, speed_kmh=42.37, heading=89.6)
+    delta.pop("timestamp")
+    assert delta == {"id": str(driver.id), "latitude": -26.3, "longitude": 28.0, "speed_kmh": 42.4,
+                     "heading": 90, "is_available": True, "vehicle_type": "bakkie",
+                     "profile_version": entry["version"]}
+
+    driver.average_rating = 4.5
+    driver.save_fields("average_rating")
+    updated = get_driver_profile(driver.id)
+    assert updated["version"] != entry["version"]
+    assert updated["profile"]["rating"] == 4.5
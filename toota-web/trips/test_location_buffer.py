@@ -0,0 +1,27 @@
+import pytest
+from authentication.models import Driver
+from trips.location_buffer import LocationBuffer
+
+
+@pytest.mark.django_db
+def test_location_buffer_coalesces_pings_into_one_bulk_update(django_assert_num_queries):
+    buffer = LocationBuffer()
+    drivers = [
+        Driver.objects.create_user(
+            email=f"gps{i}@example.com", password="testpass123",
+            latitude=-26.2, longitude=28.0, vehicle_type="bakkie", is_available=True
+        )
+        for i in range(3)
+    ]
+    for step in range(5):
+        for driver in drivers:
+            buffer.record(driver.id, -26.2 + step / 100, 28.0)
+
+    rows = buffer.overlay(list(Driver.objects.filter(id=drivers[0].id).values("id", "latitude", "longitude")))
+    assert rows[0]["latitude"] == pytest.approx(-26.16)
+
+    with django_assert_num_queries(1):
+        assert buffer.flush() == 3
+    assert buffer.position(drivers[0].id) is None
+    assert buffer.stats()["coalesced"] == 12
+    assert list(Driver.objects.values_list("latitude", flat=True)) == [pytest.approx(-26.16)] * 3
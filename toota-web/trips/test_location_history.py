@@ -0,0 +1,30 @@
+import pytest
+from authentication.models import Driver, User
+from trips.location_buffer import LocationBuffer
+from trips.location_history import LocationHistory, encode_polyline, trip_breadcrumbs
+from trips.models import DriverLocationPoint, Trip
+
+
+def test_encode_polyline_matches_reference_example():
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert encode_polyline(points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+@pytest.mark.django_db
+def test_location_history_is_written_on_flush_and_served_as_breadcrumbs():
+    user = User.objects.create_user(email="rider@example.com", password="testpass123")
+    driver = Driver.objects.create_user(email="crumbs@example.com", password="testpass123")
+    trip = Trip.objects.create(user=user, driver=driver, pickup="Sandton City", destination="Rosebank Mall")
+    buffer = LocationBuffer(history=LocationHistory())
+    path = [(-26.2 + i / 1000, 28.0 + i / 1000) for i in range(5)]
+    for lat, lon in path:
+        buffer.record(driver.id, lat, lon, speed=32.4, heading=44.6)
+
+    buffer.flush()
+    point = DriverLocationPoint.objects.filter(driver=driver).order_by("recorded_at").first()
+    assert (point.lat_e6, point.lon_e6, point.speed, point.heading) == (-26200000, 28000000, 32, 45)
+
+    crumbs = trip_breadcrumbs(trip)
+    assert crumbs["points"] == 5
+    assert crumbs["polyline"] == encode_polyline(path)
+    assert trip_breadcrumbs(trip, max_points=2)["polyline"] == encode_polyline([path[0], path[-1]])
@@ -0,0 +1,31 @@
+from trips.location_policy import LocationPolicy
+
+
+def test_location_policy_throttles_dead_bands_and_rejects_jumps():
+    policy = LocationPolicy(min_interval=2.0, min_distance_m=10.0, max_speed_kmh=200.0)
+    fix = (-26.2, 28.0, 100.0)
+
+    assert policy.check(None, -26.2, 28.0, now=100.0) is None
+    assert policy.check(fix, -26.201, 28.0, now=101.0) == "too_soon"
+    assert policy.check(fix, -26.20003, 28.0, now=105.0) == "too_close"  # ~3 m
+    assert policy.check(fix, -26.3, 28.0, now=105.0) == "too_fast"  # ~11 km in 5 s
+    assert policy.check(fix, -26.201, 28.0, now=105.0) is None  # ~110 m in 5 s
+    assert policy.check(fix, None, 28.0, now=105.0) == "invalid"
+
+    stats = policy.stats()
+    assert stats["accepted"] == 2
+    assert stats["dropped"] == {"invalid": 1, "too_soon": 1, "too_close": 1, "too_fast": 1}
+
+
+def test_location_policy_reanchors_after_consecutive_agreeing_jumps():
+    policy = LocationPolicy(min_interval=2.0, min_distance_m=10.0, max_speed_kmh=200.0, reanchor_after=3)
+    bad_anchor = (-25.0, 28.0, 100.0)  # ~130 km away from the driver's real position
+    jumps = []
+
+    assert policy.check(bad_anchor, -26.2, 28.0, now=105.0, jumps=jumps) == "too_fast"
+    assert policy.check(bad_anchor, -24.0, 28.0, now=108.0, jumps=jumps) == "too_fast"  # disagrees: restart
+    assert policy.check(bad_anchor, -26.2, 28.0, now=111.0, jumps=jumps) == "too_fast"
+    assert policy.check(bad_anchor, -26.2001, 28.0, now=114.0, jumps=jumps) == "too_fast"
+    assert policy.check(bad_anchor, -26.2002, 28.0, now=117.0, jumps=jumps) is None
+    assert jumps == []
+    assert policy.stats()["reanchored"] == 1
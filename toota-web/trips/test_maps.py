@@ -0,0 +1,335 @@
+import asyncio
+import sys
+import time
+from unittest.mock import patch
+import pytest
+from django.test import override_settings
+from trips.maps_cache import MemoryBackend, geocode_cache, reverse_geocode_cache, route_cache
+from trips.maps_stub import maps_stub_server
+from trips.maps_client import (CircuitBreaker, get_maps_session, close_maps_session, close_maps_session_on_reactor_shutdown,
+                               maps_lifespan)
+from trips.utils import (areverse_geocode, gather_with_deadline, get_batch_route_data,
+                         format_duration, get_coordinates, get_google_route_data, maps_single_flight,
+                         route_summary)
+
+
+@pytest.mark.asyncio
+async def test_maps_session_is_shared_and_closed_on_shutdown():
+    session = get_maps_session()
+    assert get_maps_session() is session
+
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    await maps_lifespan({"type": "lifespan"}, receive, send)
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert session.closed
+    assert get_maps_session() is not session
+    await close_maps_session()
+
+
+@pytest.mark.asyncio
+async def test_maps_session_is_closed_from_the_daphne_reactor_shutdown():
+    class FakeReactor:
+        triggers = []
+
+        def addSystemEventTrigger(self, phase, event, callable):
+            self.triggers.append((phase, event, callable))
+
+    reactor = FakeReactor()
+    with patch.dict(sys.modules, {"twisted.internet.reactor": reactor}):
+        assert close_maps_session_on_reactor_shutdown() is True
+    (phase, event, close), = reactor.triggers
+    assert (phase, event) == ("before", "shutdown")
+
+    session = get_maps_session()
+    await close().asFuture(asyncio.get_running_loop())
+    assert session.closed
+
+
+@pytest.mark.asyncio
+async def test_route_cache_snaps_nearby_points_and_counts_hits(maps_caches):
+    route = {"distance_meters": 12500, "duration_seconds": 1200}
+    with patch("trips.utils._fetch_google_route_data", return_value=route) as fetch:
+        assert await get_google_route_data(-26.20000, 28.04000, -26.1, 28.1) == route
+        # ~10 m away from the first pickup: same grid cell, served from cache.
+        assert await get_google_route_data(-26.20005, 28.04005, -26.1, 28.1) == route
+        assert fetch.call_count == 1
+        await get_google_route_data(-26.3, 28.04, -26.1, 28.1)
+        assert fetch.call_count == 2
+    assert route_cache.stats()["hits"] == 1
+    assert route_cache.stats()["misses"] == 2
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_expires_and_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    await backend.set("a", 1, ttl=60)
+    await backend.set("b", 2, ttl=60)
+    await backend.get("a")
+    await backend.set("c", 3, ttl=60)
+    assert await backend.get("b") is None
+    assert await backend.get("a") == 1
+    await backend.set("d", 4, ttl=-1)
+    assert await backend.get("d") is None
+
+
+@pytest.mark.asyncio
+async def test_django_backend_clear_only_drops_its_own_namespace():
+    from django.core.cache import cache
+    from trips.maps_cache import DjangoCacheBackend
+
+    routes = DjangoCacheBackend(namespace="maps:test-routes")
+    geocodes = DjangoCacheBackend(namespace="maps:test-geocodes")
+    await cache.aset("session:abc", "keep", timeout=60)
+    await routes.set("maps:test-routes:1", "route", ttl=60)
+    await geocodes.set("maps:test-geocodes:1", "place", ttl=60)
+
+    routes.clear()
+    assert await routes.get("maps:test-routes:1") is None
+    assert await geocodes.get("maps:test-geocodes:1") == "place"
+    assert await cache.aget("session:abc") == "keep"
+
+    await routes.set("maps:test-routes:1", "fresh", ttl=60)
+    assert await routes.get("maps:test-routes:1") == "fresh"
+
+
+@pytest.mark.asyncio
+async def test_batch_route_data_chunks_origins_and_reuses_cache(maps_caches):
+    origins = [(-26.2 + i / 100, 28.0) for i in range(30)]
+
+    async def fake_matrix(chunk, dest_lat, dest_lon):
+        return [{"distance_meters": lat, "duration_seconds": 300} for lat, _ in chunk]
+
+    with patch("trips.utils._fetch_distance_matrix", side_effect=fake_matrix) as fetch:
+        results = await get_batch_route_data(origins, -26.1, 28.1)
+        assert [len(call.args[0]) for call in fetch.call_args_list] == [25, 5]
+        assert [r["distance_meters"] for r in results] == [lat for lat, _ in origins]
+
+        await get_batch_route_data(origins[:3] + [(-30.0, 30.0)], -26.1, 28.1)
+        assert fetch.call_args_list[-1].args[0] == [(-30.0, 30.0)]
+
+
+@pytest.mark.asyncio
+async def test_gather_with_deadline_bounds_concurrency_and_drops_slow_calls():
+    in_flight = 0
+    peak = 0
+
+    async def lookup(delay, value):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            await asyncio.sleep(delay)
+            return value
+        finally:
+            in_flight -= 1
+
+    async def broken():
+        raise RuntimeError("boom")
+
+    coros = [lookup(0.01, i) for i in range(6)] + [lookup(5, "slow"), broken()]
+    results = await gather_with_deadline(coros, limit=3, deadline=0.2)
+
+    assert peak <= 3
+    assert results == {0: 0, 1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 7: None}
+
+
+@pytest.mark.asyncio
+async def test_gather_with_deadline_closes_lookups_that_never_started():
+    async def lookup():
+        await asyncio.sleep(5)
+
+    coros = [lookup() for _ in range(4)]
+    assert await gather_with_deadline(coros, limit=1, deadline=0.05) == {}
+    await asyncio.sleep(0)  # let the cancellations run
+    assert all(coro.cr_frame is None for coro in coros)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_get_coordinates_caches_by_normalized_address_including_misses(maps_caches):
+    responses = {
+        "12 Main Road, Sandton": ((-26.1, 28.05), True),
+        "nowhere at all": ((None, None), True),
+    }
+
+    async def fake_fetch(address, api_key):
+        return responses[address]
+
+    with patch("trips.utils._fetch_coordinates", side_effect=fake_fetch) as fetch:
+        assert await get_coordinates("12 Main Road, Sandton") == (-26.1, 28.05)
+        assert await get_coordinates("  12 main road sandton ") == (-26.1, 28.05)
+        assert await get_coordinates("nowhere at all") == (None, None)
+        assert await get_coordinates("Nowhere, at all") == (None, None)
+        assert fetch.call_count == 2
+
+        # A cold process still finds the stored answer in the database.
+        geocode_cache.clear()
+        assert await get_coordinates("12 MAIN ROAD SANDTON") == (-26.1, 28.05)
+        assert fetch.call_count == 2
+
+        # A stored miss is only cached in-process until its row expires.
+        geocode_cache.clear()
+        with patch.object(geocode_cache, "set", wraps=geocode_cache.set) as cache_set:
+            assert await get_coordinates("nowhere at all") == (None, None)
+        assert 0 < cache_set.call_args.kwargs["ttl"] <= 3600
+        assert fetch.call_count == 2
+
+
+class FakeResponse:
+    status = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self):
+        return self.payload
+
+
+class FakeSession:
+    def __init__(self, payload):
+        self.payload = payload
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        return FakeResponse(self.payload)
+
+
+@pytest.mark.asyncio
+async def test_areverse_geocode_caches_nearby_coordinates(maps_caches):
+    session = FakeSession({"status": "OK", "results": [{"formatted_address": "1 Jan Smuts Ave"}]})
+
+    assert await areverse_geocode(-26.2, 28.04, session=session) == "1 Jan Smuts Ave"
+    assert await areverse_geocode(-26.20001, 28.04001, session=session) == "1 Jan Smuts Ave"
+    assert session.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_route_lookups_share_one_request(maps_caches):
+    calls = 0
+
+    async def slow_fetch(*args):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"distance_meters": 3000, "duration_seconds": 420}
+
+    coalesced_before = maps_single_flight.coalesced
+    with patch("trips.utils._fetch_google_route_data", side_effect=slow_fetch):
+        results = await asyncio.gather(*(
+            get_google_route_data(-26.2, 28.04, -26.1, 28.1) for _ in range(10)
+        ))
+
+    assert calls == 1
+    assert all(r == {"distance_meters": 3000, "duration_seconds": 420} for r in results)
+    assert maps_single_flight.coalesced - coalesced_before == 9
+    assert maps_single_flight.stats()["in_flight"] == 0
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # only one trial at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_route_data_falls_back_to_estimate_when_breaker_is_open(maps_caches, breaker):
+    breaker.opened_at = time.monotonic()
+    with patch("trips.maps_client.get_maps_session") as get_session:
+        route_data = await get_google_route_data(-26.2041, 28.0473, -25.7479, 28.2293, vehicle_type="Bakkie")
+        get_session.assert_not_called()
+
+    assert route_data["estimated"] is True
+    # ~54 km straight line * 1.3 road factor at 45 km/h
+    assert route_data["distance_meters"] == pytest.approx(70500, abs=1000)
+    assert route_data["duration_seconds"] == pytest.approx(70.5 / 45 * 3600, rel=0.02)
+    assert route_summary(route_data)["duration"].startswith("1 hour ")
+
+
+def test_route_summary_renders_numeric_route_for_clients():
+    summary = route_summary({"distance_meters": 12345, "duration_seconds": 3900})
+    assert summary == {
+        "distance": 12.35,
+        "duration": "1 hour 5 mins",
+        "distance_meters": 12345,
+        "duration_seconds": 3900,
+    }
+    assert format_duration(60) == "1 min"
+    assert route_summary(None) is None
+
+
+@pytest.mark.asyncio
+async def test_route_lookups_run_offline_against_maps_stub(maps_caches):
+    async with maps_stub_server() as (base_url, stub):
+        with override_settings(MAPS_BASE_URL=base_url):
+            route = await get_google_route_data(-26.2041, 28.0473, -25.7479, 28.2293)
+            batch = await get_batch_route_data([(-26.2041, 28.0473), (-26.1, 28.0)], -25.7479, 28.2293)
+            address = await areverse_geocode(-26.2, 28.04)
+        await close_maps_session()
+
+    assert "estimated" not in route
+    assert route == batch[0]
+    assert route["distance_meters"] == pytest.approx(70500, abs=1000)
+    assert address.endswith("Stub Street, -26.200, 28.040")
+    assert stub.requests == 3
+
+
+@pytest.mark.asyncio
+async def test_maps_stub_error_injection_trips_the_breaker(maps_caches, breaker):
+    async with maps_stub_server(error_rate=1.0, error_mode="quota") as (base_url, stub):
+        with override_settings(MAPS_BASE_URL=base_url):
+            for i in range(breaker.failure_threshold + 2):
+                route = await get_google_route_data(-26.2 + i / 10, 28.04, -26.1, 28.1)
+                assert route["estimated"] is True
+        await close_maps_session()
+    assert breaker.state == "open"
+    assert stub.errors == breaker.failure_threshold
+
+
+@pytest.mark.asyncio
+async def test_driver_address_lookups_are_throttled_by_time_and_distance():
+    from trips.consumers import DriverLocationConsumer
+
+    consumer = DriverLocationConsumer()
+    calls = []
+
+    async def lookup(lat, lon):
+        calls.append((lat, lon))
+
+    clock = [1000.0]
+    with patch.object(consumer, "update_current_location", lookup), \
+            patch("trips.consumers.time.monotonic", lambda: clock[0]), \
+            override_settings(DRIVER_ADDRESS_REFRESH_SECONDS=300, DRIVER_ADDRESS_REFRESH_METERS=500):
+        consumer.schedule_current_location_update(-26.2041, 28.0473)
+        await consumer.location_task
+        consumer.schedule_current_location_update(-26.2200, 28.0473)   # far, but too soon
+        clock[0] += 600
+        consumer.schedule_current_location_update(-26.2042, 28.0473)   # late, but barely moved
+        consumer.schedule_current_location_update(-26.2200, 28.0473)
+        await consumer.location_task
+
+    assert calls == [(-26.2041, 28.0473), (-26.2200, 28.0473)]
@@ -1,9 +1,10 @@
 from django.urls import path
 from .views import (
-    CheckTripStatusView, SetDriverOnlineStatus
+    CheckTripStatusView, SetDriverOnlineStatus, TripBreadcrumbsView
 )
 
 urlpatterns = [
     path("<uuid:trip_id>/status/", CheckTripStatusView.as_view(), name="update-trip-status"),
+    path("<uuid:trip_id>/breadcrumbs/", TripBreadcrumbsView.as_view(), name="trip-breadcrumbs"),
     path("driver/online-status/", SetDriverOnlineStatus.as_view(), name="set-driver-online-status")
 ]
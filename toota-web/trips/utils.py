@@ -1,69 +1,392 @@
 from authentication.models import Driver
+from .driver_index import driver_index
+from .location_buffer import location_buffer
+from .maps_client import maps_get_json, maps_url
+from .ranking import haversine_km
+from .maps_cache import route_cache, geocode_cache, reverse_geocode_cache
+from .models import GeocodeResult
 import decimal
 import datetime
+import hashlib
 from dotenv import load_dotenv
-import requests
 load_dotenv()
-import aiohttp
 import asyncio
 import logging
 import googlemaps
+import math
 import os
+import re
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.db.models import ExpressionWrapper, F, FloatField, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
 
 logger = logging.getLogger(__name__)
 
 
-def find_nearest_drivers(pickup_lat, pickup_lon, vehicle_type, limit=20):
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+# Bounds on the database-mode search's widening radius
+MIN_RADIUS_GROWTH = 1.25
+MAX_RADIUS_ROUNDS = 6
+
+
+def find_nearest_drivers(pickup_lat, pickup_lon, vehicle_type, limit=20, mode=None):
     """
     Find the nearest available drivers to the given pickup location.
-    Returns a list of serialized driver data.
+
+    `mode` (default settings.DRIVER_SEARCH_MODE) selects how candidates are
+    ranked:
+      - "index": the in-memory grid index, measuring only nearby cells.
+      - "database": a bounding-box filter plus haversine ORDER BY/LIMIT in SQL.
+    Returns a list of serialized driver data, nearest first, with the same
+    schema as FindDriversSerializer but built from `.values()` rows, plus
+    the straight-line `distance_km` to the pickup (geodesic when
+    DRIVER_SEARCH_GEODESIC_REFINE is on in index mode, haversine otherwise).
     """
-    from .serializers import FindDriversSerializer
-    from geopy.distance import geodesic
+    from .serializers import find_drivers_projection, serialize_driver_rows
 
-    if not vehicle_type:
-        available_drivers = Driver.objects.filter(is_available=True)
+    fields, _ = find_drivers_projection()
+    mode = mode or getattr(settings, 'DRIVER_SEARCH_MODE', 'index')
+    if mode == "database":
+        rows = _nearest_drivers_from_database(pickup_lat, pickup_lon, vehicle_type, limit, fields)
     else:
-        available_drivers = Driver.objects.filter(is_available=True, vehicle_type__in=vehicle_type)
+        rows = _nearest_drivers_from_index(pickup_lat, pickup_lon, vehicle_type, limit, fields)
 
-    pickup_location = (float(pickup_lat), float(pickup_lon))
+    # Positions written behind by DriverLocationConsumer may be newer than the DB.
+    location_buffer.overlay(rows)
 
-    drivers_with_distance = []
-    for driver in available_drivers:
-        driver_location = (driver.latitude, driver.longitude)
-        distance = geodesic(pickup_location, driver_location).km
-        drivers_with_distance.append((driver, distance))
+    drivers = serialize_driver_rows(rows)
+    for driver, row in zip(drivers, rows):
+        driver["distance_km"] = round(row["distance_km"], 3)
+    return drivers
 
-    # Sort by distance and limit the results
-    sorted_drivers = sorted(drivers_with_distance, key=lambda x: x[1])[:limit]
 
-    # Return only serialized driver data (no distance)
-    return [FindDriversSerializer(driver).data for driver, _ in sorted_drivers]
+def _nearest_drivers_from_index(pickup_lat, pickup_lon, vehicle_type, limit, fields):
+    if driver_index.needs_rebuild():
+        driver_index.rebuild(
+            Driver.objects.filter(is_available=True)
+            .values_list("id", "latitude", "longitude", "vehicle_type")
+        )
 
-GOOGLE_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+    nearest = driver_index.nearest(
+        pickup_lat, pickup_lon, limit=limit, vehicle_types=vehicle_type,
+        refine=getattr(settings, 'DRIVER_SEARCH_GEODESIC_REFINE', True),
+    )
+    distances = dict(nearest)
+
+    # The index may lag behind other workers, so re-check availability in the DB.
+    rows = Driver.objects.filter(id__in=list(distances), is_available=True).values(*fields)
+    rows_by_id = {str(row["id"]): row for row in rows}
+    ranked = []
+    for driver_id, distance_km in distances.items():
+        row = rows_by_id.get(driver_id)
+        if row is not None:
+            row["distance_km"] = distance_km
+            ranked.append(row)
+    return ranked
 
-async def get_google_route_data(pickup_lat, pickup_lon, dest_lat, dest_lon):
-    url = (
-        "https://maps.googleapis.com/maps/api/directions/json"
-        f"?origin={pickup_lat},{pickup_lon}"
-        f"&destination={dest_lat},{dest_lon}"
-        f"&mode=driving&key={GOOGLE_API_KEY}"
+
+def get_search_radius_km(vehicle_type):
+    """
+    Initial search radius for the requested vehicle types, taken from
+    settings.DRIVER_SEARCH_RADIUS_KM. When several types are requested the
+    widest radius wins.
+    """
+    radii = getattr(settings, 'DRIVER_SEARCH_RADIUS_KM', {})
+    default = radii.get("default", 10.0)
+    if not vehicle_type:
+        return default
+    return max(radii.get(v_type, default) for v_type in vehicle_type)
+
+
+def haversine_expression(lat, lon, lat_field="latitude", lon_field="longitude"):
+    """Great-circle distance in km from (lat, lon) to a row, as a DB expression."""
+    lat_r = math.radians(float(lat))
+    lon_r = math.radians(float(lon))
+    d_lat = (Radians(F(lat_field)) - Value(lat_r)) / 2
+    d_lon = (Radians(F(lon_field)) - Value(lon_r)) / 2
+    a = Power(Sin(d_lat), 2) + Value(math.cos(lat_r)) * Cos(Radians(F(lat_field))) * Power(Sin(d_lon), 2)
+    return ExpressionWrapper(
+        Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(a)),
+        output_field=FloatField(),
     )
 
+
+def _nearest_drivers_from_database(pickup_lat, pickup_lon, vehicle_type, limit, fields):
+    """
+    Rank drivers in SQL: a lat/lon bounding box narrows the rows (and can use
+    an index), then the haversine distance is ordered and limited by the DB so
+    only `limit` rows come back. The radius widens by
+    DRIVER_SEARCH_RADIUS_GROWTH until enough drivers are found or
+    DRIVER_SEARCH_MAX_RADIUS_KM is reached, in at most MAX_RADIUS_ROUNDS
+    queries.
+    """
+    pickup_lat, pickup_lon = float(pickup_lat), float(pickup_lon)
+    radius_km = get_search_radius_km(vehicle_type)
+    max_radius_km = max(getattr(settings, 'DRIVER_SEARCH_MAX_RADIUS_KM', 50.0), radius_km)
+    # A growth of 1.0 or less would never reach the maximum radius.
+    growth = max(getattr(settings, 'DRIVER_SEARCH_RADIUS_GROWTH', 2.0), MIN_RADIUS_GROWTH)
+
+    available_drivers = Driver.objects.filter(is_available=True)
+    if vehicle_type:
+        available_drivers = available_drivers.filter(vehicle_type__in=vehicle_type)
+
+    for round_number in range(1, MAX_RADIUS_ROUNDS + 1):
+        if round_number == MAX_RADIUS_ROUNDS:
+            radius_km = max_radius_km
+        lat_delta = radius_km / KM_PER_DEGREE
+        lon_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(pickup_lat)), 0.01))
+        drivers = list(
+            available_drivers
+            .filter(
+                latitude__range=(pickup_lat - lat_delta, pickup_lat + lat_delta),
+                longitude__range=(pickup_lon - lon_delta, pickup_lon + lon_delta),
+            )
+            .annotate(distance_km=haversine_expression(pickup_lat, pickup_lon))
+            .filter(distance_km__lte=radius_km)
+            .order_by("distance_km")
+            .values(*fields, "distance_km")[:limit]
+        )
+        if len(drivers) >= limit or radius_km >= max_radius_km:
+            return drivers
+        radius_km = min(radius_km * growth, max_radius_km)
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical async lookups: while a call for `key` is
+    in flight, other callers with the same key await the same result
+    instead of issuing their own request.
+    """
+
+    def __init__(self):
+        self._in_flight = {}  # key -> task
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fetch):
+        """Return the result of `fetch()`, sharing it with concurrent callers."""
+        task = self._in_flight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fetch())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shield so one caller timing out does not cancel the shared request.
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
+
+
+maps_single_flight = SingleFlight()
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+
+async def get_google_route_data(pickup_lat, pickup_lon, dest_lat, dest_lon, vehicle_type=None):
+    """
+    Driving route between two points as
+    {"distance_meters": int, "duration_seconds": int}. Results are
+    cached with both ends snapped to the route cache grid, so repeated
+    lookups for nearly the same route skip the Directions API, and
+    concurrent misses for the same snapped route share one request.
+
+    If the Directions API is unavailable (or the Maps circuit breaker is
+    open) a local estimate with the same shape and "estimated": True is
+    returned instead, so callers always get a dict.
+    """
+    cache_key = route_cache.point_key((pickup_lat, pickup_lon), (dest_lat, dest_lon))
+    cached = await route_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    async def fetch():
+        route_data = await _fetch_google_route_data(pickup_lat, pickup_lon, dest_lat, dest_lon)
+        await route_cache.set(cache_key, route_data)
+        return route_data
+
+    route_data = await maps_single_flight.do(cache_key, fetch)
+    if route_data is None:
+        return estimate_route_data(pickup_lat, pickup_lon, dest_lat, dest_lon, vehicle_type)
+    return route_data
+
+
+async def _fetch_google_route_data(pickup_lat, pickup_lon, dest_lat, dest_lon):
+    params = {
+        "origin": f"{pickup_lat},{pickup_lon}",
+        "destination": f"{dest_lat},{dest_lon}",
+        "mode": "driving",
+        "key": GOOGLE_API_KEY,
+    }
+    data = await maps_get_json(maps_url("directions"), params=params)
+
+    if data and data.get("status") == "OK" and data.get("routes"):
+        leg = data["routes"][0]["legs"][0]
+        return {
+            "distance_meters": leg["distance"]["value"],
+            "duration_seconds": leg["duration"]["value"],
+        }
+
+
+def route_summary(route_data):
+    """
+    Client-facing view of a route: numeric fields plus distance in km and a
+    rendered duration text. Text is produced here, at the edge, and never
+    parsed back.
+    """
+    if route_data is None:
+        return None
+    summary = {
+        "distance": round(route_data["distance_meters"] / 1000, 2),
+        "duration": format_duration(route_data["duration_seconds"]),
+        "distance_meters": route_data["distance_meters"],
+        "duration_seconds": route_data["duration_seconds"],
+    }
+    if route_data.get("estimated"):
+        summary["estimated"] = True
+    return summary
+
+
+def format_duration(seconds):
+    """Render seconds like the Directions API does, e.g. "1 hour 5 mins"."""
+    minutes = max(int(round(seconds / 60)), 1)
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours} hour{'s' if hours != 1 else ''}")
+    if minutes:
+        parts.append(f"{minutes} min{'s' if minutes != 1 else ''}")
+    return " ".join(parts)
+
+
+def estimate_route_data(pickup_lat, pickup_lon, dest_lat, dest_lon, vehicle_type=None):
+    """
+    Local route estimate for when Google Maps is unavailable: straight-line
+    (haversine) distance times ROUTE_ESTIMATE_ROAD_FACTOR, driven at the
+    ROUTE_ESTIMATE_SPEED_KMH average for the vehicle type.
+    """
+    straight_km = float(haversine_km(float(pickup_lat), float(pickup_lon), [float(dest_lat)], [float(dest_lon)])[0])
+    distance_km = straight_km * getattr(settings, 'ROUTE_ESTIMATE_ROAD_FACTOR', 1.3)
+    speeds = getattr(settings, 'ROUTE_ESTIMATE_SPEED_KMH', {})
+    speed_kmh = speeds.get((vehicle_type or "").lower(), speeds.get("default", 40.0))
+    return {
+        "distance_meters": int(distance_km * 1000),
+        "duration_seconds": int(distance_km / speed_kmh * 3600),
+        "estimated": True,
+    }
+
+
+async def gather_with_deadline(coros, limit, deadline):
+    """
+    Run `coros` concurrently with at most `limit` in flight and collect
+    results as they complete. Anything still running after `deadline`
+    seconds is cancelled and left out. Returns {position: result}; a
+    coroutine that raised is reported as None.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(position, coro):
+        try:
+            async with semaphore:
+                try:
+                    return position, await coro
+                except Exception as e:
+                    logger.error(f"Concurrent lookup {position} failed: {e}")
+                    return position, None
+        finally:
+            # Cancelled while waiting for the semaphore: `coro` never ran, so
+            # close it rather than leave a "never awaited" warning behind.
+            coro.close()
+
+    tasks = [asyncio.ensure_future(run(position, coro)) for position, coro in enumerate(coros)]
+    results = {}
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=5) as response:
-                data = await response.json()
+        for next_done in asyncio.as_completed(tasks, timeout=deadline):
+            position, value = await next_done
+            results[position] = value
+    except asyncio.TimeoutError:
+        logger.warning(f"{len(tasks) - len(results)} of {len(tasks)} lookups missed the {deadline}s deadline")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    return results
+
+
+# Distance Matrix allows at most 25 origins per request (and 100 elements).
+DISTANCE_MATRIX_MAX_ORIGINS = 25
+
+
+async def get_batch_route_data(origins, dest_lat, dest_lon):
+    """
+    Driving distance and duration from each (lat, lon) in `origins` to one
+    destination, e.g. every nearby driver to a passenger. Cached routes are
+    reused; the rest go out as Distance Matrix requests of up to 25 origins,
+    sent concurrently. Returns a list aligned with `origins`, holding
+    {"distance_meters": int, "duration_seconds": int} or None.
+    """
+    results = [None] * len(origins)
+    cache_keys = [route_cache.point_key(origin, (dest_lat, dest_lon)) for origin in origins]
+
+    missing = []
+    for i, cache_key in enumerate(cache_keys):
+        results[i] = await route_cache.get(cache_key)
+        if results[i] is None:
+            missing.append(i)
+
+    chunks = [
+        missing[start:start + DISTANCE_MATRIX_MAX_ORIGINS]
+        for start in range(0, len(missing), DISTANCE_MATRIX_MAX_ORIGINS)
+    ]
+    chunk_results = await asyncio.gather(*(
+        _fetch_distance_matrix([origins[i] for i in chunk], dest_lat, dest_lon)
+        for chunk in chunks
+    ))
+    for chunk, rows in zip(chunks, chunk_results):
+        for i, route_data in zip(chunk, rows):
+            results[i] = route_data
+            await route_cache.set(cache_keys[i], route_data)
 
-                if data.get("status") == "OK" and data.get("routes"):
-                    leg = data["routes"][0]["legs"][0]
-                    distance_km = round(leg["distance"]["value"] / 1000, 2)
-                    duration_text = leg["duration"]["text"]
+    return results
 
-                    return {"distance": distance_km, "duration": duration_text}
 
-    except Exception as e:
-        logger.error(f"Google Directions API failed: {e}")
+async def _fetch_distance_matrix(origins, dest_lat, dest_lon):
+    """One Distance Matrix request; returns a list aligned with `origins`."""
+    params = {
+        "origins": "|".join(f"{lat},{lon}" for lat, lon in origins),
+        "destinations": f"{dest_lat},{dest_lon}",
+        "mode": "driving",
+        "key": GOOGLE_API_KEY,
+    }
+    data = await maps_get_json(
+        maps_url("distancematrix"), params=params, timeout=10
+    )
+    if not data or data.get("status") != "OK":
+        return [None] * len(origins)
+
+    results = []
+    for row in data.get("rows", []):
+        element = row["elements"][0]
+        if element.get("status") == "OK":
+            results.append({
+                "distance_meters": element["distance"]["value"],
+                "duration_seconds": element["duration"]["value"],
+            })
+        else:
+            results.append(None)
+    return results + [None] * (len(origins) - len(results))
 
 
 def calculate_easter(year):
@@ -125,40 +448,128 @@ def convert_decimals(obj):
     return obj
 
 
+def normalize_address(address):
+    """Lowercase, drop punctuation and collapse whitespace for cache keys."""
+    return " ".join(re.sub(r"[^\w\s]", " ", address.lower()).split())[:512]
+
+
 async def get_coordinates(address, api_key=os.getenv("GOOGLE_MAPS_API_KEY")):
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
+    """
+    Geocode an address to (lat, lng), or (None, None) if it cannot be found.
+
+    Lookups go through an in-process LRU and then the GeocodeResult table,
+    both keyed by the normalized address, before calling the Geocoding API.
+    Addresses with no results are cached for GEOCODE_NEGATIVE_TTL_SECONDS so
+    bad input does not keep hitting the API; transient errors are not cached.
+    """
     if not address or not address.strip():
        raise ValueError("Address cannot be empty")
-    params = {
-        "address": address,
-        "key": api_key
-    }
+    address_key = normalize_address(address)
+    cache_key = geocode_cache.key(hashlib.sha1(address_key.encode()).hexdigest())
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, timeout=5) as response:
-                data = await response.json()
+    cached = await geocode_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-                if data['status'] == 'OK' and data['results']:
-                    location = data['results'][0]['geometry']['location']
-                    return location['lat'], location['lng']
-                else:
-                    return None, None
-    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        print(f"Geocode error: {e}")
-        return None, None
+    async def fetch():
+        stored = await _get_stored_geocode(address_key)
+        if stored is not None:
+            coordinates, expires_at = stored
+            ttl = None
+            if coordinates == (None, None):
+                # A stored miss must expire with its row, not live for the positive TTL.
+                ttl = max(1, int((expires_at - timezone.now()).total_seconds()))
+            await geocode_cache.set(cache_key, coordinates, ttl=ttl)
+            return coordinates
 
+        coordinates, cacheable = await _fetch_coordinates(address, api_key)
+        if cacheable:
+            negative = coordinates == (None, None)
+            ttl = getattr(settings, 'GEOCODE_NEGATIVE_TTL_SECONDS', 3600) if negative else None
+            await geocode_cache.set(cache_key, coordinates, ttl=ttl)
+            await _store_geocode(address_key, address, coordinates, ttl or getattr(settings, 'GEOCODE_DB_TTL_SECONDS', 90 * 86400))
+        return coordinates
 
-def reverse_geocode(lat, lng, api_key=os.getenv("GOOGLE_MAPS_API_KEY")):
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
+    return await maps_single_flight.do(cache_key, fetch)
+
+
+@database_sync_to_async
+def _get_stored_geocode(address_key):
+    result = (
+        GeocodeResult.objects
+        .filter(address_key=address_key, expires_at__gt=timezone.now())
+        .values_list("latitude", "longitude", "expires_at")
+        .first()
+    )
+    return (tuple(result[:2]), result[2]) if result else None
+
+
+@database_sync_to_async
+def _store_geocode(address_key, address, coordinates, ttl):
+    GeocodeResult.objects.update_or_create(
+        address_key=address_key,
+        defaults={
+            "address": address,
+            "latitude": coordinates[0],
+            "longitude": coordinates[1],
+            "expires_at": timezone.now() + datetime.timedelta(seconds=ttl),
+        },
+    )
+
+
+async def _fetch_coordinates(address, api_key):
+    """
+    Call the Geocoding API. Returns ((lat, lng), cacheable); "no results"
+    answers are cacheable, network errors and quota errors are not.
+    """
+    url = maps_url("geocode")
     params = {
-        "latlng": f"{lat},{lng}",
+        "address": address,
         "key": api_key
     }
-    response = requests.get(url, params=params)
-    data = response.json()
 
-    if data['status'] == 'OK':
-        return data['results'][0]['formatted_address']
+    data = await maps_get_json(url, params=params)
+    if not data:
+        return (None, None), False
+
+    if data['status'] == 'OK' and data['results']:
+        location = data['results'][0]['geometry']['location']
+        return (location['lat'], location['lng']), True
     else:
-        return None
\ No newline at end of file
+        return (None, None), data['status'] == 'ZERO_RESULTS'
+
+
+async def areverse_geocode(lat, lng, api_key=os.getenv("GOOGLE_MAPS_API_KEY"), session=None):
+    """
+    Formatted address for a coordinate, or None. Results are cached with the
+    coordinate snapped to MAPS_CACHES['reverse_geocodes'] GRID_METERS, and
+    requests go through the shared Maps session unless `session` is given.
+    """
+    cache_key = reverse_geocode_cache.point_key((lat, lng))
+    cached = await reverse_geocode_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    async def fetch():
+        url = maps_url("geocode")
+        params = {
+            "latlng": f"{lat},{lng}",
+            "key": api_key
+        }
+        data = await maps_get_json(url, params=params, session=session)
+        if data and data['status'] == 'OK' and data['results']:
+            address = data['results'][0]['formatted_address']
+            await reverse_geocode_cache.set(cache_key, address)
+            return address
+        return None
+
+    return await maps_single_flight.do(cache_key, fetch)
+
+
+def reverse_geocode(lat, lng, api_key=os.getenv("GOOGLE_MAPS_API_KEY")):
+    """
+    Sync wrapper around areverse_geocode for views. Under the ASGI server
+    async_to_sync runs it on the server's event loop, so it shares the
+    pooled Maps session.
+    """
+    return async_to_sync(areverse_geocode)(lat, lng, api_key)
@@ -10,6 +10,7 @@ from drf_yasg import openapi
 from .models import Trip
 from .serializers import CheckTripStatusSerializer, DriverRatingSerializer
 from .utils import find_nearest_drivers
+from .location_history import trip_breadcrumbs
 from authentication.models import Driver
 
 load_dotenv()
@@ -34,6 +35,32 @@ class CheckTripStatusView(APIView):
 
         return Response({"trip_status": trip.status}, status=status.HTTP_200_OK)
 
+class TripBreadcrumbsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Get the driver's recorded path for a trip as an encoded polyline.",
+        manual_parameters=[
+            openapi.Parameter('max_points', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description='Thin the trail to at most this many points')
+        ],
+        responses={200: "Breadcrumb trail.", 404: "Trip not found."}
+    )
+    def get(self, request, trip_id):
+        try:
+            trip = Trip.objects.get(id=trip_id)
+        except Trip.DoesNotExist:
+            return Response({"error": "Trip not found."}, status=status.HTTP_404_NOT_FOUND)
+        if request.user.id not in (trip.user_id, trip.driver_id):
+            return Response({"error": "Trip not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            max_points = int(request.query_params.get("max_points", 0)) or None
+        except ValueError:
+            return Response({"error": "max_points must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(trip_breadcrumbs(trip, max_points=max_points), status=status.HTTP_200_OK)
+
 class SetDriverOnlineStatus(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -68,7 +95,7 @@ class SetDriverOnlineStatus(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
         driver.is_online = is_online
-        driver.save()
+        driver.save_fields("is_online")
 
         return Response({"message": f"Driver is now {'online' if is_online else 'offline'}."}, status=status.HTTP_200_OK)
 